@@ -14,6 +14,16 @@ run or not.  The success_error_folder is first deleted to remove any files
 from previous runs of the script, then a success or error file is written
 to disk.
 
+NOTE: Before downloading, this script checks if the layer has changed since
+the last time ALL the scripts ran successfully (see DA_Layer_Signature.py).
+If it hasn't, nothing is downloaded and a NO_CHANGES file is written to the
+success_error_folder along with the success file.  The other scripts look for
+the NO_CHANGES file and skip their work.
+
+NOTE: Every downloaded page is saved to a checkpoint folder in the data
+folder as soon as it is downloaded.  If the download fails part way, the next
+run only downloads the pages that are missing (see Get_AGOL_Data_All()).
+
 The users set many of the variables in a config file:
     1) Username and Password of an AGOL account that has permission to download
        the data (used to get the token).
@@ -24,6 +34,22 @@ The users set many of the variables in a config file:
     5) Feature Service index
     6) FGDB name
     7) FC name
+    8) OPTIONAL: Number of pages to download at the same time
+    9) OPTIONAL: Full URL of the Feature Service
+   10) OPTIONAL: Only download the features edited since the last run
+   11) OPTIONAL: Skip the whole series of scripts if the layer hasn't changed
+   12) OPTIONAL: Download the pages in the compact PBF format
+   13) OPTIONAL: Number of times a failed page is tried again
+   14) OPTIONAL: Only download the fields the scripts use, plus an allow-list
+   15) OPTIONAL: Spatial reference, datum transformation and precision of
+       the downloaded geometry
+   16) OPTIONAL: Tune the page size to the fastest one for the network
+   17) OPTIONAL: How many old snapshots to keep, and how often to compact
+       the FGDB
+   18) OPTIONAL: Record the responses from AGOL, or replay them without the
+       network (used by all the scripts)
+   19) OPTIONAL: Other Feature Services (i.e. other fires) to download at the
+       same time
 
     Format for config file:
 
@@ -42,10 +68,112 @@ The users set many of the variables in a config file:
         # Index of the layer in the Feature Service on AGOL that you want to download
         FS_index =
 
+        # OPTIONAL. Number of pages to download at the same time (default 1)
+        Num_Workers = 4
+
+        # OPTIONAL. Full URL of the Feature Service (up to '/FeatureServer').
+        # Only needed to download from somewhere other than the CoSD AGOL
+        # server, i.e. a local stand-in FeatureServer for testing.
+        FS_url =
+
+        # OPTIONAL. Only download the features edited since the last run and
+        # merge them into the last snapshot (default False).  The layer must
+        # have editor tracking on.
+        Incremental = True
+
+        # OPTIONAL. Download the whole layer if the last full download is
+        # older than this many hours (default 24).  Only used if Incremental.
+        Full_Refresh_Hours = 24
+
+        # OPTIONAL. Don't download (or process, publish or download the
+        # attachments of) the layer if it hasn't changed since the last
+        # successful run of all the scripts (default True).
+        Skip_If_Unchanged = True
+
+        # OPTIONAL. Download the pages in the compact protocol buffer (PBF)
+        # format instead of JSON (default False).  Much less data is sent,
+        # which helps on slow connections.  JSON is used if the layer
+        # doesn't support PBF.
+        Use_PBF = True
+
+        # OPTIONAL. Number of times a page that fails (i.e. the server is busy
+        # or times out) is tried again, waiting 2, 4, 8... seconds between
+        # tries (default 3).
+        Max_Retries = 3
+
+        # OPTIONAL. Only download the fields that the scripts use (default
+        # True): the fields in FieldsToCalculate.csv, the fields used by
+        # DA_Process_Fire_Data.py, the fields of the production FC and the
+        # fields in Extra_Fields (see DA_Field_Projection.py).  If False, all
+        # fields are downloaded.
+        Project_Fields = True
+
+        # OPTIONAL. Comma separated list of other fields to always download.
+        Extra_Fields =
+
+        # OPTIONAL. WKID of the spatial reference to download the geometry in
+        # (the server projects it).  Defaults to the spatial reference of
+        # Parcels_All in [Paths] (State Plane VI), so the downloaded FC
+        # doesn't have to be projected every time it is used with the
+        # parcels.  Use 'LAYER' to download in the spatial reference of the
+        # layer (Web Mercator).
+        Out_SR =
+
+        # OPTIONAL. WKID of the datum transformation the server uses to
+        # project to Out_SR (default: none).
+        Datum_Transformation =
+
+        # OPTIONAL. Number of decimal places of the downloaded coordinates
+        # (default: full precision).  2 is 1/100 of a foot in State Plane VI.
+        Geometry_Precision = 2
+
+        # OPTIONAL. Tune the number of features asked for in each page to the
+        # fastest size for the network, measured over the runs (default
+        # True).  If False, every page asks for maxRecordCount features.
+        Adaptive_Page_Size = True
+
+        # OPTIONAL. Old snapshots in the FGDB are deleted after each run (see
+        # Apply_Snapshot_Retention()).  Snapshots with the same data as the
+        # next newer one are always deleted.  Of the rest, the newest
+        # Keep_Last (default 10) are kept, plus the newest of each hour for
+        # Keep_Hourly_Hours (default 24) and the newest of each day for
+        # Keep_Daily_Days (default 30).
+        Keep_Last = 10
+        Keep_Hourly_Hours = 24
+        Keep_Daily_Days = 30
+
+        # OPTIONAL. Compact the FGDB (give back the space of the deleted
+        # snapshots) every this many hours (default 24).
+        Compact_Hours = 24
+
+        # OPTIONAL. Comma separated list of other layers to download at the
+        # same time as FS_name, as <FS_name>/<FS_index> or as the full URL
+        # <FS_url>/<FS_index>.  Each is downloaded into its own FGDB in the
+        # Data folder (i.e. 'DA_Fire_From_AGOL_Holy_Fire_0.gdb') with all the
+        # same options as FS_name (see Download_Services()).  Only FS_name is
+        # processed by the other scripts.
+        Other_Services = Holy_Fire/0, Lilac_Fire/0
+
         [Paths]
         # Root folder for project
         Root_Folder =
 
+        # Production FC (its fields are always downloaded if Project_Fields)
+        Prod_FC_path =
+
+        # PARCELS_ALL FC (the geometry is downloaded in its spatial reference)
+        Parcels_All =
+
+        [HTTP_Cache]
+        # OPTIONAL. OFF, RECORD or REPLAY (default OFF).  RECORD saves every
+        # response from AGOL, REPLAY uses the saved responses instead of AGOL
+        # so a run can be repeated without the network (see DA_HTTP_Cache.py).
+        Mode = OFF
+
+        # OPTIONAL. Folder for the saved responses (default 'HTTP_Cache' in
+        # the folder of the config file).
+        Folder =
+
 Users set some variables in this script:
   Name of this script
   Location of the config file
@@ -59,7 +187,7 @@ Users set some variables in this script:
 # Licence:     <your licence>
 #-------------------------------------------------------------------------------
 
-import arcpy, sys, datetime, os, ConfigParser, time, shutil
+import arcpy, sys, datetime, os, ConfigParser, time, shutil, threading
 arcpy.env.overwriteOutput = True
 
 def main():
@@ -98,6 +226,109 @@ def main():
         # Index of the layer in the FS you want to d/l.  Frequently 0.
         index_of_layer = config.get('Download_Info', 'FS_index')
 
+        # Number of pages to download at the same time.  OPTIONAL, default 1.
+        num_workers = 1
+        if config.has_option('Download_Info', 'Num_Workers'):
+            num_workers = config.getint('Download_Info', 'Num_Workers')
+
+        # Full URL of the Feature Service.  OPTIONAL, only needed to point the
+        #  download at a different server (i.e. a local stand-in FeatureServer
+        #  used for testing).
+        FS_url = ''
+        if config.has_option('Download_Info', 'FS_url'):
+            FS_url = config.get('Download_Info', 'FS_url')
+
+        # Only download the features edited since the last run.  OPTIONAL,
+        #  default False.
+        incremental = False
+        if config.has_option('Download_Info', 'Incremental'):
+            incremental = config.getboolean('Download_Info', 'Incremental')
+
+        # Hours before a full download is done even if Incremental.  OPTIONAL,
+        #  default 24.
+        full_refresh_hours = 24
+        if config.has_option('Download_Info', 'Full_Refresh_Hours'):
+            full_refresh_hours = config.getint('Download_Info', 'Full_Refresh_Hours')
+
+        # Skip everything if the layer hasn't changed.  OPTIONAL, default True.
+        skip_if_unchanged = True
+        if config.has_option('Download_Info', 'Skip_If_Unchanged'):
+            skip_if_unchanged = config.getboolean('Download_Info', 'Skip_If_Unchanged')
+
+        # Download the pages as PBF instead of JSON.  OPTIONAL, default False.
+        use_pbf = False
+        if config.has_option('Download_Info', 'Use_PBF'):
+            use_pbf = config.getboolean('Download_Info', 'Use_PBF')
+
+        # Times a failed page is tried again.  OPTIONAL, default 3.
+        max_retries = 3
+        if config.has_option('Download_Info', 'Max_Retries'):
+            max_retries = config.getint('Download_Info', 'Max_Retries')
+
+        # Only download the fields the scripts use.  OPTIONAL, default True.
+        project_fields = True
+        if config.has_option('Download_Info', 'Project_Fields'):
+            project_fields = config.getboolean('Download_Info', 'Project_Fields')
+
+        # Other fields to always download.  OPTIONAL.
+        extra_fields = []
+        if config.has_option('Download_Info', 'Extra_Fields'):
+            extra_fields = [name.strip() for name in config.get('Download_Info', 'Extra_Fields').split(',') if name.strip() != '']
+
+        # The production FC.  Its fields are always downloaded.
+        prod_FC_path = ''
+        if config.has_option('Paths', 'Prod_FC_path'):
+            prod_FC_path = config.get('Paths', 'Prod_FC_path')
+
+        # Spatial reference to download the geometry in.  OPTIONAL, default
+        #  the spatial reference of PARCELS_ALL.
+        out_sr = ''
+        if config.has_option('Download_Info', 'Out_SR'):
+            out_sr = config.get('Download_Info', 'Out_SR').strip()
+
+        parcels_all = ''
+        if config.has_option('Paths', 'Parcels_All'):
+            parcels_all = config.get('Paths', 'Parcels_All')
+
+        # Datum transformation to project with.  OPTIONAL.
+        datum_transformation = ''
+        if config.has_option('Download_Info', 'Datum_Transformation'):
+            datum_transformation = config.get('Download_Info', 'Datum_Transformation').strip()
+
+        # Tune the page size.  OPTIONAL, default True.
+        adaptive_page_size = True
+        if config.has_option('Download_Info', 'Adaptive_Page_Size'):
+            adaptive_page_size = config.getboolean('Download_Info', 'Adaptive_Page_Size')
+
+        # Decimal places of the coordinates.  OPTIONAL, default full precision.
+        geometry_precision = ''
+        if config.has_option('Download_Info', 'Geometry_Precision'):
+            geometry_precision = config.get('Download_Info', 'Geometry_Precision').strip()
+
+        # Snapshots to keep.  OPTIONAL, default the newest 10, the newest of
+        #  each hour for 24 hours and the newest of each day for 30 days.
+        keep_last = 10
+        if config.has_option('Download_Info', 'Keep_Last'):
+            keep_last = config.getint('Download_Info', 'Keep_Last')
+
+        keep_hourly_hours = 24
+        if config.has_option('Download_Info', 'Keep_Hourly_Hours'):
+            keep_hourly_hours = config.getint('Download_Info', 'Keep_Hourly_Hours')
+
+        keep_daily_days = 30
+        if config.has_option('Download_Info', 'Keep_Daily_Days'):
+            keep_daily_days = config.getint('Download_Info', 'Keep_Daily_Days')
+
+        # Hours between compacting the FGDB.  OPTIONAL, default 24.
+        compact_hours = 24
+        if config.has_option('Download_Info', 'Compact_Hours'):
+            compact_hours = config.getint('Download_Info', 'Compact_Hours')
+
+        # Other layers to download at the same time.  OPTIONAL.
+        other_services = []
+        if config.has_option('Download_Info', 'Other_Services'):
+            other_services = Parse_Services(config.get('Download_Info', 'Other_Services'))
+
         # Set root folder
         root_folder    = config.get('Paths', 'Root_Folder')
 
@@ -106,12 +337,38 @@ def main():
         FGDB_name   = 'DA_Fire_From_AGOL.gdb'
         FC_name     = 'DA_Fire_from_AGOL'
 
+        # The last downloaded snapshot, used for an incremental download
+        delta_state_file = None
+        if incremental:
+            delta_state_file = '{}\DA_Fire_From_AGOL_Delta.json'.format(data_folder)
+
+        # The pages downloaded so far, so a failed download can be resumed
+        checkpoint_folder = '{}\DA_Fire_From_AGOL_Checkpoint'.format(data_folder)
+
+        # How fast each page size was, used to tune the page size
+        page_size_tuning_file = None
+        if adaptive_page_size:
+            page_size_tuning_file = '{}\DA_Fire_Page_Size_Tuning.json'.format(data_folder)
+
+        # The signature of the layer from the last successful run of all the
+        #  scripts, and the signature from this run (made the last successful
+        #  one by DA_Download_Fire_Attachments.py)
+        signature_file         = '{}\DA_Fire_Layer_Signature.json'.format(data_folder)
+        pending_signature_file = '{}\DA_Fire_Layer_Signature_Pending.json'.format(data_folder)
+
         # Set the log file path
         log_file_folder = '{}\Scripts\Logs'.format(root_folder)
         log_file = r'{}\{}'.format(log_file_folder, name_of_script.split('.')[0])
 
         # Set the path to the success/fail files
         success_error_folder = '{}\Scripts\Source_Code\Control_Files\Success_Error'.format(root_folder)
+        no_changes_file = 'NO_CHANGES_DA_Download_Fire_Data.txt'
+
+        # The Control CSV with the fields DA_Process_Fire_Data.py calculates
+        calc_fields_csv = '{}\Scripts\Source_Code\Control_Files\FieldsToCalculate.csv'.format(root_folder)
+
+        # The field names of the production FC saved by Get_AGOL_Fields()
+        prod_fields_file = '{}\DA_Prod_FC_Fields.json'.format(data_folder)
 
     except Exception as e:
         print '*** ERROR! There was a problem setting variables from the config file'
@@ -127,9 +384,13 @@ def main():
     #---------------------------------------------------------------------------
     #                Set Variables that will probably not change
 
-    # We will get all the fields
+    # We will get all the fields, unless Project_Fields (see Get_AGOL_Fields())
     AGOL_fields = '*'
 
+    # The geometry comes back as the layer has it, unless changed by
+    #  Get_Geometry_Params()
+    geometry_params = {}
+
     # Flag to control if there is an error
     success = True
 
@@ -152,6 +413,16 @@ def main():
             print '*** ERROR with Write_Print_To_Log() ***'
             print str(e)
 
+    # Record or replay the responses from AGOL (see DA_HTTP_Cache.py)
+    if success == True:
+        try:
+            import DA_HTTP_Cache
+            DA_HTTP_Cache.Configure_From_Config(cfgFile)
+        except Exception as e:
+            success = False
+            print '*** ERROR with DA_HTTP_Cache.Configure_From_Config() ***'
+            print str(e)
+
     #---------------------------------------------------------------------------
     #                         Check Folder Schema.
     #          Confirm all folders/files needed in this script exist
@@ -175,28 +446,157 @@ def main():
             print '*** ERROR with Get_Token() ***'
             print str(e)
 
+    # Set the full FS URL. "1vIhDJwtG5eNmiqX" is the CoSD portal server so it shouldn't change much.
+    if FS_url == '':
+        FS_url  = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/arcgis/rest/services/{}/FeatureServer'.format(FS_name)
+
     #---------------------------------------------------------------------------
-    # Download the data
+    # Check if the layer has changed since the last successful run
+    no_changes = False
     if success == True:
+        try:
+            no_changes = Check_Layer_Unchanged(token, FS_url, index_of_layer, signature_file,
+                                               pending_signature_file, skip_if_unchanged)
+        except Exception as e:
+            # Not a reason to stop, just download the layer
+            print '*** WARNING with Check_Layer_Unchanged(), downloading the layer anyway ***'
+            print str(e)
 
-        # Set the full FS URL. "1vIhDJwtG5eNmiqX" is the CoSD portal server so it shouldn't change much.
-        FS_url  = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/arcgis/rest/services/{}/FeatureServer'.format(FS_name)
+    #---------------------------------------------------------------------------
+    # Work out which fields the scripts use
+    prod_fields = None
+    if success == True and project_fields == True and (no_changes == False or len(other_services) > 0):
+        try:
+            prod_fields = Get_Prod_Fields(prod_FC_path, prod_fields_file)
+        except Exception as e:
+            # Not a reason to stop, just download all the fields
+            print '*** WARNING with Get_Prod_Fields(), downloading all the fields ***'
+            print str(e)
 
-        # Set the name of the FC we want to create in our FGDB w/ Date and Time
+    if success == True and no_changes == False and project_fields == True:
+        try:
+            AGOL_fields = Get_AGOL_Fields(token, FS_url, index_of_layer, calc_fields_csv, prod_fields, extra_fields)
+        except Exception as e:
+            # Not a reason to stop, just download all the fields
+            print '*** WARNING with Get_AGOL_Fields(), downloading all the fields ***'
+            print str(e)
+            AGOL_fields = '*'
+    elif success == True and no_changes == False:
+        print 'Project_Fields is False in the config file, downloading all the fields\n'
+
+    #---------------------------------------------------------------------------
+    # Work out the spatial reference and precision to download the geometry in
+    if success == True and no_changes == False:
+        try:
+            geometry_params = Get_Geometry_Params(out_sr, parcels_all, datum_transformation, geometry_precision)
+        except Exception as e:
+            # Not a reason to stop, just download the geometry as the layer has it
+            print '*** WARNING with Get_Geometry_Params(), downloading the geometry as the layer has it ***'
+            print str(e)
+            geometry_params = {}
+
+    #---------------------------------------------------------------------------
+    # Make the FGDBs of the other layers (other fires), if any.  Checking if
+    #  they changed and working out their fields is done by each layer's own
+    #  thread in Download_Services().  An error with one of them is reported,
+    #  but doesn't stop this script.
+    other_downloads = []
+    other_failures  = []
+    if success == True:
+        for service in other_services:
+            try:
+                download = Get_Service_Files(data_folder, service, incremental, adaptive_page_size)
+                download['prepare'] = True
+
+                if not os.path.exists(data_folder + '\\' + download['FGDB_name']):
+                    print 'NOTICE, FGDB for [{}] does not exist, creating it now\n'.format(service['name'])
+                    arcpy.CreateFileGDB_management(data_folder, download['FGDB_name'], 'CURRENT')
+
+                other_downloads.append(download)
+
+            except Exception as e:
+                print '*** ERROR getting ready to download [{}] ***'.format(service['name'])
+                print str(e)
+                other_failures.append(service['name'])
+
+    prepare_settings = {'skip_if_unchanged' : skip_if_unchanged,
+                        'project_fields'    : project_fields,
+                        'calc_fields_csv'   : calc_fields_csv,
+                        'prod_fields'       : prod_fields,
+                        'extra_fields'      : extra_fields}
+
+    #---------------------------------------------------------------------------
+    # Set the name of the FC we want to create in our FGDB w/ Date and Time
+    if success == True and (no_changes == False or len(other_downloads) > 0):
         try:
             dt_to_append = Get_DT_To_Append()
             FC_name_date = FC_name + '_' + dt_to_append
         except Exception as e:
+            success = False
             print '*** ERROR with Get_DT_To_Append() ***'
             print str(e)
 
+    #---------------------------------------------------------------------------
+    # Download the data
+    if success == True and (no_changes == False or len(other_downloads) > 0):
+
+        # The layer of FS_name (if it changed) and the other layers are
+        #  downloaded at the same time
+        downloads = []
+        if no_changes == False:
+            downloads.append({'name'                  : FS_name,
+                              'FS_url'                : FS_url,
+                              'index'                 : index_of_layer,
+                              'FGDB_name'             : FGDB_name,
+                              'AGOL_fields'           : AGOL_fields,
+                              'delta_state_file'      : delta_state_file,
+                              'checkpoint_folder'     : checkpoint_folder,
+                              'page_size_tuning_file' : page_size_tuning_file})
+        downloads += other_downloads
+
         # Download the data
         try:
-            Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, FGDB_name, FC_name_date)
+            errors = Download_Services(downloads, token, data_folder, FC_name_date, num_workers, full_refresh_hours,
+                                       use_pbf, max_retries, geometry_params, prepare_settings)
         except Exception as e:
-            success = False
-            print '*** ERROR with Get_AGOL_Data_All() ***'
-            print str(e)
+            errors = [str(e)] * len(downloads)
+
+        for download, error in zip(downloads, errors):
+            if download in other_downloads:
+                if error == None and not download.get('unchanged'):
+                    # Nothing else is done with the other layers, so the
+                    #  signature of this run is the last successful one now
+                    import DA_Layer_Signature
+                    DA_Layer_Signature.Commit_Pending_Signature(download['pending_signature_file'], download['signature_file'])
+                elif error != None:
+                    other_failures.append(download['name'])
+
+            elif error != None:
+                success = False
+                print '*** ERROR with Get_AGOL_Data_All() ***'
+                print error
+
+    #---------------------------------------------------------------------------
+    # Delete the old snapshots and compact the FGDB(s)
+    if success == True:
+        FGDB_names = [FGDB_name]
+        for service in other_services:
+            if service['name'] not in other_failures:
+                FGDB_names.append(Get_Service_Files(data_folder, service, incremental, adaptive_page_size)['FGDB_name'])
+
+        for retention_FGDB_name in FGDB_names:
+            if not os.path.exists(data_folder + '\\' + retention_FGDB_name):
+                continue
+            try:
+                Apply_Snapshot_Retention(data_folder + '\\' + retention_FGDB_name, keep_last, keep_hourly_hours,
+                                         keep_daily_days, compact_hours)
+            except Exception as e:
+                # Not a reason to stop, the snapshots are deleted next run
+                print '*** WARNING with Apply_Snapshot_Retention() ***'
+                print str(e)
+
+    if other_failures:
+        print '\n*** WARNING, these other layers had errors (see above):  {} ***\n'.format(', '.join(other_failures))
 
     #---------------------------------------------------------------------------
     # Write a file to disk to let other scripts know if this script ran
@@ -224,6 +624,12 @@ def main():
         print '\nCreating file:\n  {}\n'.format(file_path)
         open(file_path, 'w')
 
+        # Let the other scripts know there is nothing new to do
+        if success == True and no_changes == True:
+            file_path = '{}\{}'.format(success_error_folder, no_changes_file)
+            print 'Creating file:\n  {}\n'.format(file_path)
+            open(file_path, 'w')
+
     except Exception as e:
         success = False
         print '*** ERROR with Writing a Success or Fail file() ***'
@@ -236,6 +642,11 @@ def main():
         body = """Success<br>
         The Log file is at: {}""".format(log_file_date)
 
+        if other_failures:
+            subj = 'SUCCESS (with errors in other layers) running {}'.format(name_of_script)
+            body += """<br>
+        These other layers had errors: {}""".format(', '.join(other_failures))
+
     else:
         subj = 'ERROR running {}'.format(name_of_script)
         body = """There was an error with this script.<br>
@@ -259,7 +670,10 @@ def main():
     print 'Success = {}'.format(success)
     sys.stdout = orig_stdout
 
-    if success == True:
+    if success == True and no_changes == True:
+        print '\nSUCCESSFULLY ran {}'.format(name_of_script)
+        print 'The layer has not changed since the last run, nothing was downloaded\n'
+    elif success == True:
         print '\nSUCCESSFULLY ran {}'.format(name_of_script)
         print 'Please find downloaded data at:\n  {}\n'.format(data_folder)
     else:
@@ -379,54 +793,346 @@ def Get_Token(cfgFile, gtURL="https://www.arcgis.com/sharing/rest/generateToken"
         online database.
 
     RETURNS:
-      token (str): A long string that acts as an access code to AGOL servers.
-        Used in later functions to gain access to our data.
+      token (DA_AGOL_Token.Token_Provider): Acts as an access code to AGOL
+        servers and can be used anywhere a token string is used.  Used in later
+        functions to gain access to our data.
 
     FUNCTION: Gets a token from AGOL that allows access to the AGOL data.
+      The token is cached (with when it expires) in the local profile of the
+      account running the script, so the other DA scripts (and the next run)
+      reuse it instead of asking AGOL for a new one.  A new token is gotten
+      before the current one expires, so a long download or update doesn't
+      fail half way through.
     """
 
     print '--------------------------------------------------------------------'
     print "Getting Token..."
 
-    import ConfigParser, urllib, urllib2, json
+    import DA_AGOL_Token
 
-    # Get the user name and password from the cfgFile
-    configRMA = ConfigParser.ConfigParser()
-    configRMA.read(cfgFile)
-    usr = configRMA.get("AGOL","usr")
-    pwd = configRMA.get("AGOL","pwd")
+    # Get the user name and password from the cfgFile and get the cached token,
+    #  or a new token from gtURL if there is no cached token that is still good
+    token = DA_AGOL_Token.Get_Token_Provider(cfgFile, gtURL)
+    ##print token  # For testing purposes
 
-    # Create a dictionary of the user name, password, and 2 other keys
-    gtValues = {'username' : usr, 'password' : pwd, 'referer' : 'http://www.arcgis.com', 'f' : 'json' }
+    print "Successfully retrieved token.\n"
 
-    # Encode the dictionary so they are in URL format
-    gtData = urllib.urlencode(gtValues)
+    return token
 
-    # Create a request object with the URL adn the URL formatted dictionary
-    gtRequest = urllib2.Request(gtURL,gtData)
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Check_Layer_Unchanged()
+def Check_Layer_Unchanged(token, FS_url, index_of_layer, signature_file, pending_signature_file,
+                          skip_if_unchanged=True):
+    """
+    PARAMETERS:
+      token (str): The token obtained by Get_Token().
+      FS_url (str): The URL address for the feature service.
+      index_of_layer (int): The index of the layer in the feature service.
+      signature_file (str): Full path to the signature of the layer from the
+        last successful run of all the scripts.
+      pending_signature_file (str): Full path to save the signature of the
+        layer from this run to.
+      skip_if_unchanged {bool}: If False the layer is always treated as
+        changed. OPTIONAL.
 
-    # Store the response to the request
-    gtResponse = urllib2.urlopen(gtRequest)
+    RETURNS:
+      no_changes (bool): True if the layer hasn't changed since the last
+        successful run and nothing needs to be done.
 
-    # Store the response as a json object
-    gtJson = json.load(gtResponse)
+    FUNCTION:
+      To compare the signature of the layer (number of features, checksum of
+      the OBJECTIDs and last edit date, see DA_Layer_Signature.py) with the
+      signature saved by the last successful run.
+
+      If the layer changed, the new signature is saved to the
+      'pending_signature_file'.  It is moved to the 'signature_file' by
+      DA_Download_Fire_Attachments.py once all of the scripts have run
+      successfully.  The signature is taken BEFORE the download, so an edit
+      made during the download is seen as a change by the next run.
+
+      Every edit counts, including the edits of these scripts, so a report
+      a person edited is seen even if these scripts edit it again before the
+      next run.  DA_Process_Fire_Data.py moves the pending signature past
+      its own edits (see DA_Layer_Signature.Record_Pipeline_Edits()).
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Check_Layer_Unchanged()'
 
-    # Store the token from the json object
-    token = gtJson['token']
-    ##print token  # For testing purposes
+    import DA_Layer_Signature
 
-    print "Successfully retrieved token.\n"
+    # Remove any pending signature left by a run that didn't finish
+    if os.path.exists(pending_signature_file):
+        os.remove(pending_signature_file)
 
-    return token
+    signature = DA_Layer_Signature.Get_Layer_Signature(FS_url, index_of_layer, token)
+    print '  Signature of the layer now:'
+    print '    Count: {}  OBJECTID checksum: {}  Last edit date: {}'.format(
+                signature['count'], signature['oid_checksum'], signature['last_edit_date'])
+
+    last_signature = DA_Layer_Signature.Read_Signature(signature_file)
+    if last_signature != None:
+        print '  Signature of the layer at the last successful run:'
+        print '    Count: {}  OBJECTID checksum: {}  Last edit date: {}'.format(
+                    last_signature.get('count'), last_signature.get('oid_checksum'), last_signature.get('last_edit_date'))
+
+    no_changes = DA_Layer_Signature.Signatures_Match(signature, last_signature)
+
+    if no_changes == True and skip_if_unchanged == True:
+        print '\n  The layer has NOT changed since the last successful run.'
+        print '  Nothing will be downloaded, processed or published.'
+
+    else:
+        if no_changes == True:
+            print '\n  The layer has not changed, but Skip_If_Unchanged is False so it will be downloaded'
+            no_changes = False
+        else:
+            print '\n  The layer has changed since the last successful run (or there was no last run)'
+
+        print '  Saving the signature to:\n    {}'.format(pending_signature_file)
+        DA_Layer_Signature.Write_Signature(pending_signature_file, signature)
+
+    print 'Finished Check_Layer_Unchanged()\n'
+
+    return no_changes
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Parse_Services()
+def Parse_Services(services_str):
+    """
+    PARAMETERS:
+      services_str (str): The Other_Services from the config file, a comma
+        separated list of <FS_name>/<FS_index> or <FS_url>/<FS_index>, i.e.
+        'Holy_Fire/0, https://services1.arcgis.com/.../Lilac_Fire/FeatureServer/0'
+
+    RETURNS:
+      services (list of dict): {'name': .., 'FS_url': .., 'index': ..} for
+        each layer.  'name' is the name of the Feature Service.
+    """
+
+    services = []
+
+    for entry in services_str.split(','):
+        entry = entry.strip().rstrip('/')
+        if entry == '':
+            continue
+
+        if '/' not in entry or not entry.rsplit('/', 1)[1].isdigit():
+            raise ValueError('"{}" in Other_Services is not <FS_name>/<FS_index> or <FS_url>/<FS_index>'.format(entry))
+
+        service, index = entry.rsplit('/', 1)
+        if '://' in service:
+            FS_url = service
+            name   = service.split('/')[-2]
+        else:
+            name   = service
+            FS_url = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/arcgis/rest/services/{}/FeatureServer'.format(service)
+
+        services.append({'name': name, 'FS_url': FS_url, 'index': index})
+
+    return services
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Service_Files()
+def Get_Service_Files(data_folder, service, incremental=False, adaptive_page_size=True):
+    """
+    PARAMETERS:
+      data_folder (str): Full path to the Data folder.
+      service (dict): A layer from Parse_Services().
+      incremental {bool}: If the layer is downloaded incrementally. OPTIONAL.
+      adaptive_page_size {bool}: If the page size is tuned. OPTIONAL.
+
+    RETURNS:
+      download (dict): The 'service' with the FGDB and the files the
+        download of the layer uses.  They are named like the files of
+        FS_name, with '_<name>_<index>' added, so every layer has its own
+        snapshots, delta state, checkpoint, page size tuning and signature.
+    """
+
+    import re
+
+    suffix = re.sub(r'\W', '_', '{}_{}'.format(service['name'], service['index']))
+
+    download = dict(service)
+    download.update({
+        'FGDB_name'              : 'DA_Fire_From_AGOL_{}.gdb'.format(suffix),
+        'delta_state_file'       : None,
+        'checkpoint_folder'      : '{}\DA_Fire_From_AGOL_{}_Checkpoint'.format(data_folder, suffix),
+        'page_size_tuning_file'  : None,
+        'signature_file'         : '{}\DA_Fire_Layer_Signature_{}.json'.format(data_folder, suffix),
+        'pending_signature_file' : '{}\DA_Fire_Layer_Signature_{}_Pending.json'.format(data_folder, suffix)})
+
+    if incremental:
+        download['delta_state_file'] = '{}\DA_Fire_From_AGOL_{}_Delta.json'.format(data_folder, suffix)
+
+    if adaptive_page_size:
+        download['page_size_tuning_file'] = '{}\DA_Fire_Page_Size_Tuning_{}.json'.format(data_folder, suffix)
+
+    return download
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Get_AGOL_Fields()
+def Get_AGOL_Fields(token, FS_url, index_of_layer, calc_fields_csv, prod_fields, extra_fields):
+    """
+    PARAMETERS:
+      token (str): The token obtained by Get_Token().
+      FS_url (str): The URL of the Feature Service (up to '/FeatureServer').
+      index_of_layer (int): The index of the layer in the Feature Service.
+      calc_fields_csv (str): Full path to 'FieldsToCalculate.csv'.
+      prod_fields (list of str): The field names of the production FC from
+        Get_Prod_Fields(), or None if they aren't known.
+      extra_fields (list of str): Other fields to always download.
+
+    RETURNS:
+      AGOL_fields (str): The outFields to download, i.e. 'OBJECTID,Quantity,...'
+        or '*' to download all fields.
+
+    FUNCTION:
+      To only download the fields of the layer that the scripts use (see
+      DA_Field_Projection.py), instead of every field.  If the fields of the
+      production FC aren't known, all fields are downloaded, since there is
+      no way to tell which fields it needs.
+
+      It doesn't use arcpy, so the layers in Download_Services() can call it
+      at the same time.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Get_AGOL_Fields()'
+
+    import DA_AGOL_Download
+    import DA_Field_Projection
+
+    if prod_fields == None:
+        print '  The fields of the production FC aren\'t known, downloading all fields'
+        print 'Finished Get_AGOL_Fields()\n'
+        return '*'
+
+    if not os.path.exists(calc_fields_csv):
+        print '  * WARNING, the Control CSV can\'t be found at:\n    {}'.format(calc_fields_csv)
+        calc_fields_csv = None
+
+    layer_info = DA_AGOL_Download.Get_Layer_Info(FS_url, index_of_layer, token)
+
+    AGOL_fields = DA_Field_Projection.Build_Out_Fields(layer_info, calc_fields_csv, prod_fields, extra_fields)
+
+    print 'Finished Get_AGOL_Fields()\n'
+
+    return AGOL_fields
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Get_Prod_Fields()
+def Get_Prod_Fields(prod_FC_path, prod_fields_file):
+    """
+    PARAMETERS:
+      prod_FC_path (str): Full path to the production FC, or ''.
+      prod_fields_file (str): Full path to the .json file with the field
+        names of the production FC saved by the last run that could read it.
+
+    RETURNS:
+      prod_fields (list of str): The field names of the production FC, or
+        None if they aren't known.
+
+    FUNCTION:
+      To get the field names of the production FC for Get_AGOL_Fields(), and
+      save them.  If the production FC can't be found, the field names saved
+      by the last run that could read it are used.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Get_Prod_Fields()'
+
+    import DA_Field_Projection
+
+    if prod_FC_path != '' and arcpy.Exists(prod_FC_path):
+        prod_fields = [field.name for field in arcpy.ListFields(prod_FC_path)]
+        DA_Field_Projection.Write_Prod_Fields(prod_fields_file, prod_FC_path, prod_fields)
+
+    else:
+        if prod_FC_path == '':
+            print '  * WARNING, there is no [Paths] Prod_FC_path in the config file'
+        else:
+            print '  * WARNING, the production FC can\'t be found at:\n    "{}"'.format(prod_FC_path)
+
+        saved = DA_Field_Projection.Read_Prod_Fields(prod_fields_file)
+        if saved == None:
+            print '  * WARNING, FIELD PROJECTION IS OFF:  the fields of the production FC aren\'t known, so'
+            print '    all fields are downloaded.  Set [Paths] Prod_FC_path to a production FC that can be'
+            print '    read (its field names are then saved to "{}")'.format(prod_fields_file)
+            print 'Finished Get_Prod_Fields()\n'
+            return None
+
+        prod_fields = saved['fields']
+        print '  Using the {} field names of the production FC saved on {} from:\n    "{}"'.format(
+                    len(prod_fields), time.strftime('%Y-%m-%d %H:%M', time.localtime(saved['saved'])),
+                    saved['prod_FC_path'])
+
+    print 'Finished Get_Prod_Fields()\n'
+
+    return prod_fields
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Geometry_Params()
+def Get_Geometry_Params(out_sr, parcels_all, datum_transformation, geometry_precision):
+    """
+    PARAMETERS:
+      out_sr (str): The WKID from the config file, '' to use the spatial
+        reference of 'parcels_all', or 'LAYER' to use the spatial reference of
+        the layer.
+      parcels_all (str): Full path to the PARCELS_ALL FC, or ''.
+      datum_transformation (str): The WKID of the datum transformation, or ''.
+      geometry_precision (str): The number of decimal places, or ''.
+
+    RETURNS:
+      geometry_params (dict): The geometry query parameters to download with
+        (see DA_AGOL_Download.Get_Geometry_Params()).
+
+    FUNCTION:
+      To have the server project the geometry to the spatial reference of the
+      parcels (State Plane VI) and round the coordinates, so the downloaded FC
+      doesn't have to be projected every time DA_Process_Fire_Data.py uses it
+      with the parcels, and every page is smaller.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Get_Geometry_Params()'
+
+    import DA_AGOL_Download
+
+    if out_sr.upper() == 'LAYER':
+        out_sr = ''
+
+    elif out_sr == '' and parcels_all != '':
+        if arcpy.Exists(parcels_all):
+            spatial_reference = arcpy.Describe(parcels_all).spatialReference
+            if spatial_reference.factoryCode > 0:
+                out_sr = spatial_reference.factoryCode
+                print '  Using the spatial reference of PARCELS_ALL: {} ({})'.format(spatial_reference.name, out_sr)
+            else:
+                print '  * WARNING, the spatial reference of PARCELS_ALL has no WKID, downloading in the spatial reference of the layer'
+        else:
+            print '  * WARNING, PARCELS_ALL can\'t be found at:\n    {}'.format(parcels_all)
+            print '  Downloading in the spatial reference of the layer'
+
+    geometry_params = DA_AGOL_Download.Get_Geometry_Params(out_sr, geometry_precision, datum_transformation)
+    print '  Geometry query parameters: {}'.format(geometry_params)
+
+    print 'Finished Get_Geometry_Params()\n'
+
+    return geometry_params
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #                             FUNCTION Get_AGOL_Data_All()
-def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, wkg_FGDB, FC_name):
+def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, wkg_FGDB, FC_name, num_workers=1,
+                      delta_state_file=None, full_refresh_hours=24, use_pbf=False, checkpoint_folder=None,
+                      max_retries=3, geometry_params=None, page_size_tuning_file=None):
     """
     PARAMETERS:
       AGOL_fields (str) = The fields we want to have the server return from our query.
-        use the string ('*') to return all fields.
+        use the string ('*') to return all fields.  See Get_AGOL_Fields().
       token (str) = The token obtained by the Get_Token() which gives access to
         AGOL databases that we have permission to access.
       FS_url (str) = The URL address for the feature service.
@@ -439,6 +1145,30 @@ def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, w
       FC_name (str) = The name of the FC that will be created to hold the data
         downloaded by this function.  This FC gets overwritten every time the
         script is run.
+      num_workers {int} = The most pages that will be downloaded at the same
+        time.  OPTIONAL.  The default of 1 downloads one page at a time.
+      delta_state_file {str} = Full path to the .json file that holds the
+        last downloaded snapshot.  OPTIONAL.  If given, only the features
+        edited since the last run are downloaded and merged into the last
+        snapshot (see 'DELTA DOWNLOAD' below), and the file is updated.
+        If not given, the whole layer is downloaded every time.
+      full_refresh_hours {int} = Download the whole layer (instead of a delta)
+        if the last full download is older than this.  OPTIONAL.
+      use_pbf {bool} = Download the pages in the compact protocol buffer
+        format (if the layer supports it) instead of JSON.  OPTIONAL.
+      checkpoint_folder {str} = Full path to a folder to save every page to as
+        soon as it is downloaded.  OPTIONAL.  If given, a download that
+        failed part way is resumed (see 'CHECKPOINT' below).
+      max_retries {int} = The number of times a page that fails is tried
+        again.  OPTIONAL.
+      geometry_params {dict} = Query parameters that have the server project
+        and round the geometry, i.e. {'outSR': '2230', 'geometryPrecision': '2'}
+        (see Get_Geometry_Params()).  OPTIONAL.  The FC is made in the
+        spatial reference the server sends.
+      page_size_tuning_file {str} = Full path to the .json file with how fast
+        each page size was.  OPTIONAL.  If given, the page size is tuned
+        (see 'PAGE SIZE' below).  If not, every page asks for
+        maxRecordCount features.
 
     RETURNS:
       None
@@ -447,12 +1177,73 @@ def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, w
       To download ALL data from a layer in a FS on AGOL, using OBJECTIDs.
       This function, establishs a connection to the
       data, finds out the number of features, gets the highest and lowest OBJECTIDs,
-      and the maxRecordCount returned by the server, and then loops through the
-      AGOL data and downloads it to the FGDB.  The first time the data is d/l by
-      the script it will create a FC.  Any subsequent loops will download the
-      next set of data and then append the data to the first FC.  This looping
-      will happen until all the data has been downloaded and appended to the one
-      FC created in the first loop.
+      and the maxRecordCount returned by the server, and then splits the
+      OBJECTIDs into pages of maxRecordCount OBJECTIDs each.  The pages are
+      built from the actual list of OBJECTIDs (not from OBJECTID ranges), so
+      every page is full even when the OBJECTIDs are sparse, and the number
+      of pages is ceil(number of records / maxRecordCount).
+
+      The pages are downloaded by a pool of up to 'num_workers' threads (see
+      DA_AGOL_Download.Download_Pages()) and handed back in OBJECTID order.
+      The latency of each page and the total throughput are printed to the log.
+      If 'use_pbf' is True the pages are downloaded in the compact protocol
+      buffer format and decoded (see DA_PBF_Decoder.py) into the same JSON
+      the server would have sent, so nothing after the download changes.
+
+      Each page is written to one new FC as soon as it is handed back, while
+      the next pages download (see FC_Page_Writer), so there is no per-page
+      copy/append/delete in the FGDB.  If the download fails the partly
+      written FC is deleted.
+
+    DELTA DOWNLOAD:
+      If a 'delta_state_file' is given and the layer has editor tracking on,
+      only the features whose edit date is on or after the newest edit date
+      in the last snapshot (plus any OBJECTID that is new to us) are
+      downloaded.  Deleted features are found by comparing the OBJECTIDs in
+      the layer with the OBJECTIDs in the last snapshot.  The edited features
+      are merged into the last snapshot and the result is written to the new
+      timestamped FC, exactly as if the whole layer had been downloaded.
+      A full download is done instead if there is no usable state, or if the
+      last full download is older than 'full_refresh_hours'.
+
+    PAGE SIZE:
+      The server can send fewer features than the maxRecordCount it
+      advertises.  If it cuts a page short ('exceededTransferLimit') the
+      missing features are downloaded in smaller requests, so nothing is
+      lost (see DA_AGOL_Download.Download_Pages()).
+      If a 'page_size_tuning_file' is given, the page size is chosen from
+      how fast (features per second) each size was in the last runs (see
+      DA_AGOL_Download.Choose_Page_Size()), and this run's speed is saved.
+      The page sizes, cut short pages and speed are printed to the log.
+
+    CHECKPOINT:
+      If a 'checkpoint_folder' is given, every page is saved to it as soon as
+      it is downloaded (see DA_AGOL_Download.Open_Checkpoint()).  If the
+      download fails (after each failed page has been tried again
+      'max_retries' times, waiting longer each time), the pages already
+      downloaded stay in the checkpoint and the next run only downloads the
+      pages that are missing.  If the layer has editor tracking on, the pages
+      with features edited since the checkpoint was started are downloaded
+      again.  The checkpoint is deleted once the FC has been written.
+
+    MANIFEST:
+      Once the FC is written it is added, with its number of features and a
+      hash of the features, to the manifest next to the FGDB (see
+      DA_Snapshot_Manifest.py).  'DA_Process_Fire_Data.py' uses the manifest
+      to find the newest snapshot without listing the FGDB.
+
+    COLUMNAR SNAPSHOT:
+      The features are also written as one NumPy array per field (see
+      DA_Columnar_Snapshot.py), in a folder with the name of the FC in the
+      '<FGDB name>_Columnar' folder, so they can be loaded memory-mapped
+      instead of with a cursor.
+
+    FINGERPRINTS:
+      A fingerprint of every report (see DA_Fingerprints.py) is saved in a
+      .json file with the name of the FC in the '<FGDB name>_Fingerprints'
+      folder, so DA_Fingerprints.Diff_Snapshots() can tell which reports were
+      added, modified and deleted between any two snapshots.  The editor
+      tracking fields are left out of the fingerprints.
 
     NOTE:
       Need to have obtained a token from the Get_Token() function.
@@ -461,7 +1252,10 @@ def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, w
     print '--------------------------------------------------------------------'
     print 'Starting Get_AGOL_Data_All()'
 
-    import urllib2, json, urllib
+    import DA_AGOL_Download
+    import DA_Columnar_Snapshot
+    import DA_Fingerprints
+    import DA_Snapshot_Manifest
 
     # Set URLs
     query_url = FS_url + '/{}/query'.format(index_of_layer)
@@ -472,25 +1266,25 @@ def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, w
 
     # This query returns ALL the OBJECTIDs that are in a FS regardless of the
     #   'max records returned' setting
-    query = "?where=1=1&returnIdsOnly=true&f=json&token={}".format(token)
-    obj_count_URL = query_url + query
-    ##print obj_count_URL  # For testing purposes
-    response = urllib2.urlopen(obj_count_URL)  # Send the query to the web
-    obj_count_json = json.load(response)  # Store the response as a json object
     try:
-        object_ids = obj_count_json['objectIds']
-    except:
+        object_ids = DA_AGOL_Download.Get_Object_Ids(query_url, token)
+    except Exception as e:
         print '*** ERROR! ***'
-        print '  {}'.format(obj_count_json['error']['message'])
+        print '  {}'.format(str(e))
         print '  Is the Feature Service Name correct?'
-        print '  URL: {}'.format(obj_count_URL)
+        print '  URL: {}'.format(query_url)
+        raise
 
     num_object_ids = len(object_ids)
     print '  Number of records in FS layer: {}'.format(num_object_ids)
 
+    if num_object_ids == 0:
+        print '  * WARNING, no data was downloaded. *'
+        print 'Finished Get_AGOL_Data_All()'
+        return
+
     #---------------------------------------------------------------------------
     #                  Get the lowest and highest OBJECTID
-    object_ids.sort()
     lowest_obj_id = object_ids[0]
     highest_obj_id = object_ids[num_object_ids-1]
     print '  The lowest OBJECTID is: {}\n  The highest OBJECTID is: {}'.format(\
@@ -500,82 +1294,180 @@ def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, w
     #               Get the 'maxRecordCount' of the Feature Service
     # 'maxRecordCount' is the number of records the server will return
     # when we make a query on the data.
-    query = '?f=json&token={}'.format(token)
-    max_count_url = FS_url + query
-    ##print max_count_url  # For testing purposes
-    response = urllib2.urlopen(max_count_url)
-    max_record_count_json = json.load(response)
-    max_record_count = max_record_count_json['maxRecordCount']
+    max_record_count = DA_AGOL_Download.Get_Max_Record_Count(FS_url, token)
     print '  The max record count is: {}\n'.format(str(max_record_count))
 
-
     #---------------------------------------------------------------------------
+    #       Decide if only the features edited since the last run are needed
+    layer_info = DA_AGOL_Download.Get_Layer_Info(FS_url, index_of_layer, token)
+    oid_field = layer_info.get('objectIdField', 'OBJECTID')
+
+    # The layer can have a smaller 'maxRecordCount' than the service
+    if layer_info.get('maxRecordCount') and layer_info['maxRecordCount'] < max_record_count:
+        max_record_count = layer_info['maxRecordCount']
+        print '  The max record count of the layer is: {}\n'.format(max_record_count)
+    edit_date_field = (layer_info.get('editFieldsInfo') or {}).get('editDateField')
+
+    # Use PBF if asked for and the layer supports it
+    output_format = 'json'
+    if use_pbf == True:
+        if DA_AGOL_Download.Supports_PBF(layer_info):
+            output_format = 'pbf'
+        else:
+            print '  The layer does not support PBF queries, downloading as JSON'
 
-    # Set the variables needed in the loop below
-    start_OBJECTID = lowest_obj_id  # i.e. 1
-    end_OBJECTID   = lowest_obj_id + max_record_count - 1  # i.e. 1000
-    last_dl_OBJECTID = 0  # The last downloaded OBJECTID
-    first_iteration = True  # Changes to False at the end of the first loop
+    delta_state = None
+    if delta_state_file != None:
+        print '  Checking if a delta download can be done'
+        delta_state = DA_AGOL_Download.Load_Delta_State(delta_state_file, FS_url, index_of_layer, AGOL_fields, full_refresh_hours,
+                                                        geometry_params)
 
-    while last_dl_OBJECTID <= highest_obj_id:
-        where_clause = 'OBJECTID >= {} AND OBJECTID <= {}'.format(start_OBJECTID, end_OBJECTID)
+        if delta_state != None and edit_date_field == None:
+            print '  Not using the delta state because editor tracking is not enabled on the layer'
+            delta_state = None
 
-        # Encode the where_clause so it is readable by URL protocol (ie %27 = ' in URL).
-        # visit http://meyerweb.com/eric/tools/dencoder to test URL encoding.
-        # If you suspect the where clause is causing the problems, uncomment the
-        #   below 'where = "1=1"' clause.
-        ##where_clause = "1=1"  # For testing purposes
-        print '  Getting data where: {}'.format(where_clause)
-        where_encoded = urllib.quote(where_clause)
-        query = "?where={}&outFields={}&returnGeometry=true&f=json&token={}".format(where_encoded, AGOL_fields, token)
-        fsURL = query_url + query
+    if delta_state != None:
+        # Download the features edited since the newest edit in the last
+        # snapshot, plus any feature that is new to us
+        where_clause = DA_AGOL_Download.Build_Edit_Date_Where(edit_date_field, delta_state['last_edit_date'])
+        print '  DELTA download of features where: {}'.format(where_clause)
+        edited_ids = DA_AGOL_Download.Get_Object_Ids(query_url, token, where_clause)
 
-        # Create empty Feature Set object
-        fs = arcpy.FeatureSet()
+        prev_ids = set(feature['attributes'][oid_field] for feature in delta_state['features'])
+        ids_to_download = (set(edited_ids) | (set(object_ids) - prev_ids)) & set(object_ids)
+        ids_to_download = sorted(ids_to_download)
 
-        #---------------------------------------------------------------------------
-        #                 Try to load data into Feature Set object
-        # This try/except is because the fs.load(fsURL) will fail whenever no data
-        # is returned by the query.
-        try:
-            ##print 'fsURL %s' % fsURL  # For testing purposes
-            fs.load(fsURL)
-        except:
-            print '*** ERROR, data not downloaded ***'
+        last_full_download = delta_state['last_full_download']
+
+    else:
+        print '  FULL download of all features'
+        ids_to_download = object_ids
+        last_full_download = time.time()
+
+    print '  Number of records to download: {}\n'.format(len(ids_to_download))
+
+    #---------------------------------------------------------------------------
+    #                           Download the pages
+    checkpoint = None
+    if checkpoint_folder != None:
+        checkpoint = DA_AGOL_Download.Open_Checkpoint(checkpoint_folder)
+
+    # Choose the page size
+    page_size = max_record_count
+    if page_size_tuning_file != None:
+        resume = (checkpoint != None and checkpoint['resumed'] and checkpoint['num_pages'] > 0)
+        page_size = DA_AGOL_Download.Choose_Page_Size(page_size_tuning_file, max_record_count, resume)
+
+        # Save the page size now, so a checkpoint left by this run can be
+        #  resumed with the same batches
+        DA_AGOL_Download.Update_Page_Size_Tuning(page_size_tuning_file, page_size, {})
+
+    batches = DA_AGOL_Download.Build_OID_List_Batches(ids_to_download, page_size)
+
+    # Every page asks for the same spatial reference and precision
+    if geometry_params:
+        batches = [dict(batch, **geometry_params) for batch in batches]
+
+    if checkpoint != None:
+        # Don't resume the pages with features edited since the checkpoint
+        #  was started
+        if checkpoint['resumed'] and checkpoint['num_pages'] > 0 and edit_date_field != None:
+            where_clause = DA_AGOL_Download.Build_Edit_Date_Where(edit_date_field, checkpoint['started'])
+            edited_ids = DA_AGOL_Download.Get_Object_Ids(query_url, token, where_clause)
+            num_dropped = DA_AGOL_Download.Drop_Checkpoint_Pages(checkpoint, query_url, AGOL_fields, batches, edited_ids)
+            print '  {} feature(s) edited since the checkpoint was started, {} page(s) will be downloaded again\n'.format(
+                        len(edited_ids), num_dropped)
+
+    # A full download writes each page to the new FC as soon as it is
+    #  downloaded, a delta download writes the merged snapshot after
+    FC_path = data_folder + "\\" + wkg_FGDB + '\\' + FC_name
+    writer = FC_Page_Writer(FC_path, data_folder, arcpy_lock)
+    page_callback = None
+    if delta_state == None:
+        page_callback = writer.Write_Page
+
+    try:
+        pages, stats = DA_AGOL_Download.Download_Pages(query_url, batches, AGOL_fields, token, num_workers,
+                                                       output_format, layer_info.get('fields'), checkpoint, max_retries,
+                                                       page_callback=page_callback)
+
+        if page_size_tuning_file != None:
+            DA_AGOL_Download.Update_Page_Size_Tuning(page_size_tuning_file, page_size, stats, max_record_count)
 
         #-----------------------------------------------------------------------
-        # Process d/l data
+        #    Merge the edited features into the last snapshot (delta download)
+        if delta_state != None:
+            edited_features = [feature for page_json in pages for feature in page_json.get('features', [])]
+            features, counts = DA_AGOL_Download.Merge_Delta(delta_state['features'], edited_features, object_ids, oid_field)
+            print '  Merged into the last snapshot:  {} added, {} updated, {} deleted, {} unchanged\n'.format(
+                        counts['added'], counts['updated'], counts['deleted'], counts['unchanged'])
+
+            # The merged snapshot is written as one page
+            merged_page = {'objectIdFieldName': delta_state['objectIdFieldName'],
+                           'fields'           : delta_state['fields'],
+                           'geometryType'     : delta_state['geometryType'],
+                           'spatialReference' : delta_state['spatialReference'],
+                           'features'         : features}
+            pages = [merged_page]
+            writer.Write_Page(merged_page)
 
-        if first_iteration == True:  # Then this is the first run and d/l data to the FC_name
-            path = data_folder + "\\" + wkg_FGDB + '\\' + FC_name
-        else:
-            path = data_folder + "\\" + wkg_FGDB + '\\temp_to_append'
+    except:
+        writer.Abort()
+        raise
 
-        #Copy the features to the FGDB.
-        print '    Copying AGOL database features to: %s' % path
-        arcpy.CopyFeatures_management(fs,path)
+    num_written = writer.Close()
 
-        # If this is a subsequent run then append the newly d/l data to the FC_name
-        if first_iteration == False:
-            orig_path = data_folder + "\\" + wkg_FGDB + '\\' + FC_name
-            print '    Appending:\n      {}\n      To:\n      {}'.format(path, orig_path)
-            arcpy.Append_management(path, orig_path, 'NO_TEST')
+    #---------------------------------------------------------------------------
+    #             Add the new snapshot to the manifest of the FGDB
+    if num_written > 0:
+        features = [feature for page_json in pages for feature in page_json.get('features', [])]
+        content_hash = DA_Snapshot_Manifest.Hash_Features(features, oid_field)
+        manifest_path = DA_Snapshot_Manifest.Get_Manifest_Path(data_folder + '\\' + wkg_FGDB)
+        DA_Snapshot_Manifest.Add_Snapshot(manifest_path, FC_path, num_written, content_hash)
+        print '  Added the snapshot to the manifest:\n    {}\n'.format(manifest_path)
 
-            print '    Deleting temp_to_append'
-            arcpy.Delete_management(path)
+    #---------------------------------------------------------------------------
+    #   Write the columnar copy of the snapshot (see DA_Columnar_Snapshot.py)
+    if num_written > 0:
+        try:
+            columnar_folder = DA_Columnar_Snapshot.Get_Columnar_Folder(data_folder + '\\' + wkg_FGDB)
+            snapshot_folder = columnar_folder + '\\' + FC_name
+            DA_Columnar_Snapshot.Write_Columnar_Snapshot(snapshot_folder, pages, oid_field)
+            print '  Wrote the columnar snapshot to:\n    {}\n'.format(snapshot_folder)
+        except Exception as e:
+            # Not a reason to stop, the FC has the data
+            print '  * WARNING, could not write the columnar snapshot:  {}\n'.format(e)
 
-        # Set the last downloaded OBJECTID
-        last_dl_OBJECTID = end_OBJECTID
+    #---------------------------------------------------------------------------
+    #  Save the fingerprints of the reports (see DA_Fingerprints.py)
+    if num_written > 0:
+        try:
+            edit_fields_info = layer_info.get('editFieldsInfo') or {}
+            exclude_fields = [edit_fields_info.get(key) for key in ('creationDateField', 'creatorField',
+                                                                     'editDateField', 'editorField')]
+            fingerprints = DA_Fingerprints.Get_Fingerprints(features, oid_field, exclude_fields)
+            fingerprints_file = DA_Fingerprints.Save_Fingerprints(data_folder + '\\' + wkg_FGDB, FC_name, fingerprints)
+            print '  Saved the fingerprints of {} reports to:\n    {}\n'.format(len(fingerprints), fingerprints_file)
+
+            diff = DA_Fingerprints.Diff_Snapshots(data_folder + '\\' + wkg_FGDB)
+            if diff['old_snapshot'] != None:
+                print '  Since the last snapshot:  {} added, {} modified, {} deleted\n'.format(
+                            len(diff['added']), len(diff['modified']), len(diff['deleted']))
+        except Exception as e:
+            # Not a reason to stop, the next stages process every report
+            print '  * WARNING, could not save the fingerprints:  {}\n'.format(e)
 
-        # Set the starting and ending OBJECTID for the next iteration
-        start_OBJECTID = end_OBJECTID + 1
-        end_OBJECTID   = start_OBJECTID + max_record_count - 1
+    #---------------------------------------------------------------------------
+    #       Save the snapshot so the next run can do a delta download
+    if delta_state_file != None and num_written > 0:
+        Save_Delta_Snapshot(delta_state_file, pages, FS_url, index_of_layer, AGOL_fields,
+                            oid_field, edit_date_field, last_full_download, geometry_params)
 
-        # If we reached this point we have gone through one full iteration
-        first_iteration = False
-        print ''
+    # The download is saved, so the next run starts a new checkpoint
+    if checkpoint_folder != None:
+        DA_AGOL_Download.Remove_Checkpoint(checkpoint_folder)
 
-    if first_iteration == False:
+    if num_written > 0:
         print "  Successfully retrieved data.\n"
     else:
         print '  * WARNING, no data was downloaded. *'
@@ -584,6 +1476,587 @@ def Get_AGOL_Data_All(AGOL_fields, token, FS_url, index_of_layer, data_folder, w
 
     return
 
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Download_Services()
+
+# arcpy is not thread safe, only one download writes to a FGDB at a time
+arcpy_lock = threading.Lock()
+
+def Download_Services(downloads, token, data_folder, FC_name, num_workers=1, full_refresh_hours=24,
+                      use_pbf=False, max_retries=3, geometry_params=None, prepare_settings=None):
+    """
+    PARAMETERS:
+      downloads (list of dict): The layers to download.  Keys:
+        name, FS_url, index, FGDB_name, AGOL_fields, delta_state_file,
+        checkpoint_folder, page_size_tuning_file
+        (see Get_AGOL_Data_All() and Get_Service_Files()).
+        A layer with 'prepare' True is got ready first (see
+        Prepare_Service_Download()), and 'unchanged' is set to True in it if
+        it hasn't changed and wasn't downloaded.
+      token (str): The token obtained by Get_Token().
+      data_folder (str): Full path to the folder with the FGDBs.
+      FC_name (str): The name of the FC to create in each FGDB.
+      num_workers {int}, full_refresh_hours {int}, use_pbf {bool},
+      max_retries {int}, geometry_params {dict}: Used for every layer (see
+        Get_AGOL_Data_All()). OPTIONAL.
+      prepare_settings {dict}: Used to get the layers with 'prepare' ready
+        (see Prepare_Service_Download()). OPTIONAL.
+
+    RETURNS:
+      errors (list of str): For each layer in 'downloads', None if it was
+        downloaded, or the error message.
+
+    FUNCTION:
+      To download all the layers at the same time, each with
+      Get_AGOL_Data_All() in its own thread, so the time it takes is the time
+      of the slowest layer, not the sum of all of them.  Each layer has its
+      own pool of 'num_workers' page workers.  The requests to check if a
+      layer changed and to work out its fields are made in its thread too.
+
+      Every line a layer prints (except the warnings of its page workers) is
+      started with '[<name>]' so the log shows the progress of each layer.
+      An error with one layer doesn't stop the others.  The time and result
+      of each layer is printed at the end.
+
+      The pages are written to the FGDBs one layer at a time (see
+      arcpy_lock): a layer holds the lock from its first page until its FC
+      is written, and the other layers keep downloading in the meantime.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Download_Services()'
+
+    from multiprocessing.pool import ThreadPool
+
+    print '  Downloading {} layer(s) at the same time:'.format(len(downloads))
+    for download in downloads:
+        print '    [{}]  {}/{}'.format(download['name'], download['FS_url'], download['index'])
+    print ''
+
+    output = Service_Output(sys.stdout)
+
+    def Download(download):
+        if len(downloads) > 1:
+            output.Set_Prefix('[{}] '.format(download['name']))
+
+        start_time = time.time()
+        error = None
+        if download.get('prepare'):
+            try:
+                download['unchanged'] = Prepare_Service_Download(download, token, prepare_settings)
+            except Exception as e:
+                error = str(e)
+                print '*** ERROR getting ready to download [{}] ***'.format(download['name'])
+                print error
+
+        if error == None and not download.get('unchanged'):
+            try:
+                Get_AGOL_Data_All(download['AGOL_fields'], token, download['FS_url'], download['index'], data_folder,
+                                  download['FGDB_name'], FC_name, num_workers, download['delta_state_file'],
+                                  full_refresh_hours, use_pbf, download['checkpoint_folder'], max_retries,
+                                  geometry_params, download['page_size_tuning_file'])
+            except Exception as e:
+                error = str(e)
+                print '*** ERROR with Get_AGOL_Data_All() ***'
+                print error
+
+        output.Set_Prefix(None)
+
+        return error, time.time() - start_time
+
+    start_time = time.time()
+    if len(downloads) == 1:
+        results = [Download(downloads[0])]
+
+    else:
+        sys.stdout = output
+        pool = ThreadPool(len(downloads))
+        try:
+            results = pool.map(Download, downloads)
+        finally:
+            pool.close()
+            pool.join()
+            sys.stdout = output.stream
+
+    print '\n  {:<40}{:>10}  {}'.format('Layer', 'Seconds', 'Result')
+    for download, (error, seconds) in zip(downloads, results):
+        if error != None:
+            result = 'ERROR:  ' + error
+        elif download.get('unchanged'):
+            result = 'NOT CHANGED'
+        else:
+            result = 'OK'
+        print '  {:<40}{:>10.1f}  {}'.format(download['name'], seconds, result)
+    print '\n  All layers downloaded in {:.1f} seconds (the sum of the layers is {:.1f} seconds)'.format(
+                time.time() - start_time, sum(seconds for error, seconds in results))
+
+    print 'Finished Download_Services()\n'
+
+    return [error for error, seconds in results]
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                     FUNCTION Prepare_Service_Download()
+def Prepare_Service_Download(download, token, settings):
+    """
+    PARAMETERS:
+      download (dict): A layer from Get_Service_Files().  Its 'AGOL_fields'
+        is set.
+      token (str): The token obtained by Get_Token().
+      settings (dict): 'skip_if_unchanged', 'project_fields',
+        'calc_fields_csv', 'prod_fields' and 'extra_fields' (see main()).
+
+    RETURNS:
+      unchanged (bool): True if the layer hasn't changed since the last
+        successful run, so it isn't downloaded.
+
+    FUNCTION:
+      To get one of the other layers ready to download, in its own thread
+      in Download_Services():  check if it changed (Check_Layer_Unchanged())
+      and work out which of its fields to download (Get_AGOL_Fields()).
+    """
+
+    if Check_Layer_Unchanged(token, download['FS_url'], download['index'], download['signature_file'],
+                             download['pending_signature_file'], settings['skip_if_unchanged']):
+        return True
+
+    download['AGOL_fields'] = '*'
+    if settings['project_fields'] == True:
+        try:
+            download['AGOL_fields'] = Get_AGOL_Fields(token, download['FS_url'], download['index'],
+                                                      settings['calc_fields_csv'], settings['prod_fields'],
+                                                      settings['extra_fields'])
+        except Exception as e:
+            # Not a reason to stop, just download all the fields
+            print '*** WARNING with Get_AGOL_Fields(), downloading all the fields ***'
+            print str(e)
+
+    return False
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           CLASS Service_Output()
+class Service_Output(object):
+    """
+    Used as sys.stdout while Download_Services() runs.  Each thread can set a
+    prefix that is added to the start of every line it prints.  Whole lines
+    are written, so the lines of the layers don't get mixed together.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock   = threading.Lock()
+        self.local  = threading.local()
+
+    def Set_Prefix(self, prefix):
+        """
+        FUNCTION:
+          To set the prefix of the current thread (None for no prefix).  Any
+          part of a line still held for the thread is written first.
+        """
+
+        partial = getattr(self.local, 'partial', '')
+        if partial:
+            with self.lock:
+                self.stream.write('{}{}\n'.format(self.local.prefix, partial))
+
+        self.local.prefix  = prefix
+        self.local.partial = ''
+
+    def write(self, text):
+        prefix = getattr(self.local, 'prefix', None)
+        if prefix == None:
+            with self.lock:
+                self.stream.write(text)
+            return
+
+        lines = (self.local.partial + text).split('\n')
+        self.local.partial = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write(''.join('{}{}\n'.format(prefix, line) for line in lines))
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Save_Delta_Snapshot()
+def Save_Delta_Snapshot(delta_state_file, pages, FS_url, index_of_layer, AGOL_fields,
+                        oid_field, edit_date_field, last_full_download, geometry_params=None):
+    """
+    PARAMETERS:
+      delta_state_file (str): Full path to the .json file to write.
+      pages (list of dict): The pages that were written to the new snapshot FC.
+      FS_url (str), index_of_layer (int), AGOL_fields (str): What was
+        downloaded.
+      oid_field (str): The name of the OBJECTID field of the layer.
+      edit_date_field (str): The name of the editor tracking date field of
+        the layer.  None if editor tracking is not on.
+      last_full_download (float): The time (from time.time()) that the whole
+        layer was last downloaded.
+      geometry_params {dict}: The geometry query parameters the snapshot was
+        downloaded with. OPTIONAL.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To save the snapshot that was just written to the FGDB so the next run
+      of this script can merge a delta download into it.  The newest edit
+      date in the snapshot is saved with it.  This date comes from the AGOL
+      server, so the next delta query doesn't depend on this machine's clock.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Save_Delta_Snapshot()'
+
+    import DA_AGOL_Download
+
+    features = [feature for page_json in pages for feature in page_json.get('features', [])]
+    first_page = pages[0]
+
+    # Find the newest edit date in the snapshot
+    last_edit_date = None
+    if edit_date_field != None:
+        edit_dates = [feature['attributes'].get(edit_date_field) for feature in features]
+        edit_dates = [edit_date for edit_date in edit_dates if edit_date != None]
+        if edit_dates:
+            last_edit_date = max(edit_dates)
+
+    state = {'FS_url'             : FS_url,
+             'index_of_layer'     : index_of_layer,
+             'AGOL_fields'        : AGOL_fields,
+             'geometry_params'    : geometry_params or {},
+             'objectIdFieldName'  : oid_field,
+             'fields'             : first_page['fields'],
+             'geometryType'       : first_page['geometryType'],
+             'spatialReference'   : first_page['spatialReference'],
+             'features'           : features,
+             'last_edit_date'     : last_edit_date,
+             'last_full_download' : last_full_download}
+
+    print '  Saving {} features to:\n    {}'.format(len(features), delta_state_file)
+    DA_AGOL_Download.Save_Delta_State(delta_state_file, state)
+
+    print 'Finished Save_Delta_Snapshot()\n'
+
+    return
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Apply_Snapshot_Retention()
+def Apply_Snapshot_Retention(FGDB_path, keep_last=10, keep_hourly_hours=24, keep_daily_days=30, compact_hours=24):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the snapshots.
+      keep_last {int}: Keep this many of the newest snapshots. OPTIONAL.
+      keep_hourly_hours {int}: Keep the newest snapshot of each hour for this
+        many hours. OPTIONAL.
+      keep_daily_days {int}: Keep the newest snapshot of each day for this
+        many days. OPTIONAL.
+      compact_hours {int}: Compact the FGDB every this many hours. OPTIONAL.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To keep the FGDB from growing without end.  The snapshots that the
+      retention policy doesn't keep (see
+      DA_Snapshot_Manifest.Choose_Snapshots_To_Delete()) are deleted from
+      the FGDB (with their columnar copies and fingerprints) and taken out of the manifest.  A
+      snapshot with the same data as the next newer snapshot is always
+      deleted.
+
+      Every 'compact_hours' the FGDB is listed, so any timestamped snapshot
+      that isn't in the manifest (i.e. made before there was a manifest) is
+      added to it and can be deleted too, and the FGDB is compacted to give
+      back the space of the deleted snapshots.  The FGDB is only listed then,
+      not every run.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Apply_Snapshot_Retention()'
+
+    import DA_Columnar_Snapshot
+    import DA_Fingerprints
+    import DA_Snapshot_Manifest
+
+    manifest_path = DA_Snapshot_Manifest.Get_Manifest_Path(FGDB_path)
+    columnar_folder = DA_Columnar_Snapshot.Get_Columnar_Folder(FGDB_path)
+    fingerprints_folder = DA_Fingerprints.Get_Fingerprints_Folder(FGDB_path)
+    compaction_due = DA_Snapshot_Manifest.Is_Compaction_Due(manifest_path, compact_hours)
+
+    # Add the snapshots that aren't in the manifest
+    if compaction_due:
+        manifest = DA_Snapshot_Manifest.Load_Manifest(manifest_path)
+        arcpy.env.workspace = FGDB_path
+        for FC_name in arcpy.ListFeatureClasses():
+            timestamp = DA_Snapshot_Manifest.Get_Timestamp_From_Name(FC_name)
+            if timestamp != None and timestamp not in manifest['snapshots']:
+                FC_path = '{}\{}'.format(FGDB_path, FC_name)
+                record_count = int(arcpy.GetCount_management(FC_path).getOutput(0))
+                DA_Snapshot_Manifest.Add_Snapshot(manifest_path, FC_path, record_count, None, timestamp)
+                print '  Added to the manifest:  {}'.format(FC_name)
+
+    # Delete the snapshots that aren't kept
+    manifest = DA_Snapshot_Manifest.Load_Manifest(manifest_path)
+    to_delete, collapsed = DA_Snapshot_Manifest.Choose_Snapshots_To_Delete(manifest, keep_last,
+                                                                           keep_hourly_hours, keep_daily_days)
+
+    print '  {} snapshot(s) in the FGDB, deleting {} ({} with the same data as a newer snapshot)'.format(
+                len(manifest['timestamps']), len(to_delete), len(collapsed))
+
+    deleted = []
+    for timestamp in to_delete:
+        FC_path = manifest['snapshots'][timestamp]['path']
+        snapshot_folder = '{}\\{}'.format(columnar_folder, manifest['snapshots'][timestamp]['name'])
+        fingerprints_file = '{}\\{}.json'.format(fingerprints_folder, manifest['snapshots'][timestamp]['name'])
+        try:
+            if arcpy.Exists(FC_path):
+                arcpy.Delete_management(FC_path)
+            if os.path.exists(snapshot_folder):
+                shutil.rmtree(snapshot_folder)
+            if os.path.exists(fingerprints_file):
+                os.remove(fingerprints_file)
+            deleted.append(timestamp)
+        except Exception as e:
+            # i.e. the FC is locked, try again next run
+            print '  * WARNING, could not delete "{}":  {}'.format(FC_path, e)
+
+    if deleted:
+        DA_Snapshot_Manifest.Remove_Snapshots(manifest_path, deleted, collapsed)
+
+    # Give back the space of the deleted snapshots
+    if compaction_due:
+        print '  Compacting:  {}'.format(FGDB_path)
+        arcpy.Compact_management(FGDB_path)
+        DA_Snapshot_Manifest.Set_Compacted(manifest_path)
+
+    print 'Finished Apply_Snapshot_Retention()\n'
+
+    return
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           CLASS FC_Page_Writer()
+class FC_Page_Writer(object):
+    """
+    Writes the downloaded pages to one new FC, one page at a time, with one
+    insert cursor.
+
+    The FC (with the fields and spatial reference of the pages) is created
+    from the first downloaded feature with one JSONToFeatures call.  Every
+    other feature is then decoded straight into the open InsertCursor.  This
+    replaces copying each page to a 'temp_to_append' FC, appending it and
+    deleting it again, which cost three geoprocessing calls and a schema
+    round trip per page.
+
+    Every geometry is made in the spatial reference of the pages, so it is
+    not projected or snapped to a coarser resolution on the way in.
+    GlobalID fields are written as GUID fields so the GlobalIDs from AGOL
+    are kept.  Dates (milliseconds since 1970 in the JSON) are written as UTC
+    datetimes.
+
+    Use:
+        writer = FC_Page_Writer(FC_path, temp_folder, arcpy_lock)
+        try:
+            for page_json in pages:
+                writer.Write_Page(page_json)
+        except:
+            writer.Abort()
+            raise
+        num_written = writer.Close()
+    """
+
+    def __init__(self, FC_path, temp_folder, lock=None):
+        """
+        PARAMETERS:
+          FC_path (str): Full path of the FC to create.  It will be
+            overwritten if it already exists.
+          temp_folder (str): Full path to a folder that can hold a temporary
+            .json file.  The file is deleted once the FC is created.
+          lock {threading.Lock}: Held from the time the FC is created until
+            Close() or Abort(), since arcpy is not thread safe. OPTIONAL.
+        """
+
+        self.FC_path     = FC_path
+        self.temp_folder = temp_folder
+        self.lock        = lock
+
+        self.cursor            = None
+        self.locked            = False
+        self.num_written       = 0
+        self.spatial_reference = None
+
+    #---------------------------------------------------------------------------
+    def Write_Page(self, page_json):
+        """
+        PARAMETERS:
+          page_json (dict): A JSON query response (in esri JSON format).  All
+            pages must come from the same query so they have the same fields,
+            geometry type and spatial reference.
+
+        FUNCTION:
+          To write the features of a page to the FC, creating the FC from the
+          first page that has features.
+        """
+
+        features = page_json.get('features', [])
+        if len(features) == 0:
+            return
+
+        first_feature = None
+        if self.cursor == None:
+            self.Create_FC(page_json)
+            first_feature = features[0]
+
+        for feature in features:
+            # The first feature was written when the FC was created
+            if feature is first_feature:
+                continue
+            self.cursor.insertRow(self.Get_Row(feature))
+            self.num_written += 1
+
+    #---------------------------------------------------------------------------
+    def Create_FC(self, page_json):
+        """
+        FUNCTION:
+          To create the FC from the first feature of 'page_json' and open the
+          insert cursor.
+        """
+
+        import json
+
+        if self.lock != None:
+            self.lock.acquire()
+            self.locked = True
+
+        # Keep the GlobalIDs from AGOL by storing them in a GUID field
+        fields = []
+        for field in page_json['fields']:
+            field = dict(field)
+            if field['type'] == 'esriFieldTypeGlobalID':
+                field['type'] = 'esriFieldTypeGUID'
+            fields.append(field)
+
+        self.spatial_reference = page_json['spatialReference']
+
+        schema_json = {'geometryType'     : page_json['geometryType'],
+                       'spatialReference' : self.spatial_reference,
+                       'fields'           : fields,
+                       'features'         : page_json['features'][:1]}
+
+        schema_json_path = self.temp_folder + '\\temp_schema.json'
+        with open(schema_json_path, 'w') as json_file:
+            json.dump(schema_json, json_file)
+
+        print '  Creating FC at:\n    {}'.format(self.FC_path)
+        arcpy.JSONToFeatures_conversion(schema_json_path, self.FC_path)
+        os.remove(schema_json_path)
+        self.num_written = 1
+
+        # Only insert into the fields that were created in the FC
+        skip_types = ['esriFieldTypeOID', 'esriFieldTypeGeometry', 'esriFieldTypeBlob',
+                      'esriFieldTypeRaster', 'esriFieldTypeXML']
+        FC_field_names = [f.name.lower() for f in arcpy.ListFields(self.FC_path)]
+
+        self.insert_fields = []
+        self.date_fields   = []
+        for field in fields:
+            if field['type'] not in skip_types and field['name'].lower() in FC_field_names:
+                self.insert_fields.append(field['name'])
+                if field['type'] == 'esriFieldTypeDate':
+                    self.date_fields.append(field['name'])
+
+        # Points are written as x/y pairs (in the spatial reference of the
+        #  FC), everything else as a geometry object
+        self.is_point = (page_json['geometryType'] == 'esriGeometryPoint')
+        if self.is_point:
+            shape_token = 'SHAPE@XY'
+        else:
+            shape_token = 'SHAPE@'
+
+        print '  Inserting features'
+        self.cursor = arcpy.da.InsertCursor(self.FC_path, self.insert_fields + [shape_token])
+
+    #---------------------------------------------------------------------------
+    def Get_Row(self, feature):
+        """
+        RETURNS:
+          row (list): The values of the insert fields and the geometry of a
+            feature.
+        """
+
+        epoch = datetime.datetime(1970, 1, 1)
+
+        attributes = feature['attributes']
+        row = []
+        for field_name in self.insert_fields:
+            value = attributes.get(field_name)
+            if value != None and field_name in self.date_fields:
+                value = epoch + datetime.timedelta(milliseconds=value)
+            row.append(value)
+
+        geometry = feature.get('geometry')
+        if geometry == None:
+            row.append(None)
+        elif self.is_point:
+            row.append((geometry.get('x'), geometry.get('y')))
+        else:
+            # AsShape() takes the spatial reference from the JSON
+            geometry = dict(geometry)
+            geometry['spatialReference'] = self.spatial_reference
+            row.append(arcpy.AsShape(geometry, True))
+
+        return row
+
+    #---------------------------------------------------------------------------
+    def Close(self):
+        """
+        RETURNS:
+          num_written (int): The number of features written to the FC.
+
+        FUNCTION:
+          To close the insert cursor and let go of the lock.
+        """
+
+        if self.cursor != None:
+            del self.cursor
+            self.cursor = None
+        self.Release_Lock()
+
+        if self.num_written > 0:
+            print '  Wrote {} features to the FC'.format(self.num_written)
+        else:
+            print '  There were no features to write'
+
+        return self.num_written
+
+    #---------------------------------------------------------------------------
+    def Abort(self):
+        """
+        FUNCTION:
+          To close the insert cursor and delete the partly written FC (i.e.
+          if the download failed part way), then let go of the lock.
+        """
+
+        try:
+            if self.cursor != None:
+                del self.cursor
+                self.cursor = None
+                if arcpy.Exists(self.FC_path):
+                    arcpy.Delete_management(self.FC_path)
+                    print '  Deleted the partly written FC'
+        finally:
+            self.num_written = 0
+            self.Release_Lock()
+
+    #---------------------------------------------------------------------------
+    def Release_Lock(self):
+        if self.locked:
+            self.lock.release()
+            self.locked = False
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #                               Function Email_W_Body()
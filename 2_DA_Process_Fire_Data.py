@@ -23,6 +23,10 @@ Start Calling Functions
      run this script.  The check is performed by looking for a specifically named
      text file found in the success_error_folder.
 
+   If the previous script found that the layer has NOT changed since the last
+     successful run (it writes a NO_CHANGES file to the success_error_folder),
+     all the steps below are skipped, but the success file is still written.
+
 3. Get the path to the most recently downloaded data.
      This is the path of the data that was most recently downloaded from AGOL
      with the 'DA_Download_Fire_Data.py' script.
@@ -36,9 +40,24 @@ Start Calling Functions
      This selects all the parcels that intersect with the DA Reports and exports
      them to their own FC 'Parcel_All_Int_DA_Reports'.
      We do this so that the Parcel and DA Report Join that happens below is MUCH faster.
+     The parcels are selected from a local copy of PARCELS_ALL (the parcel
+     cache) instead of from the SDE, see Refresh_Parcel_Cache().  The cache is
+     only brought up to date with the parcels edited in the SDE since it was
+     last refreshed.
+     Every time the cache changes, a packed, memory-mapped copy of the parcel
+     geometry and APNs (the parcel store, see DA_Parcel_Store.py) is written
+     next to it, so the parcels the DA Reports are on are found from the
+     store without reading the parcels from a FC.
 
 6. Spatially Join the DA Reports with the extracted Parcels from above to get the working data FC.
      This creates a point FC that has all the data from the DA Reports AND the extracted Parcels.
+     The join is done in this script by DA_Spatial_Join.py (a grid index of
+     the parcels and a point in polygon test), not by arcpy.SpatialJoin_analysis().
+     With the parcel store the index is loaded from the store instead of built,
+     and the DA Reports are split by spatial tile and joined by a pool of
+     processes that each map the same store (see DA_Parcel_Store.py).
+     The parcels each DA Report was joined to are saved, and only the reports
+     that are new, moved, or may be on a parcel that changed are joined again.
 
 7. Handle data on a stacked parcel.
      Stacked parcels are multiple APN's on one parcel footprint.
@@ -122,6 +141,39 @@ Format for config file:
     Root_Folder =
     Share_Folder =
     Prod_FC_path =
+
+    [Parcel_Cache]
+    # OPTIONAL. Select the parcels from a local copy of PARCELS_ALL
+    #  (default True).  False selects them from PARCELS_ALL in the SDE.
+    Use_Cache = True
+
+    # OPTIONAL. Copy all of PARCELS_ALL again every this many hours, even if
+    #  it looks unchanged (default 168, one week).
+    Full_Refresh_Hours = 168
+
+    # OPTIONAL. If PARCELS_ALL has no editor tracking, compare a checksum of
+    #  every parcel with the cache every this many hours (default 24).  In
+    #  between, the cache is only refreshed if the number of parcels or the
+    #  highest OBJECTID changed.
+    Checksum_Hours = 24
+
+    # OPTIONAL. True compares the checksums on this run, whenever they were
+    #  last compared (default False).
+    Force_Checksum = False
+
+    [Spatial_Join]
+    # OPTIONAL. PYTHON joins the DA Reports to the parcels in this script
+    #  (see DA_Spatial_Join.py), ARCPY uses arcpy.SpatialJoin_analysis()
+    #  (default PYTHON).
+    Engine = PYTHON
+
+    # OPTIONAL. The most processes the PYTHON engine joins with when there is
+    #  a parcel store (default 0, one for each core).  1 joins in this script.
+    Processes = 0
+
+    # OPTIONAL. Only join the DA Reports again that are new, moved or may be
+    #  on a parcel that changed since the last run (default True).
+    Incremental = True
 """
 #
 # Author:      mgrue
@@ -176,9 +228,20 @@ def main():
     prod_FC_path         = config.get('Paths',         'Prod_FC_path')
     parcels_all          = config.get('Paths',         'Parcels_All')
 
+    # The URL of the FS the reports are in.  OPTIONAL.  (See DA_Download_Fire_Data.py)
+    FS_url = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/arcgis/rest/services/{}/FeatureServer'.format(name_of_FS)
+    if config.has_option('Download_Info', 'FS_url'):
+        FS_url = config.get('Download_Info', 'FS_url')
+
+    # The AGOL account these scripts edit the layer with
+    pipeline_user = config.get('AGOL', 'usr')
+
     # Set the working folder, FGDBs, FCs, and Tables
     data_folder           = '{}\Data'.format(root_folder)
 
+    # The layer signature DA_Download_Fire_Data.py took for this run
+    pending_signature_file = '{}\DA_Fire_Layer_Signature_Pending.json'.format(data_folder)
+
     raw_agol_FGDB_name    = 'DA_Fire_From_AGOL.gdb'
     raw_agol_FGDB_path    = '{}\{}'.format(data_folder, raw_agol_FGDB_name)
 
@@ -191,6 +254,42 @@ def main():
     parcels_extract_name  = 'Parcel_All_Int_DA_Reports'
     parcels_extract_path  = '{}\{}'.format(processing_FGDB_path, parcels_extract_name)
 
+    # Set the local copy of PARCELS_ALL (see Refresh_Parcel_Cache())
+    parcel_cache_FGDB_name = 'DA_Parcel_Cache.gdb'
+    parcel_cache_FGDB_path = '{}\{}'.format(data_folder, parcel_cache_FGDB_name)
+    parcel_cache_path      = '{}\Parcels_All_Cache'.format(parcel_cache_FGDB_path)
+    parcel_cache_state     = '{}\DA_Parcel_Cache.json'.format(data_folder)
+    parcel_store_folder    = '{}\DA_Parcel_Cache_Store'.format(data_folder)
+    report_parcels_file    = '{}\DA_Report_Parcels.json'.format(data_folder)
+
+    use_parcel_cache = True
+    if config.has_option('Parcel_Cache', 'Use_Cache'):
+        use_parcel_cache = config.getboolean('Parcel_Cache', 'Use_Cache')
+
+    parcel_cache_full_refresh_hours = 168
+    if config.has_option('Parcel_Cache', 'Full_Refresh_Hours'):
+        parcel_cache_full_refresh_hours = config.getint('Parcel_Cache', 'Full_Refresh_Hours')
+
+    parcel_cache_checksum_hours = 24
+    if config.has_option('Parcel_Cache', 'Checksum_Hours'):
+        parcel_cache_checksum_hours = config.getint('Parcel_Cache', 'Checksum_Hours')
+
+    parcel_cache_force_checksum = False
+    if config.has_option('Parcel_Cache', 'Force_Checksum'):
+        parcel_cache_force_checksum = config.getboolean('Parcel_Cache', 'Force_Checksum')
+
+    spatial_join_engine = 'PYTHON'
+    if config.has_option('Spatial_Join', 'Engine'):
+        spatial_join_engine = config.get('Spatial_Join', 'Engine').strip().upper() or 'PYTHON'
+
+    spatial_join_processes = 0
+    if config.has_option('Spatial_Join', 'Processes'):
+        spatial_join_processes = config.getint('Spatial_Join', 'Processes')
+
+    spatial_join_incremental = True
+    if config.has_option('Spatial_Join', 'Incremental'):
+        spatial_join_incremental = config.getboolean('Spatial_Join', 'Incremental')
+
 
     # Set txt that looks for Report Number / APN pairs (for stacked parcels)
     match_Report_to_APN_folder = '{}\Stacked_Parcels_Input'.format(share_folder)
@@ -208,6 +307,7 @@ def main():
     # Set the path to the success/fail files
     success_error_folder = '{}\Scripts\Source_Code\Control_Files\Success_Error'.format(root_folder)
     download_success_file = 'SUCCESS_running_DA_Download_Fire_Data.txt'  # Hard Coded into variable here
+    no_changes_file       = 'NO_CHANGES_DA_Download_Fire_Data.txt'        # Hard Coded into variable here
     process_success_file  = 'SUCCESS_running_{}.txt'.format(name_of_script.split('.')[0])
 
     # Set the Control_Files path
@@ -235,6 +335,16 @@ def main():
         print '\n*** ERROR with Write_Print_To_Log() ***'
         print str(e)
 
+    # Record or replay the responses from AGOL (see DA_HTTP_Cache.py)
+    if success == True:
+        try:
+            import DA_HTTP_Cache
+            DA_HTTP_Cache.Configure_From_Config(cfgFile)
+        except Exception as e:
+            success = False
+            print '*** ERROR with DA_HTTP_Cache.Configure_From_Config() ***'
+            print str(e)
+
 
     #---------------------------------------------------------------------------
     #                         Check Folder Schema.
@@ -366,8 +476,16 @@ def main():
             print '  Please fix any problems with that script first. Then try again.'
             print '  You can find the log files at:\n    {}'.format(log_file_folder)
 
-    # Get the path to the most recently downloaded data
+    # Skip the processing if the layer hasn't changed since the last successful run
+    no_changes = False
     if success == True:
+        if os.path.exists('{}\{}'.format(success_error_folder, no_changes_file)):
+            no_changes = True
+            print '\n  DA_Download_Fire_Data.py found NO CHANGES in the layer since the last successful run.'
+            print '  The production data is already up to date, skipping the processing.\n'
+
+    # Get the path to the most recently downloaded data
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             orig_DA_reports_fc = Get_Newest_Data(raw_agol_FGDB_path)
@@ -384,9 +502,19 @@ def main():
             print '\n*** ERROR with Get_Newest_Data() ***'
             print str(e)
 
+    # Load the columnar copy of the newest data written by DA_Download_Fire_Data.py
+    columnar_snapshot = None
+    if success == True and no_changes == False:
+        try:
+            columnar_snapshot = Get_Columnar_Snapshot(raw_agol_FGDB_path, orig_DA_reports_fc)
+        except Exception as e:
+            # Not a reason to stop, the FC is read instead
+            print '\n*** WARNING with Get_Columnar_Snapshot(), reading the FC instead ***'
+            print str(e)
+
     #---------------------------------------------------------------------------
     # Set the date that the data was most recently downloaded
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             Set_Date_Data_DL(orig_DA_reports_fc, AGOL_Data_DL_path)
@@ -395,12 +523,48 @@ def main():
             print '\n*** ERROR with Set_Date_Data_DL() ***'
             print str(e)
 
+    #---------------------------------------------------------------------------
+    # Bring the local copy of PARCELS_ALL up to date
+    parcels_to_extract_from = parcels_all
+    parcel_store            = None
+    if success == True and no_changes == False and use_parcel_cache == True:
+        try:
+            print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+            # Make sure the parcel cache FGDB exists, create it if it does not
+            if not arcpy.Exists(parcel_cache_FGDB_path):
+                print 'NOTICE, Parcel Cache FGDB does not exist, creating it now at:\n  {}\n'.format(parcel_cache_FGDB_path)
+                arcpy.CreateFileGDB_management(data_folder, parcel_cache_FGDB_name, 'CURRENT')
+
+            Refresh_Parcel_Cache(parcels_all, parcel_cache_path, parcel_cache_state, parcel_cache_full_refresh_hours,
+                                 parcel_store_folder, parcel_cache_checksum_hours, parcel_cache_force_checksum)
+            parcels_to_extract_from = parcel_cache_path
+
+        except Exception as e:
+            # Not a reason to stop, the parcels can still come from the SDE
+            print '\n*** WARNING, could not refresh the parcel cache, selecting the parcels from PARCELS_ALL ***'
+            print str(e)
+
+        # Load the parcel store made from the cache
+        if parcels_to_extract_from == parcel_cache_path:
+            try:
+                import DA_Parcel_Store
+                parcel_store = DA_Parcel_Store.Load_Parcel_Store(parcel_store_folder)
+                if parcel_store != None:
+                    print 'Loaded the parcel store of {} parcels at:\n  {}\n'.format(parcel_store.num_parcels, parcel_store_folder)
+
+            except Exception as e:
+                # Not a reason to stop, the parcels can still be read from the cache
+                print '\n*** WARNING, could not load the parcel store, reading the parcels from the parcel cache ***'
+                print str(e)
+                parcel_store = None
+
     #---------------------------------------------------------------------------
     # Get an extract of all parcels that intersect with the DA Reports
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            Extract_Parcels(parcels_all, orig_DA_reports_fc, parcels_extract_path)
+            Extract_Parcels(parcels_to_extract_from, orig_DA_reports_fc, parcels_extract_path, parcel_store)
 
             # Add Attribute Index
             try:
@@ -416,10 +580,18 @@ def main():
 
     #---------------------------------------------------------------------------
     # Spatially Join the DA Reports with the parcels_extract_path
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            working_fc = Join_2_FC_By_Spatial_Join(orig_DA_reports_fc, parcels_extract_path, processing_FGDB_path)
+            # The parcel store is of the parcel cache, so join to the cache when it is used
+            if parcel_store != None and spatial_join_engine != 'ARCPY':
+                assignments_file = report_parcels_file if spatial_join_incremental == True else None
+                working_fc = Join_2_FC_By_Spatial_Join(orig_DA_reports_fc, parcel_cache_path, processing_FGDB_path,
+                                                       spatial_join_engine, parcel_store, spatial_join_processes,
+                                                       assignments_file)
+            else:
+                working_fc = Join_2_FC_By_Spatial_Join(orig_DA_reports_fc, parcels_extract_path, processing_FGDB_path,
+                                                       spatial_join_engine)
 
             # Add Attribute Index
             try:
@@ -436,7 +608,7 @@ def main():
     #---------------------------------------------------------------------------
     # Handle data on a stacked parcel.
     # Stacked parcels are multiple APN's on one parcel footprint
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
@@ -455,7 +627,7 @@ def main():
 
     #---------------------------------------------------------------------------
     # Add Fields to downloaded DA Fire Data
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             Fields_Add_Fields(working_fc, add_fields_csv)
@@ -466,7 +638,7 @@ def main():
 
     #---------------------------------------------------------------------------
     # Calculate Fields
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             Fields_Calculate_Fields(working_fc, calc_fields_csv)
@@ -477,10 +649,10 @@ def main():
 
     #---------------------------------------------------------------------------
     # QA/QC the data
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            success = QA_QC_Data(orig_DA_reports_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extract_path, match_Report_to_APN_txt, arcpy_version)
+            success = QA_QC_Data(orig_DA_reports_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extract_path, match_Report_to_APN_txt, arcpy_version, parcel_store, columnar_snapshot)
             os.remove(match_Report_to_APN_csv)  # Delete the temp csv file
         except Exception as e:
             success = False
@@ -494,7 +666,7 @@ def main():
 
     # Backup the production features before attempting to change it
     # Delete the features in the backup database
-    if success == True:
+    if success == True and no_changes == False:
         print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
         print '----------------------------------------------------------------'
         print '----------------------------------------------------------------'
@@ -513,7 +685,7 @@ def main():
             print 'WARNING, a backup Feature Class does not exist, please make a copy of the orig FC and append "_BAK" to the name'
 
     # Append the features from the production database to the backup database
-    if success == True:
+    if success == True and no_changes == False:
         if arcpy.Exists(backup_fc):
             try:
                 print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -529,7 +701,7 @@ def main():
     #                       Append newly processed data
     #                      into the production database
     # Delete the features in the prod database
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             print 'Deleting features in the current production FC'
@@ -540,7 +712,7 @@ def main():
             print str(e)
 
     # Append the features from the working database to the prod database
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             print 'Appending newly processed features from working database to prod database'
@@ -563,7 +735,7 @@ def main():
     #---------------------------------------------------------------------------
     #              Export the updated prod database to an Excel file
     # Delete the features in the prod database
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             fld_name_or_alias = 'ALIAS'
@@ -580,7 +752,7 @@ def main():
     #                           Update AGOL fields
     #---------------------------------------------------------------------------
     # Get a token with permissions to view the AGOL data
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             token = Get_Token(cfgFile)
@@ -590,7 +762,7 @@ def main():
             print str(e)
 
     # Update AGOL fields
-    if success == True:
+    if success == True and no_changes == False:
         try:
             print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
             Update_AGOL_Fields(name_of_FS, index_of_layer_in_FS, token, working_fc)
@@ -599,6 +771,19 @@ def main():
             print '\n*** ERROR with Update_AGOL_Fields() ***'
             print str(e)
 
+    # Move the pending layer signature past the edits above, so the next run
+    #  doesn't download the layer again only because of them
+    if success == True and no_changes == False:
+        try:
+            import DA_Layer_Signature
+            print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            print 'Recording the edits of this script in the pending layer signature...'
+            DA_Layer_Signature.Record_Pipeline_Edits(pending_signature_file, FS_url, index_of_layer_in_FS,
+                                                     token, pipeline_user)
+        except Exception as e:
+            print '\n*** WARNING! Could not record the edits in the layer signature, the next run will download the layer again ***'
+            print str(e)
+
 
     #---------------------------------------------------------------------------
     # Write a file to disk to let other scripts know if this script ran
@@ -781,14 +966,37 @@ def Get_Newest_Data(FGDB_path):
         Data_From_AGOL_2018_01_01__10_00_00
         Data_From_AGOL_2018_01_02__10_00_00
         Data_From_AGOL_2018_01_02__10_00_01
+
+      The newest FC is looked up in the manifest that 'DA_Download_Fire_Data.py'
+      keeps next to the FGDB (see DA_Snapshot_Manifest.py), so the FGDB
+      doesn't have to be listed.  The FGDB is only listed if there is no
+      manifest, or if the FC in the manifest no longer exists.
     """
 
     print '--------------------------------------------------------------------'
     print 'Starting Get_Newest_Data()'
 
-    arcpy.env.workspace = FGDB_path
+    import DA_Snapshot_Manifest
+
     print 'Finding the newest data in: {}'.format(FGDB_path)
 
+    # Look up the newest FC in the manifest
+    manifest_path = DA_Snapshot_Manifest.Get_Manifest_Path(FGDB_path)
+    newest_snapshot = DA_Snapshot_Manifest.Get_Newest_Snapshot(manifest_path)
+
+    if newest_snapshot != None and arcpy.Exists(newest_snapshot['path']):
+        newest_download_path = newest_snapshot['path']
+        print 'The newest download ({} features) is at:\n  {}'.format(newest_snapshot['record_count'], newest_download_path)
+        print 'Finished Get_Newest_Data()\n'
+        return newest_download_path
+
+    if newest_snapshot != None:
+        print '  * WARNING, the newest FC in the manifest no longer exists, listing the FGDB'
+    else:
+        print '  No snapshot manifest at "{}", listing the FGDB'.format(manifest_path)
+
+    arcpy.env.workspace = FGDB_path
+
     # List all FC's in the FGDB
     AGOL_downloads = arcpy.ListFeatureClasses()
 
@@ -804,6 +1012,48 @@ def Get_Newest_Data(FGDB_path):
 
     return newest_download_path
 
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION: Get_Columnar_Snapshot()
+def Get_Columnar_Snapshot(FGDB_path, snapshot_fc):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the downloaded AGOL data.
+      snapshot_fc (str): Full path to the FC returned by Get_Newest_Data().
+
+    RETURNS:
+      columnar_snapshot (DA_Columnar_Snapshot.Columnar_Snapshot): The
+        columnar copy of 'snapshot_fc', or None if there isn't one.
+
+    FUNCTION:
+      To load the columnar copy of the newest download that
+      'DA_Download_Fire_Data.py' writes next to the FGDB (see
+      DA_Columnar_Snapshot.py), so QA_QC_Data() can read whole fields of it
+      from memory-mapped arrays instead of a cursor over the FC.
+    """
+
+    print '--------------------------------------------------------------------'
+    print 'Starting Get_Columnar_Snapshot()'
+
+    import DA_Columnar_Snapshot
+
+    columnar_snapshot = DA_Columnar_Snapshot.Load_Newest_Columnar_Snapshot(FGDB_path)
+
+    # Only use it if it is the copy of the FC that is being processed
+    snapshot_name = os.path.basename(snapshot_fc.replace('\\', '/'))
+    if columnar_snapshot != None and os.path.basename(columnar_snapshot.snapshot_folder.replace('\\', '/')) != snapshot_name:
+        columnar_snapshot = None
+
+    if columnar_snapshot == None:
+        print '  There is no columnar copy of:  {}'.format(snapshot_name)
+    else:
+        print '  Loaded the columnar copy ({} rows) at:\n    {}'.format(columnar_snapshot.num_rows,
+                                                                      columnar_snapshot.snapshot_folder)
+
+    print 'Finished Get_Columnar_Snapshot()\n'
+
+    return columnar_snapshot
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #            FUNCTION: Set Date the AGOL data was Downloaded
@@ -868,11 +1118,11 @@ def Set_Date_Data_DL(fc_w_timestamp, fc_to_update):
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #                         FUNCTION: Extract Parcels
-def Extract_Parcels(parcels_all, related_fc, parcels_int_related_fc):
+def Extract_Parcels(parcels_all, related_fc, parcels_int_related_fc, parcel_store=None):
     """
     PARAMETERS:
       parcels_all (str): Full path to the PARCELS_ALL FC.  This should be an SDE
-        FC.
+        FC, or the local copy of it made by Refresh_Parcel_Cache().
 
       related_fc (str):  Full path to a FC that will be used to select parcels
         that intersect features in this FC.
@@ -880,6 +1130,11 @@ def Extract_Parcels(parcels_all, related_fc, parcels_int_related_fc):
       parcels_int_related_fc (str):  Full path to an EXISTING FC that will contain
         the selected parcels.
 
+      parcel_store {DA_Parcel_Store.Parcel_Store}: The parcel store made from
+        'parcels_all' by Refresh_Parcel_Cache().  If given, the parcels the
+        (point) features of 'related_fc' are on are found in the store and
+        selected by their OBJECTIDs instead of by location. OPTIONAL.
+
     RETURNS:
       None
 
@@ -910,8 +1165,27 @@ def Extract_Parcels(parcels_all, related_fc, parcels_int_related_fc):
     arcpy.MakeFeatureLayer_management(parcels_all, 'par_all_lyr')
 
     # Select Parcels that intersect with the DA Reports
-    print '\n  Selecting parcels that intersect with the DA Reports'
-    arcpy.SelectLayerByLocation_management('par_all_lyr', 'INTERSECT', related_fc)
+    if parcel_store == None:
+        print '\n  Selecting parcels that intersect with the DA Reports'
+        arcpy.SelectLayerByLocation_management('par_all_lyr', 'INTERSECT', related_fc)
+
+    else:
+        print '\n  Finding the parcels the DA Reports are on in the parcel store'
+        index = parcel_store.Get_Index()
+        oids = set()
+        for values, parcels in Find_Parcels_Of_Points(related_fc, [], parcel_store):
+            oids.update(index.Get_Key(parcel) for parcel in parcels)
+
+        # Select them by OBJECTID, 1000 at a time
+        oid_field = arcpy.Describe(parcels_all).OIDFieldName
+        oids = sorted(oids)
+        selection_type = 'NEW_SELECTION'
+        for start in range(0, len(oids), 1000):
+            where_clause = '{} IN ({})'.format(oid_field, ','.join(str(oid) for oid in oids[start:start + 1000]))
+            arcpy.SelectLayerByAttribute_management('par_all_lyr', selection_type, where_clause)
+            selection_type = 'ADD_TO_SELECTION'
+        if len(oids) == 0:
+            arcpy.SelectLayerByAttribute_management('par_all_lyr', 'NEW_SELECTION', '1 = 0')
 
     # Get count of selected parcels
     count = Get_Count_Selected('par_all_lyr')
@@ -933,10 +1207,406 @@ def Extract_Parcels(parcels_all, related_fc, parcels_int_related_fc):
 
     return
 
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Refresh_Parcel_Cache()
+def Refresh_Parcel_Cache(parcels_all, parcel_cache, state_file, full_refresh_hours=168, store_folder=None,
+                         checksum_hours=24, force_checksum=False):
+    """
+    PARAMETERS:
+      parcels_all (str): Full path to the PARCELS_ALL FC in the SDE.
+
+      parcel_cache (str): Full path to the local copy of PARCELS_ALL (in a
+        FGDB that exists).  It is made if it doesn't exist.
+
+      state_file (str): Full path to a .json file that remembers what the
+        SDE looked like when the cache was last refreshed.
+
+      full_refresh_hours {int}: Copy all of PARCELS_ALL again if it was last
+        copied more than this many hours ago. OPTIONAL.
+
+      store_folder {str}: Full path to the folder of the parcel store of the
+        cache (see Build_Parcel_Store()).  It is written again every time the
+        cache changes, or if it doesn't exist. OPTIONAL.
+
+      checksum_hours {int}: If PARCELS_ALL has no editor tracking, compare
+        the checksums of the parcels if they were last compared more than
+        this many hours ago. OPTIONAL.
+
+      force_checksum {bool}: Compare the checksums of the parcels on this
+        run. OPTIONAL.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      Selecting the parcels that intersect the DA Reports from the SDE over
+      the network is the slowest step of this script.  This keeps a local copy
+      of PARCELS_ALL (the geometry and every field, so the parcels can be
+      appended to 'Parcel_All_Int_DA_Reports' as before) so Extract_Parcels()
+      can select from it instead.  The OBJECTID of each parcel in the SDE is
+      kept in the PARCELS_ALL_OID field of the cache.
+
+      If editor tracking is on, the SDE is checked with a few cheap queries
+      (the number of parcels, the highest OBJECTID and the newest edit date):
+        1) If they are the same as last time, the cache is used as it is.
+        2) Otherwise only the parcels edited since the newest edit date of
+           last time are copied again, and if the number of parcels doesn't
+           match after that, the parcels deleted from the SDE are deleted
+           from the cache.
+
+      If editor tracking is off, an edit to a parcel doesn't change the edit
+      date, and reading every parcel of the SDE is almost as slow as copying
+      it, so:
+        3) If the number of parcels and the highest OBJECTID are the same as
+           last time, the cache is used as it is.
+        4) Otherwise, or if the checksums were last compared more than
+           'checksum_hours' ago, or if 'force_checksum' is True, a checksum
+           of every parcel (its fields, area and length, see
+           Get_Parcel_Checksums()) is read from the SDE and from the cache,
+           without the geometry.  The parcels whose checksum is different,
+           or that are not in the cache, are copied again, and the parcels
+           that are no longer in the SDE are deleted from the cache.
+      So an edit that changes no parcel count or OBJECTID is picked up by
+      the next comparison of the checksums.
+
+      All of PARCELS_ALL is also copied again if there is no cache, if the
+      cache was made from another FC, or every 'full_refresh_hours'.
+    """
+
+    print '--------------------------------------------------------------------'
+    print 'Starting Refresh_Parcel_Cache()'
+
+    import json
+    import DA_AGOL_Download
+
+    print '  PARCELS_ALL FC path:\n    {}'.format(parcels_all)
+    print '  Parcel cache path:\n    {}\n'.format(parcel_cache)
+
+    cache_oid_field = 'PARCELS_ALL_OID'
+
+    # Get what the SDE looks like now
+    desc = arcpy.Describe(parcels_all)
+    edit_date_field = None
+    if getattr(desc, 'editorTrackingEnabled', False) and getattr(desc, 'editedAtFieldName', ''):
+        edit_date_field = desc.editedAtFieldName
+
+    source_state = {'source'        : parcels_all,
+                    'count'         : int(arcpy.GetCount_management(parcels_all).getOutput(0)),
+                    'max_oid'       : Get_Max_Value(parcels_all, desc.OIDFieldName),
+                    'max_edit_date' : None}
+    if edit_date_field != None:
+        max_edit_date = Get_Max_Value(parcels_all, edit_date_field)
+        if max_edit_date != None:
+            source_state['max_edit_date'] = max_edit_date.strftime('%Y-%m-%d %H:%M:%S')
+
+    print '  PARCELS_ALL has {} parcels, the highest OBJECTID is {} and the newest edit is {}'.format(
+                source_state['count'], source_state['max_oid'], source_state['max_edit_date'])
+
+    # Get what the SDE looked like at the last refresh
+    last_state = None
+    try:
+        with open(state_file) as json_file:
+            last_state = json.load(json_file)
+    except (IOError, ValueError):
+        pass
+
+    # Decide how to refresh the cache
+    full_refresh = True
+    if last_state == None:
+        print '  No parcel cache state found at:\n    {}'.format(state_file)
+    elif not arcpy.Exists(parcel_cache):
+        print '  The parcel cache does not exist'
+    elif last_state.get('source', '').lower() != parcels_all.lower():
+        print '  The parcel cache was made from:\n    {}'.format(last_state.get('source'))
+    elif time.time() - last_state.get('last_full_refresh', 0) > full_refresh_hours * 3600:
+        print '  The parcel cache was fully refreshed more than {} hours ago'.format(full_refresh_hours)
+    else:
+        full_refresh = False
+
+    last_full_refresh = time.time()
+    last_checksum = time.time()
+    if full_refresh == False:
+        last_full_refresh = last_state['last_full_refresh']
+        last_checksum = last_state.get('last_checksum', last_full_refresh)
+
+    # The fields copied to the cache
+    fields = [field.name for field in arcpy.ListFields(parcels_all)
+              if field.type not in ('OID', 'Geometry', 'GlobalID') and field.editable]
+
+    cache_changed = full_refresh
+
+    if full_refresh == True:
+        print '  FULL refresh of the parcel cache'
+        if arcpy.Exists(parcel_cache):
+            arcpy.Delete_management(parcel_cache)
+        arcpy.CreateFeatureclass_management(os.path.dirname(parcel_cache), os.path.basename(parcel_cache),
+                                            desc.shapeType.upper(), parcels_all, '', '', desc.spatialReference)
+        arcpy.AddField_management(parcel_cache, cache_oid_field, 'LONG')
+
+        num_copied = Copy_Parcels(parcels_all, parcel_cache, fields, cache_oid_field)
+        print '  Copied {} parcels'.format(num_copied)
+
+        arcpy.AddIndex_management(parcel_cache, [cache_oid_field], 'parcels_all_oid_index')
+
+    elif (edit_date_field == None and force_checksum == False and
+          source_state['count']   == last_state['count'] and
+          source_state['max_oid'] == last_state['max_oid'] and
+          time.time() - last_checksum <= checksum_hours * 3600):
+        print '  PARCELS_ALL does not have editor tracking, and the number of parcels and the highest OBJECTID have not changed'
+        print '  The checksums of the parcels are compared every {} hours, the parcel cache is used as it is'.format(checksum_hours)
+
+    elif edit_date_field == None:
+        print '  PARCELS_ALL does not have editor tracking, comparing the checksums of the parcels'
+        last_checksum = time.time()
+
+        source_checksums = Get_Parcel_Checksums(parcels_all, 'OID@', fields + [desc.areaFieldName, desc.lengthFieldName])
+        cache_desc = arcpy.Describe(parcel_cache)
+        cache_checksums = Get_Parcel_Checksums(parcel_cache, cache_oid_field,
+                                               fields + [cache_desc.areaFieldName, cache_desc.lengthFieldName])
+
+        changed_oids = [oid for oid, checksum in source_checksums.iteritems() if cache_checksums.get(oid) != checksum]
+        deleted_oids = [oid for oid in cache_checksums if oid not in source_checksums]
+        del source_checksums, cache_checksums
+
+        if changed_oids or deleted_oids:
+            cache_changed = True
+
+            # Copy the changed parcels again
+            Delete_Cached_Parcels(parcel_cache, cache_oid_field, changed_oids + deleted_oids)
+            changed_oids.sort()
+            num_copied = 0
+            for start in range(0, len(changed_oids), 1000):
+                where_clause = '{} IN ({})'.format(desc.OIDFieldName, ','.join(str(oid) for oid in changed_oids[start:start + 1000]))
+                num_copied += Copy_Parcels(parcels_all, parcel_cache, fields, cache_oid_field, where_clause)
+            print '  Copied {} changed parcels'.format(num_copied)
+            print '  Deleted {} parcels that are no longer in PARCELS_ALL'.format(len(deleted_oids))
+        else:
+            print '  PARCELS_ALL has not changed since the last refresh, the parcel cache is up to date'
+
+    elif (source_state['count']   == last_state['count'] and
+          source_state['max_oid'] == last_state['max_oid'] and
+          source_state['max_edit_date'] == last_state['max_edit_date']):
+        print '  PARCELS_ALL has not changed since the last refresh, the parcel cache is up to date'
+
+    elif last_state['max_edit_date'] != None:
+        print '  INCREMENTAL refresh of the parcels edited since: {}'.format(last_state['max_edit_date'])
+        cache_changed = True
+
+        # Copy the edited parcels again
+        where_clause = Get_Date_Where(parcels_all, edit_date_field, last_state['max_edit_date'])
+        edited_oids = [row[0] for row in arcpy.da.SearchCursor(parcels_all, ['OID@'], where_clause)]
+        Delete_Cached_Parcels(parcel_cache, cache_oid_field, edited_oids)
+        num_copied = Copy_Parcels(parcels_all, parcel_cache, fields, cache_oid_field, where_clause)
+        print '  Copied {} edited parcels'.format(num_copied)
+
+        # Delete the parcels that were deleted from the SDE
+        cache_count = int(arcpy.GetCount_management(parcel_cache).getOutput(0))
+        if cache_count != source_state['count']:
+            source_oids = set(row[0] for row in arcpy.da.SearchCursor(parcels_all, ['OID@']))
+            deleted_oids = [row[0] for row in arcpy.da.SearchCursor(parcel_cache, [cache_oid_field])
+                            if row[0] not in source_oids]
+            Delete_Cached_Parcels(parcel_cache, cache_oid_field, deleted_oids)
+            print '  Deleted {} parcels that are no longer in PARCELS_ALL'.format(len(deleted_oids))
+
+    else:
+        print '  Editor tracking was turned on in PARCELS_ALL after the last refresh, FULL refresh of the parcel cache'
+        cache_changed = True
+        arcpy.DeleteFeatures_management(parcel_cache)
+        num_copied = Copy_Parcels(parcels_all, parcel_cache, fields, cache_oid_field)
+        print '  Copied {} parcels'.format(num_copied)
+
+    # Write the parcel store of the cache if the cache changed
+    if store_folder != None:
+        if cache_changed or not os.path.exists(os.path.join(store_folder, 'Store.json')):
+            Build_Parcel_Store(parcel_cache, store_folder, '{:.3f}'.format(last_full_refresh))
+
+    # Remember what the SDE looked like
+    source_state['last_full_refresh'] = last_full_refresh
+    source_state['last_checksum']     = last_checksum
+    source_state['last_refresh']      = time.time()
+    DA_AGOL_Download.Write_JSON_File(state_file, source_state)
+
+    print 'Finished Refresh_Parcel_Cache()\n'
+
+    return
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Copy_Parcels()
+def Copy_Parcels(parcels_all, parcel_cache, fields, cache_oid_field, where_clause=None):
+    """
+    RETURNS:
+      num_copied (int): The number of parcels copied from 'parcels_all' to
+        'parcel_cache', with one search cursor and one insert cursor.  The
+        OBJECTID of each parcel is written to 'cache_oid_field'.
+    """
+
+    num_copied = 0
+    with arcpy.da.SearchCursor(parcels_all, ['OID@', 'SHAPE@'] + fields, where_clause) as search_cursor:
+        with arcpy.da.InsertCursor(parcel_cache, [cache_oid_field, 'SHAPE@'] + fields) as insert_cursor:
+            for row in search_cursor:
+                insert_cursor.insertRow(row)
+                num_copied += 1
+
+    return num_copied
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Get_Parcel_Checksums()
+def Get_Parcel_Checksums(in_table, oid_field, fields):
+    """
+    PARAMETERS:
+      in_table (str): Full path to PARCELS_ALL or to the parcel cache.
+      oid_field (str): The field with the OBJECTID of the parcel in the SDE
+        ('OID@' for PARCELS_ALL, PARCELS_ALL_OID for the cache).
+      fields (list of str): The fields to checksum.  Blank names (i.e. no
+        area field) are skipped.
+
+    RETURNS:
+      checksums (dict): {OBJECTID: checksum} of every parcel in 'in_table'.
+
+    FUNCTION:
+      To read a checksum of every parcel without reading its geometry.  The
+      area and length fields stand in for the geometry, so an edit that moves
+      a parcel without changing its shape is not seen (until the next full
+      refresh).  Floats are rounded to 3 decimals first, since the SDE and the
+      file geodatabase may not store the area to the same precision.
+    """
+
+    fields = [field for field in fields if field]
+
+    checksums = {}
+    with arcpy.da.SearchCursor(in_table, [oid_field] + fields) as cursor:
+        for row in cursor:
+            checksums[row[0]] = hash(tuple(round(value, 3) if isinstance(value, float) else value
+                                           for value in row[1:]))
+
+    return checksums
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Delete_Cached_Parcels()
+def Delete_Cached_Parcels(parcel_cache, cache_oid_field, oids):
+    """
+    FUNCTION:
+      To delete the parcels with a 'cache_oid_field' in 'oids' from the parcel
+      cache, 1000 OBJECTIDs at a time.
+    """
+
+    oids = sorted(oids)
+    for start in range(0, len(oids), 1000):
+        where_clause = '{} IN ({})'.format(cache_oid_field, ','.join(str(oid) for oid in oids[start:start + 1000]))
+        with arcpy.da.UpdateCursor(parcel_cache, [cache_oid_field], where_clause) as cursor:
+            for row in cursor:
+                cursor.deleteRow()
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Get_Max_Value()
+def Get_Max_Value(in_table, field):
+    """
+    RETURNS:
+      max_value: The highest value of 'field' in 'in_table', or None if the
+        table is empty.  The database sorts the rows, so only one row is read.
+    """
+
+    sql_clause = (None, 'ORDER BY {} DESC'.format(field))
+    with arcpy.da.SearchCursor(in_table, [field], '{} IS NOT NULL'.format(field), sql_clause=sql_clause) as cursor:
+        for row in cursor:
+            return row[0]
+
+    return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Date_Where()
+def Get_Date_Where(in_table, date_field, date_str):
+    """
+    PARAMETERS:
+      in_table (str): Full path to the table the where clause is for.
+      date_field (str): The name of the date field.
+      date_str (str): 'YYYY-MM-DD HH:MM:SS'
+
+    RETURNS:
+      where_clause (str): A where clause for the rows where 'date_field' is at
+        or after 'date_str', written for the database of 'in_table' (file
+        geodatabases and Oracle write dates differently from SQL Server and
+        PostgreSQL).
+    """
+
+    # Find the workspace of the table (it may be in a feature dataset)
+    workspace = os.path.dirname(in_table)
+    while workspace and arcpy.Describe(workspace).dataType != 'Workspace':
+        if os.path.dirname(workspace) == workspace:
+            workspace = ''
+            break
+        workspace = os.path.dirname(workspace)
+
+    workspace_type = arcpy.Describe(workspace).workspaceFactoryProgID if workspace else ''
+    dbms = ''
+    if 'SdeWorkspace' in workspace_type:
+        dbms = getattr(arcpy.Describe(workspace).connectionProperties, 'dbms', '') or ''
+
+    if 'FileGDB' in workspace_type:
+        return "{} >= date '{}'".format(date_field, date_str)
+    if 'oracle' in dbms.lower():
+        return "{} >= TO_DATE('{}', 'YYYY-MM-DD HH24:MI:SS')".format(date_field, date_str)
+    return "{} >= '{}'".format(date_field, date_str)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Build_Parcel_Store()
+def Build_Parcel_Store(parcel_cache, store_folder, generation=None):
+    """
+    PARAMETERS:
+      parcel_cache (str): Full path to the local copy of PARCELS_ALL made by
+        Refresh_Parcel_Cache().
+
+      store_folder (str): Full path to the folder to write the parcel store
+        to.  Anything already there is replaced.
+
+      generation {str}: The time of the last full refresh of the cache (see
+        DA_Parcel_Store.Write_Parcel_Store()). OPTIONAL.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To write the geometry, OBJECTID, [APN] and [APN_8] of every parcel in
+      the cache to a parcel store (see DA_Parcel_Store.py), with one search
+      cursor.  The store is what Extract_Parcels(),
+      Spatial_Join_Points_To_Polygons() and QA_QC_Data() load (memory-mapped)
+      to find the parcels the DA Reports are on.
+    """
+
+    print '  Writing the parcel store to:\n    {}'.format(store_folder)
+
+    import DA_Parcel_Store
+
+    start_time = time.time()
+    cache_fields = [field.name.upper() for field in arcpy.ListFields(parcel_cache)]
+    string_fields = [field for field in ['APN', 'APN_8'] if field in cache_fields]
+
+    def Get_Parcels(cursor):
+        for row in cursor:
+            yield row[0], Get_Rings(row[1]), row[2:]
+
+    sr = arcpy.Describe(parcel_cache).spatialReference
+    with arcpy.da.SearchCursor(parcel_cache, ['OID@', 'SHAPE@'] + string_fields) as cursor:
+        num_parcels = DA_Parcel_Store.Write_Parcel_Store(store_folder, Get_Parcels(cursor), string_fields,
+                                                         sr.exportToString(), sr.XYTolerance or 0.0, parcel_cache,
+                                                         generation)
+
+    print '  Wrote {} parcels to the parcel store in {} seconds'.format(num_parcels, round(time.time() - start_time, 1))
+
+    return
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #               FUNCTION: Join DA Reports with Parcels Extract
-def Join_2_FC_By_Spatial_Join(target_fc, join_fc, output_FGDB):
+def Join_2_FC_By_Spatial_Join(target_fc, join_fc, output_FGDB, engine='PYTHON', parcel_store=None, processes=None,
+                              assignments_file=None):
     """
     PARAMETERS:
       target_fc (str): Full path to the FC you want to be joined
@@ -949,6 +1619,19 @@ def Join_2_FC_By_Spatial_Join(target_fc, join_fc, output_FGDB):
         The full path to the FC in this FGDB will be calculated to be the path
         of this FGDB + the name of the target_fc + '_joined'
 
+      engine {str}: 'PYTHON' to join with Spatial_Join_Points_To_Polygons(),
+        'ARCPY' to join with arcpy.SpatialJoin_analysis(). OPTIONAL.
+
+      parcel_store {DA_Parcel_Store.Parcel_Store}: The parcel store made from
+        the join_fc, only used by the 'PYTHON' engine. OPTIONAL.
+
+      processes {int}: The most processes to join with when there is a
+        parcel store. OPTIONAL.  Defaults to the number of cores.
+
+      assignments_file {str}: Full path to the .json file with the parcels
+        each DA Report was joined to, to only join the reports again that
+        changed when there is a parcel store. OPTIONAL.
+
     RETURNS:
       output_fc (str): Full path to the FC that resulted from the spatial join
 
@@ -963,12 +1646,239 @@ def Join_2_FC_By_Spatial_Join(target_fc, join_fc, output_FGDB):
     join_operation   = 'JOIN_ONE_TO_MANY'
 
     print '  Spatially Joining:\n    {}\n  With:\n    {}\n  Joined FC at:\n    {}'.format(target_fc, join_fc, output_fc)
-    arcpy.SpatialJoin_analysis(target_fc, join_fc, output_fc, join_operation)
+    if engine == 'ARCPY':
+        arcpy.SpatialJoin_analysis(target_fc, join_fc, output_fc, join_operation)
+    else:
+        Spatial_Join_Points_To_Polygons(target_fc, join_fc, output_fc, parcel_store, processes, assignments_file)
 
     print 'Finished Join_2_FC_By_Spatial_Join()\n'
 
     return output_fc
 
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                 FUNCTION Spatial_Join_Points_To_Polygons()
+def Spatial_Join_Points_To_Polygons(target_fc, join_fc, output_fc, parcel_store=None, processes=None,
+                                    assignments_file=None):
+    """
+    PARAMETERS:
+      target_fc (str): Full path to a point FC (the DA Reports).
+      join_fc (str): Full path to a polygon FC (the parcels).
+      output_fc (str): Full path to the joined FC to make.  It is replaced if
+        it exists.
+      parcel_store {DA_Parcel_Store.Parcel_Store}: The parcel store made from
+        the join_fc (the parcel cache) by Refresh_Parcel_Cache().  If given,
+        the index of the polygons is loaded from the store, and only the
+        values of the polygons the points are in are read from the join_fc.
+        The PARCELS_ALL_OID field of the cache is not joined. OPTIONAL.
+      processes {int}: The most processes to join with when there is a
+        parcel store (see DA_Parcel_Store.Join_Points_Parallel()). OPTIONAL.
+      assignments_file {str}: Full path to a .json file to save the parcels
+        each point ([ReportNumber]) was joined to in.  If given with a parcel
+        store, only the points that are new, moved or may be on a parcel that
+        changed since the last join are joined again (see
+        DA_Parcel_Store.Join_Points_Incremental()). OPTIONAL.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To make the same FC as a JOIN_ONE_TO_MANY, KEEP_ALL, INTERSECT
+      arcpy.SpatialJoin_analysis() of the points to the polygons, but with the
+      join done in this script by DA_Spatial_Join.py:
+        Join_Count, TARGET_FID, JOIN_FID, the fields of the target_fc, then the
+        fields of the join_fc (a join field with the same name as a target
+        field gets '_1' added to its name).  A point gets one row for every
+        polygon it intersects (Join_Count = 1), or one row with Join_Count = 0,
+        JOIN_FID = -1 and no polygon fields.
+
+      If the points are in another spatial reference than the polygons,
+      they are projected to it for the join (the output keeps the points as
+      they are).  A point within the XY tolerance of a polygon boundary
+      intersects it.
+    """
+
+    import DA_Spatial_Join
+
+    # Type of each field in ListFields() to its type in AddField_management()
+    field_types = {'String': 'TEXT', 'Integer': 'LONG', 'SmallInteger': 'SHORT', 'Double': 'DOUBLE',
+                   'Single': 'FLOAT', 'Date': 'DATE', 'Guid': 'GUID', 'GlobalID': 'GUID'}
+
+    target_fields = [field for field in arcpy.ListFields(target_fc) if field.type in field_types and field.editable]
+    join_fields   = [field for field in arcpy.ListFields(join_fc)   if field.type in field_types and field.editable]
+    if parcel_store != None:
+        join_fields = [field for field in join_fields if field.name.upper() != 'PARCELS_ALL_OID']
+
+    # Read the polygons and their values
+    start_time = time.time()
+    join_values = {}
+    if parcel_store == None:
+        polygons = []
+        with arcpy.da.SearchCursor(join_fc, ['OID@', 'SHAPE@'] + [field.name for field in join_fields]) as cursor:
+            for row in cursor:
+                polygons.append((row[0], Get_Rings(row[1])))
+                join_values[row[0]] = tuple(row[2:])
+
+        index = DA_Spatial_Join.Build_Parcel_Index(polygons)
+        print '  Indexed {} polygons in {} seconds'.format(len(polygons), round(time.time() - start_time, 1))
+    else:
+        index = parcel_store.Get_Index()
+        print '  Loaded the index of {} polygons from the parcel store in {} seconds'.format(
+                    index.num_parcels, round(time.time() - start_time, 1))
+
+    join_sr = arcpy.Describe(join_fc).spatialReference
+    tolerance = join_sr.XYTolerance or 0.0
+
+    # Join the points
+    start_time = time.time()
+    target_values = {}
+    points = []
+    with arcpy.da.SearchCursor(target_fc, ['OID@', 'SHAPE@XY'] + [field.name for field in target_fields]) as cursor:
+        for row in cursor:
+            x, y = row[1] if row[1] != None else (None, None)
+            points.append((row[0], x, y))
+            target_values[row[0]] = (row[1],) + tuple(row[2:])
+
+    target_sr = arcpy.Describe(target_fc).spatialReference
+    if target_sr.name != join_sr.name:
+        print '  Projecting the points from "{}" to "{}" for the join'.format(target_sr.name, join_sr.name)
+        points = []
+        with arcpy.da.SearchCursor(target_fc, ['OID@', 'SHAPE@XY'], spatial_reference=join_sr) as cursor:
+            for row in cursor:
+                x, y = row[1] if row[1] != None else (None, None)
+                points.append((row[0], x, y))
+
+    if parcel_store == None:
+        rows = DA_Spatial_Join.Join_Points(points, index, tolerance)
+    elif assignments_file == None:
+        import DA_Parcel_Store
+        rows = DA_Parcel_Store.Join_Points_Parallel(parcel_store.store_folder, points, tolerance, processes)
+    else:
+        import DA_Parcel_Store
+
+        # The ReportNumber of each point
+        report_numbers = [None] * len(points)
+        target_field_names = [field.name.lower() for field in target_fields]
+        if 'reportnumber' in target_field_names:
+            value_num = target_field_names.index('reportnumber') + 1
+            report_numbers = [target_values[key][value_num] for key, x, y in points]
+
+        last_assignments = DA_Parcel_Store.Load_Assignments(assignments_file)
+        rows, assignments, counts = DA_Parcel_Store.Join_Points_Incremental(parcel_store, points, report_numbers,
+                                                                            last_assignments, tolerance, processes)
+        print '  Joined {} new, moved or changed points, reused the parcels of {} points'.format(counts['joined'], counts['reused'])
+
+        try:
+            DA_Parcel_Store.Save_Assignments(assignments_file, assignments)
+        except Exception as e:
+            # Not a reason to stop, every point is joined next time
+            print '  WARNING, could not save the parcels of the points to:\n    {}'.format(assignments_file)
+            print '  {}'.format(str(e))
+    print '  Joined {} points to {} rows in {} seconds'.format(len(points), len(rows), round(time.time() - start_time, 1))
+
+    # Read the values of only the polygons the points are in, 1000 at a time
+    if parcel_store != None:
+        join_oids = sorted(set(join_oid for target_oid, join_oid in rows if join_oid != None))
+        oid_field = arcpy.Describe(join_fc).OIDFieldName
+        for start in range(0, len(join_oids), 1000):
+            where_clause = '{} IN ({})'.format(oid_field, ','.join(str(oid) for oid in join_oids[start:start + 1000]))
+            with arcpy.da.SearchCursor(join_fc, ['OID@'] + [field.name for field in join_fields], where_clause) as cursor:
+                for row in cursor:
+                    join_values[row[0]] = tuple(row[1:])
+
+    # Make the output FC
+    if arcpy.Exists(output_fc):
+        arcpy.Delete_management(output_fc)
+    arcpy.CreateFeatureclass_management(os.path.dirname(output_fc), os.path.basename(output_fc), 'POINT',
+                                        '', '', '', target_sr)
+
+    output_fields = ['Join_Count', 'TARGET_FID', 'JOIN_FID']
+    for field_name in output_fields:
+        arcpy.AddField_management(output_fc, field_name, 'LONG')
+
+    for field in target_fields + join_fields:
+        field_name = field.name
+        suffix = 1
+        while field_name.lower() in [name.lower() for name in output_fields]:
+            field_name = '{}_{}'.format(field.name, suffix)
+            suffix += 1
+        output_fields.append(field_name)
+
+        field_length = field.length if field.type == 'String' else ''
+        arcpy.AddField_management(output_fc, field_name, field_types[field.type], field.precision, field.scale,
+                                  field_length, field.aliasName)
+
+    # Write the rows
+    empty_join_values = (None,) * len(join_fields)
+    with arcpy.da.InsertCursor(output_fc, ['SHAPE@XY'] + output_fields) as cursor:
+        for target_oid, join_oid in rows:
+            values = target_values[target_oid]
+            if join_oid == None:
+                cursor.insertRow((values[0], 0, target_oid, -1) + values[1:] + empty_join_values)
+            else:
+                cursor.insertRow((values[0], 1, target_oid, join_oid) + values[1:] + join_values[join_oid])
+
+    return
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                             FUNCTION Get_Rings()
+def Get_Rings(shape):
+    """
+    PARAMETERS:
+      shape (arcpy.Polygon): A polygon from a 'SHAPE@' cursor, or None.
+
+    RETURNS:
+      rings (list): The esri JSON rings of the polygon (curves are densified
+        first), or [] if there is no polygon.
+    """
+
+    import json
+
+    if shape == None:
+        return []
+    if shape.hasCurves:
+        shape = shape.densify('ANGLE', 1000000, 0.0174533)
+    return json.loads(shape.JSON).get('rings', [])
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Find_Parcels_Of_Points()
+def Find_Parcels_Of_Points(point_fc, fields, parcel_store, where_clause=None):
+    """
+    PARAMETERS:
+      point_fc (str): Full path to a point FC (or a layer of one).
+      fields (list of str): The fields to read of each point.
+      parcel_store (DA_Parcel_Store.Parcel_Store): The parcel store.
+      where_clause {str}: Only the points that match it. OPTIONAL.
+
+    RETURNS:
+      points (list): (values of the 'fields', parcels) of each point, where
+        'parcels' are the positions in the store of the parcels the point is
+        on (see DA_Parcel_Store.Parcel_Store.Get_Value()).  A point with no
+        geometry is on no parcel.
+
+    FUNCTION:
+      To find the parcels the points are on without selecting by location.
+      The points are read in the spatial reference of the store.
+    """
+
+    spatial_reference = None
+    if parcel_store.spatial_reference:
+        spatial_reference = arcpy.SpatialReference()
+        spatial_reference.loadFromString(parcel_store.spatial_reference)
+
+    index = parcel_store.Get_Index()
+    points = []
+    with arcpy.da.SearchCursor(point_fc, ['SHAPE@XY'] + fields, where_clause, spatial_reference=spatial_reference) as cursor:
+        for row in cursor:
+            parcels = []
+            if row[0] != None and row[0][0] != None:
+                parcels = index.Query(row[0][0], row[0][1], parcel_store.xy_tolerance)
+            points.append((tuple(row[1:]), parcels))
+
+    return points
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #                          Function Handle Stacked Parcels
@@ -1597,7 +2507,8 @@ def Fields_Calculate_Fields(wkg_data, calc_fields_csv):
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #                          Function QA/QC Data
-def QA_QC_Data(orig_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extract, match_Report_to_APN_txt, arcpy_version):
+def QA_QC_Data(orig_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extract, match_Report_to_APN_txt, arcpy_version, parcel_store=None,
+               columnar_snapshot=None):
     """
     PARAMETERS:
       orig_fc (str): Full path to the originally downloaded AGOL data.
@@ -1620,6 +2531,16 @@ def QA_QC_Data(orig_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extr
         which arcpy geoprocessing tasks will be run (Servers can have different
         versions on them from the desktop software)
 
+      parcel_store {DA_Parcel_Store.Parcel_Store}: The parcel store made by
+        Refresh_Parcel_Cache().  If given, checks 1) and 2) find the parcels
+        the features are on in the store instead of selecting by location.
+        OPTIONAL.
+
+      columnar_snapshot {DA_Columnar_Snapshot.Columnar_Snapshot}: The
+        columnar copy of 'orig_fc' (see Get_Columnar_Snapshot()).  If given,
+        check 3) reads the Report Numbers from it instead of the FC.
+        OPTIONAL.
+
     RETURNS:
       success (bool):
         True if the function completed successfully,
@@ -1695,7 +2616,16 @@ def QA_QC_Data(orig_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extr
 
         # Select features that do not intersect the parcel_extract
         arcpy.MakeFeatureLayer_management(orig_fc, 'orig_fc_lyr')
-        if arcpy_version != '10.2.2':
+        if parcel_store != None:
+            # Select the features that are on no parcel in the parcel store
+            oid_field = arcpy.Describe(orig_fc).OIDFieldName
+            not_on_parcel_oids = [values[0] for values, parcels in Find_Parcels_Of_Points(orig_fc, ['OID@'], parcel_store)
+                                  if len(parcels) == 0]
+            arcpy.SelectLayerByAttribute_management('orig_fc_lyr', 'NEW_SELECTION', '1 = 0')
+            for start in range(0, len(not_on_parcel_oids), 1000):
+                where_clause = '{} IN ({})'.format(oid_field, ','.join(str(oid) for oid in not_on_parcel_oids[start:start + 1000]))
+                arcpy.SelectLayerByAttribute_management('orig_fc_lyr', 'ADD_TO_SELECTION', where_clause)
+        elif arcpy_version != '10.2.2':
             arcpy.SelectLayerByLocation_management('orig_fc_lyr', 'INTERSECT', parcels_extract, '', 'NEW_SELECTION', 'INVERT')
         else:
             # The 10.2.2 arcpy version doesn't have an 'INVERT' parameter, so we have to perform 2 tools to achieve the same result
@@ -1731,14 +2661,20 @@ def QA_QC_Data(orig_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extr
         # Select features that have are NULL for [APN] and intersect parcel_extract
         where_clause = "APN IS NULL"
         arcpy.MakeFeatureLayer_management(working_fc, 'working_fc_lyr', where_clause)
-        arcpy.SelectLayerByLocation_management('working_fc_lyr', 'INTERSECT', parcels_extract)
 
         no_apn_info_ls = []
 
-        with arcpy.da.SearchCursor('working_fc_lyr', ['ReportNumber']) as cursor:
-            for row in cursor:
-                no_apn_info_ls.append(row[0])
-            del cursor
+        if parcel_store == None:
+            arcpy.SelectLayerByLocation_management('working_fc_lyr', 'INTERSECT', parcels_extract)
+
+            with arcpy.da.SearchCursor('working_fc_lyr', ['ReportNumber']) as cursor:
+                for row in cursor:
+                    no_apn_info_ls.append(row[0])
+                del cursor
+        else:
+            for row in Find_Parcels_Of_Points('working_fc_lyr', ['ReportNumber'], parcel_store):
+                if len(row[1]) > 0:
+                    no_apn_info_ls.append(row[0][0])
 
         # Report findings
         if (len(no_apn_info_ls) > 0):
@@ -1767,20 +2703,31 @@ def QA_QC_Data(orig_fc, working_fc, QA_QC_log_folder, dt_to_append, parcels_extr
         # Use data from AGOL (orig_fc) before it is potentially split into
         # multiple records by the Spatial Join proecss, which would result in false
         # positive results when searching for duplicate Report Numbers
-        with arcpy.da.SearchCursor(orig_fc, ['ReportNumber']) as cursor:
-            for row in cursor:
-                report_number = row[0]
+        if columnar_snapshot != None and 'ReportNumber' in columnar_snapshot.columns:
+            # Count the string codes of the column, only the duplicates are decoded
+            import numpy as np
+            codes = np.asarray(columnar_snapshot.Column('ReportNumber'))
+            unique_codes, first_rows, counts = np.unique(codes, return_index=True, return_counts=True)
+            for index in np.argsort(first_rows):
+                if counts[index] > 1:
+                    code = int(unique_codes[index])
+                    report_number = columnar_snapshot.strings[code] if code >= 0 else None
+                    dup_list.extend([report_number] * (counts[index] - 1))
 
-                # Sort each report number into one of two lists
-                if report_number in orig_list:
-                    dup_list.append(report_number)
-                else:
-                    orig_list.append(report_number)
+        else:
+            with arcpy.da.SearchCursor(orig_fc, ['ReportNumber']) as cursor:
+                for row in cursor:
+                    report_number = row[0]
 
-            del cursor
+                    # Sort each report number into one of two lists
+                    if report_number in orig_list:
+                        dup_list.append(report_number)
+                    else:
+                        orig_list.append(report_number)
+
+                del cursor
 
         if (len(dup_list) > 0):
-            del row  # if len() > 0 then there was a 'row' variable created.  Delete it.
             print '  WARNING! There were duplicate Report Numbers:'
             for dup in dup_list:
                 print '    {}'.format(dup)
@@ -2106,40 +3053,26 @@ def Get_Token(cfgFile, gtURL="https://www.arcgis.com/sharing/rest/generateToken"
         online database.
 
     RETURNS:
-      token (str): A long string that acts as an access code to AGOL servers.
-        Used in later functions to gain access to our data.
+      token (DA_AGOL_Token.Token_Provider): Acts as an access code to AGOL
+        servers and can be used anywhere a token string is used.  Used in later
+        functions to gain access to our data.
 
     FUNCTION: Gets a token from AGOL that allows access to the AGOL data.
+      The token is cached (with when it expires) in the local profile of the
+      account running the script, so the other DA scripts (and the next run)
+      reuse it instead of asking AGOL for a new one.  A new token is gotten
+      before the current one expires, so a long download or update doesn't
+      fail half way through.
     """
 
     print '--------------------------------------------------------------------'
     print "Getting Token..."
 
-    import ConfigParser, urllib, urllib2, json
+    import DA_AGOL_Token
 
-    # Get the user name and password from the cfgFile
-    configRMA = ConfigParser.ConfigParser()
-    configRMA.read(cfgFile)
-    usr = configRMA.get("AGOL","usr")
-    pwd = configRMA.get("AGOL","pwd")
-
-    # Create a dictionary of the user name, password, and 2 other keys
-    gtValues = {'username' : usr, 'password' : pwd, 'referer' : 'http://www.arcgis.com', 'f' : 'json' }
-
-    # Encode the dictionary so they are in URL format
-    gtData = urllib.urlencode(gtValues)
-
-    # Create a request object with the URL adn the URL formatted dictionary
-    gtRequest = urllib2.Request(gtURL,gtData)
-
-    # Store the response to the request
-    gtResponse = urllib2.urlopen(gtRequest)
-
-    # Store the response as a json object
-    gtJson = json.load(gtResponse)
-
-    # Store the token from the json object
-    token = gtJson['token']
+    # Get the user name and password from the cfgFile and get the cached token,
+    #  or a new token from gtURL if there is no cached token that is still good
+    token = DA_AGOL_Token.Get_Token_Provider(cfgFile, gtURL)
     ##print token  # For testing purposes
 
     print "Successfully retrieved token.\n"
@@ -2277,25 +3210,21 @@ def AGOL_Get_Object_Ids_Where(name_of_FS, index_of_layer_in_FS, where_clause, to
 
     ##print '  ------------------------------------------------------------------'
     ##print "  Starting AGOL_Get_Object_Ids_Where()"
-    import urllib2, urllib, json
+    import json
+    import DA_HTTP_Client
 
     # Create empty list to hold the OBJECTID's that satisfy the where clause
     object_ids = []
 
-    # Encode the where_clause so it is readable by URL protocol (ie %27 = ' in URL).
-    # visit http://meyerweb.com/eric/tools/dencoder to test URL encoding.
-    where_encoded = urllib.quote(where_clause)
-
-    # Set URLs
+    # Set URL and query (the HTTP client encodes the where_clause for the URL)
     query_url = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/ArcGIS/rest/services/{}/FeatureServer/{}/query'.format(name_of_FS, index_of_layer_in_FS)
-    query = '?where={}&returnIdsOnly=true&f=json&token={}'.format(where_encoded, token)
-    get_object_id_url = query_url + query
+    query_params = {'where': where_clause, 'returnIdsOnly': 'true', 'f': 'json', 'token': token}
 
     # Get the list of OBJECTID's that satisfied the where_clause
     ##print '    Getting list of OBJECTID\'s that satisfied the where clause for layer:\n      {}'.format(query_url)
     print '    Where clause: "{}"'.format(where_clause)
-    response = urllib2.urlopen(get_object_id_url)
-    response_json_obj = json.load(response)
+    response = DA_HTTP_Client.Get_Client().Request(query_url, query_params, 'GET')
+    response_json_obj = json.loads(response.body)
     try:
         object_ids = response_json_obj['objectIds']
     except KeyError:
@@ -2345,7 +3274,8 @@ def AGOL_Update_Features(name_of_FS, index_of_layer_in_FS, object_id, field_to_u
 
     ##print '  ------------------------------------------------------------------'
     ##print "  Starting AGOL_Update_Features()"
-    import urllib2, urllib, json
+    import json
+    import DA_HTTP_Client
 
     success = True
 
@@ -2355,7 +3285,7 @@ def AGOL_Update_Features(name_of_FS, index_of_layer_in_FS, object_id, field_to_u
 
     # Set URLs
     update_url       = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/ArcGIS/rest/services/{}/FeatureServer/{}/updateFeatures?token={}'.format(name_of_FS, index_of_layer_in_FS, token)
-    update_params    = urllib.urlencode({'Features': features_json, 'f':'json'})
+    update_params    = {'Features': features_json, 'f':'json'}
 
 
     # Update the features
@@ -2366,8 +3296,8 @@ def AGOL_Update_Features(name_of_FS, index_of_layer_in_FS, object_id, field_to_u
     ##print '     New value for updt fld: {}'.format(new_value)
 
     ##print update_url + update_params
-    response  = urllib2.urlopen(update_url, update_params)
-    response_json_obj = json.load(response)
+    response  = DA_HTTP_Client.Get_Client().Request(update_url, update_params, 'POST')
+    response_json_obj = json.loads(response.body)
     ##print response_json_obj
 
     for result in response_json_obj['updateResults']:
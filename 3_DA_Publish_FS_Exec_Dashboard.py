@@ -16,6 +16,11 @@ NOTE:
      right after turning the print statements to a log writing object
      Write_Print_To_Log().
 
+   If the download script found that the layer has NOT changed since the
+     last successful run (it writes a NO_CHANGES file to the
+     success_error_folder), the publish is skipped, but the success file is
+     still written.
+
 2. Write a success or error text file to the success_error_folder so that
       subsequently called scripts will know if this script ran successfully
       or not.  This happens right before the end of script reporting.
@@ -73,12 +78,8 @@ import sys
 import time
 import datetime
 
-import urllib2
-import urllib
 import json
 import mimetypes
-import gzip
-from io import BytesIO
 import string
 import random
 
@@ -86,6 +87,10 @@ from xml.etree import ElementTree as ET
 import arcpy
 import shutil
 
+import DA_AGOL_Token
+import DA_HTTP_Cache
+import DA_HTTP_Client
+
 #-------------------------------------------------------------------------------
 #                             Set Variables <MG 02/12/2018>
 #-------------------------------------------------------------------------------
@@ -113,6 +118,7 @@ root_folder = config.get('Paths', 'Root_Folder')
 # Set the path to the success/fail files
 success_error_folder = '{}\Scripts\Source_Code\Control_Files\Success_Error'.format(root_folder)
 process_success_file = 'SUCCESS_running_DA_Process_Fire_Data.txt'  # Hard Coded into variable here
+no_changes_file      = 'NO_CHANGES_DA_Download_Fire_Data.txt'       # Hard Coded into variable here
 publish_success_file  = 'SUCCESS_running_{}.txt'.format(name_of_script.split('.')[0])
 
 # Log file is a concatenation of the path to the log folder and the name of the script (w/o the .py)
@@ -288,31 +294,35 @@ class AGOLHandler(object):
         self.base_url = "https://www.arcgis.com/sharing/rest"
         self.proxyDict = proxyDict
         self.serviceName = serviceName
-        self.token = self.getToken(username, password)
+
+        # Set up the proxies once, every request in url_request() then uses them
+        if self.proxyDict:
+            DA_HTTP_Client.Configure(proxies=self.proxyDict)
+
+        self.token_provider = self.getToken(username, password)
         self.itemID = self.findItem("Feature Service")
         self.SDitemID = self.findItem("Service Definition")
         self.folderName = folderName
         self.folderID = self.findFolder()
 
     def getToken(self, username, password, exp=60):
-
-        referer = "http://www.arcgis.com/"
-        query_dict = {'username': username,
-                      'password': password,
-                      'expiration': str(exp),
-                      'client': 'referer',
-                      'referer': referer,
-                      'f': 'json'}
+        """ Get the token provider for the account (see DA_AGOL_Token).
+        The token is shared with the other DA scripts through the token cache
+        of the account running them, and a new one is gotten before it
+        expires, so a long upload doesn't fail half way through.
+        Raises an Exception if AGOL doesn't give a token.
+        """
 
         token_url = '{}/generateToken'.format(self.base_url)
 
-        token_response = self.url_request(token_url, query_dict, 'POST')
+        return DA_AGOL_Token.Get_User_Token_Provider(username, password, token_url, exp)
 
-        if "token" not in token_response:
-            print(token_response['error'])
-            sys.exit()
-        else:
-            return token_response['token']
+    @property
+    def token(self):
+        """ A token that is good for at least 15 more minutes.
+        """
+
+        return self.token_provider.Get()
 
     def findItem(self, findType):
         """ Find the itemID of whats being updated
@@ -541,35 +551,25 @@ class AGOLHandler(object):
             dictionary of response from portal instance.
         """
 
-        if request_type == 'GET':
-            req = urllib2.Request('?'.join((in_url, urllib.urlencode(request_parameters))))
-        elif request_type == 'MULTIPART':
-            req = urllib2.Request(in_url, request_parameters)
-        else:
-            req = urllib2.Request(
-                in_url, urllib.urlencode(request_parameters), self.headers)
+        # The shared client keeps the connection to the portal open between
+        # requests, asks for (and unzips) gzip, and uses the proxy set up in
+        # __init__()
+        client = DA_HTTP_Client.Get_Client()
 
+        headers = {}
+        if request_type not in ('GET', 'MULTIPART'):
+            headers.update(self.headers)
         if additional_headers:
-            for key, value in list(additional_headers.items()):
-                req.add_header(key, value)
-        req.add_header('Accept-encoding', 'gzip')
+            headers.update(additional_headers)
 
-        if self.proxyDict:
-            p = urllib2.ProxyHandler(self.proxyDict)
-            auth = urllib2.HTTPBasicAuthHandler()
-            opener = urllib2.build_opener(p, auth, urllib2.HTTPHandler)
-            urllib2.install_opener(opener)
-
-        response = urllib2.urlopen(req)
-
-        if response.info().get('Content-Encoding') == 'gzip':
-            buf = BytesIO(response.read())
-            with gzip.GzipFile(fileobj=buf) as gzip_file:
-                response_bytes = gzip_file.read()
+        if request_type == 'GET':
+            response = client.Request(in_url, request_parameters, 'GET', headers)
+        elif request_type == 'MULTIPART':
+            response = client.Request(in_url, None, 'POST', headers, request_parameters)
         else:
-            response_bytes = response.read()
+            response = client.Request(in_url, request_parameters, 'POST', headers)
 
-        response_text = response_bytes.decode('UTF-8')
+        response_text = response.body.decode('UTF-8')
         response_json = json.loads(response_text)
 
         if not response_json or "error" in response_json:
@@ -729,6 +729,14 @@ if __name__ == "__main__":
     # Turn all 'print' statements into a log-writing object
     orig_stdout, log_file_date = Write_Print_To_Log(log_file)
 
+    # Record or replay the responses from AGOL (see DA_HTTP_Cache.py)
+    try:
+        DA_HTTP_Cache.Configure_From_Config(cfgFile)
+    except Exception as e:
+        success = False
+        print '*** ERROR with DA_HTTP_Cache.Configure_From_Config() ***'
+        print str(e)
+
     # Make sure that the data was processed successfully before trying to process it.
     if os.path.exists('{}\{}'.format(success_error_folder, process_success_file)):
         print '  \nDA_Process_Fire_Data.py was run successfully, publishing the data now\n'
@@ -744,7 +752,15 @@ if __name__ == "__main__":
         print '  Please fix any problems with that script first. Then try again.'
         print '  You can find the log file at:\n    {}'.format(log_file)
 
+    # Don't republish if the layer hasn't changed since the last successful run
+    no_changes = False
     if success == True:
+        if os.path.exists('{}\{}'.format(success_error_folder, no_changes_file)):
+            no_changes = True
+            print '  DA_Download_Fire_Data.py found NO CHANGES in the layer since the last successful run.'
+            print '  The published Feature Service is already up to date, skipping the publish.\n'
+
+    if success == True and no_changes == False:
         # Find and gather settings from the ini file
         localPath = sys.path[0]
         ##settingsFile = os.path.join(localPath, name_of_cfgFile) <MG 20180212: Commented out to allow for full path to .ini>
@@ -787,7 +803,7 @@ if __name__ == "__main__":
             http_proxy = "http://" + pxy_user + ":" + pxy_pass + "@" + pxy_srvr + ":" + pxy_port
             https_proxy = "http://" + pxy_user + ":" + pxy_pass + "@" + pxy_srvr + ":" + pxy_port
             ftp_proxy = "http://" + pxy_user + ":" + pxy_pass + "@" + pxy_srvr + ":" + pxy_port
-            proxyDict = {"phttp": http_proxy, "https": https_proxy, "ftp": ftp_proxy}
+            proxyDict = {"http": http_proxy, "https": https_proxy, "ftp": ftp_proxy}
 
         # create a temp directory under the script
         tempDir = os.path.join(localPath, "tempDir")
@@ -796,8 +812,14 @@ if __name__ == "__main__":
         finalSD = os.path.join(tempDir, serviceName + ".sd")
 
         # initialize AGOLHandler class
-        agol = AGOLHandler(inputUsername, inputPswd, serviceName, folderName, proxyDict)
+        try:
+            agol = AGOLHandler(inputUsername, inputPswd, serviceName, folderName, proxyDict)
+        except Exception as e:
+            success = False
+            print '\n*** ERROR with AGOLHandler() ***'
+            print str(e)
 
+    if success == True and no_changes == False:
         # Turn map document into .SD file for uploading
         print 'Using MXD at: {} to create .SD file'.format(MXD)
         makeSD(MXD, serviceName, tempDir, finalSD, maxRecords, tags, summary)
@@ -7,6 +7,12 @@ This script will:
     1) Create and write to a log file.
     2) Get a token that gives permission to view the AGOL data.
     3) Download the attachments.
+       This is skipped if 'DA_Download_Fire_Data.py' found that the layer has
+       NOT changed since the last successful run (it writes a NO_CHANGES file
+       to the success_error_folder).
+    4) If this script and all the scripts before it ran successfully, save
+       the signature of the layer that 'DA_Download_Fire_Data.py' took as the
+       signature of the last successful run (see DA_Layer_Signature.py).
 
 NOTE: The CreateReplica URL used in this script gets a replica of the full
   database, this means that even if the Feature Service is set to return 1,000
@@ -107,6 +113,19 @@ def main():
 
     # Set the path to the success/fail files
     success_error_folder = '{}\Scripts\Source_Code\Control_Files\Success_Error'.format(root_folder)
+    no_changes_file      = 'NO_CHANGES_DA_Download_Fire_Data.txt'  # Hard Coded into variable here
+
+    # The success files of all the scripts in the series (this one included)
+    #  that must exist before the signature of the layer is saved
+    all_success_files = ['SUCCESS_running_DA_Download_Fire_Data.txt',
+                         'SUCCESS_running_DA_Process_Fire_Data.txt',
+                         'SUCCESS_running_DA_Publish_FS_Exec_Dashboard.txt',
+                         'SUCCESS_running_{}.txt'.format(name_of_script.split('.')[0])]
+
+    # Set the paths to the signature of the layer (written by DA_Download_Fire_Data.py)
+    data_folder            = '{}\Data'.format(root_folder)
+    signature_file         = '{}\DA_Fire_Layer_Signature.json'.format(data_folder)
+    pending_signature_file = '{}\DA_Fire_Layer_Signature_Pending.json'.format(data_folder)
 
     # Set the Get Attachments URL
     gaURL  = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/arcgis/rest/services/{}/FeatureServer/CreateReplica?'.format(name_of_FS)
@@ -136,6 +155,16 @@ def main():
             print '*** ERROR with Write_Print_To_Log() ***'
             print str(e)
 
+    # Record or replay the responses from AGOL (see DA_HTTP_Cache.py)
+    if success == True:
+        try:
+            import DA_HTTP_Cache
+            DA_HTTP_Cache.Configure_From_Config(cfgFile)
+        except Exception as e:
+            success = False
+            print '*** ERROR with DA_HTTP_Cache.Configure_From_Config() ***'
+            print str(e)
+
     #---------------------------------------------------------------------------
     #                         Check Folder Schema.
     #          Confirm all folders/files needed in this script exist
@@ -160,8 +189,19 @@ def main():
             print '*** ERROR with Get_Token() ***'
             print str(e)
 
-    # Get Attachments
+    #---------------------------------------------------------------------------
+    # Don't download the attachments if the layer hasn't changed since the
+    # last successful run
+    no_changes = False
+    num_downloaded = 0
     if success == True:
+        if os.path.exists('{}\{}'.format(success_error_folder, no_changes_file)):
+            no_changes = True
+            print '\n  DA_Download_Fire_Data.py found NO CHANGES in the layer since the last successful run.'
+            print '  The attachments are already up to date, skipping the download.\n'
+
+    # Get Attachments
+    if success == True and no_changes == False:
         try:
             num_downloaded, success = Get_Attachments(token, gaURL, Attachment_Folder, attachment_name_prefix, use_field_to_name_attachment)
         except Exception as e:
@@ -190,6 +230,17 @@ def main():
         print '*** ERROR with Writing a Success or Fail file() ***'
         print str(e)
 
+    #---------------------------------------------------------------------------
+    # If all the scripts ran successfully, save the signature of the layer so
+    # the next run can tell if anything has changed
+    if success == True:
+        try:
+            Commit_Layer_Signature(success_error_folder, all_success_files, pending_signature_file, signature_file)
+        except Exception as e:
+            # Not a reason to fail, the next run will just process the layer again
+            print '*** WARNING with Commit_Layer_Signature() ***'
+            print str(e)
+
     #---------------------------------------------------------------------------
     # Email recipients
     if success == True:
@@ -244,6 +295,54 @@ def main():
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 #-------------------------------------------------------------------------------
 
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Commit_Layer_Signature()
+def Commit_Layer_Signature(success_error_folder, all_success_files, pending_signature_file, signature_file):
+    """
+    PARAMETERS:
+      success_error_folder (str): Full path to the folder with the success and
+        error files of the scripts.
+      all_success_files (list of str): The names of the success files that
+        must ALL exist before the signature is saved.
+      pending_signature_file (str): Full path to the signature of the layer
+        taken by 'DA_Download_Fire_Data.py' during this run.
+      signature_file (str): Full path to the signature of the layer from the
+        last successful run.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To make the signature of the layer taken during this run the signature
+      of the last successful run, but only if all the scripts ran
+      successfully.  If any of them didn't, the pending signature is left
+      alone so the next run processes the layer again.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Commit_Layer_Signature()'
+
+    import DA_Layer_Signature
+
+    missing_files = [f for f in all_success_files if not os.path.exists('{}\{}'.format(success_error_folder, f))]
+
+    if len(missing_files) > 0:
+        print '  Not all of the scripts ran successfully, NOT saving the signature of the layer.'
+        print '  Missing success files:'
+        for missing_file in missing_files:
+            print '    {}'.format(missing_file)
+
+    elif DA_Layer_Signature.Commit_Pending_Signature(pending_signature_file, signature_file):
+        print '  All of the scripts ran successfully, saved the signature of the layer to:'
+        print '    {}'.format(signature_file)
+
+    else:
+        print '  There is no new signature of the layer to save (it had not changed)'
+
+    print 'Finished Commit_Layer_Signature()\n'
+
+    return
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 #                          FUNCTION Write_Print_To_Log()
@@ -349,40 +448,26 @@ def Get_Token(cfgFile, gtURL="https://www.arcgis.com/sharing/rest/generateToken"
         online database.
 
     RETURNS:
-      token (str): A long string that acts as an access code to AGOL servers.
-        Used in later functions to gain access to our data.
+      token (DA_AGOL_Token.Token_Provider): Acts as an access code to AGOL
+        servers and can be used anywhere a token string is used.  Used in later
+        functions to gain access to our data.
 
     FUNCTION: Gets a token from AGOL that allows access to the AGOL data.
+      The token is cached (with when it expires) in the local profile of the
+      account running the script, so the other DA scripts (and the next run)
+      reuse it instead of asking AGOL for a new one.  A new token is gotten
+      before the current one expires, so a long download or update doesn't
+      fail half way through.
     """
 
     print '--------------------------------------------------------------------'
     print "Getting Token..."
 
-    import ConfigParser, urllib, urllib2, json
-
-    # Get the user name and password from the cfgFile
-    configRMA = ConfigParser.ConfigParser()
-    configRMA.read(cfgFile)
-    usr = configRMA.get("AGOL","usr")
-    pwd = configRMA.get("AGOL","pwd")
-
-    # Create a dictionary of the user name, password, and 2 other keys
-    gtValues = {'username' : usr, 'password' : pwd, 'referer' : 'http://www.arcgis.com', 'f' : 'json' }
+    import DA_AGOL_Token
 
-    # Encode the dictionary so they are in URL format
-    gtData = urllib.urlencode(gtValues)
-
-    # Create a request object with the URL adn the URL formatted dictionary
-    gtRequest = urllib2.Request(gtURL,gtData)
-
-    # Store the response to the request
-    gtResponse = urllib2.urlopen(gtRequest)
-
-    # Store the response as a json object
-    gtJson = json.load(gtResponse)
-
-    # Store the token from the json object
-    token = gtJson['token']
+    # Get the user name and password from the cfgFile and get the cached token,
+    #  or a new token from gtURL if there is no cached token that is still good
+    token = DA_AGOL_Token.Get_Token_Provider(cfgFile, gtURL)
     ##print token  # For testing purposes
 
     print "Successfully retrieved token.\n"
@@ -444,7 +529,11 @@ def Get_Attachments(token, gaURL, gaFolder, attachment_name_prefix, use_field_to
     print '--------------------------------------------------------------------'
     print 'Starting Get_Attachments()'
 
-    import time, urllib, urllib2, json, os
+    import time, json, os
+    import DA_HTTP_Client
+
+    # All the requests below go through the same kept open connections
+    client = DA_HTTP_Client.Get_Client()
 
     # Flag to control if this entire function ran successfully
     success = True
@@ -481,10 +570,8 @@ def Get_Attachments(token, gaURL, gaFolder, attachment_name_prefix, use_field_to
     }
 
     # Get the Replica URL
-    gaData = urllib.urlencode(gaValues)
-    gaRequest = urllib2.Request(gaURL, gaData)
-    gaResponse = urllib2.urlopen(gaRequest)
-    gaJson = json.load(gaResponse)
+    gaResponse = client.Request(gaURL, gaValues, 'POST')
+    gaJson = json.loads(gaResponse.body)
     ##print gaJson
     try:
         replicaUrl = gaJson['URL']
@@ -521,7 +608,7 @@ def Get_Attachments(token, gaURL, gaFolder, attachment_name_prefix, use_field_to
     # Save the file
     # NOTE: the file is saved to the 'faFolder' + 'JsonFileName'
     jsonFilePath = gaFolder + '\\' + JsonFileName # Path to the downloaded json file
-    urllib.urlretrieve(replicaUrl_token, jsonFilePath)
+    client.Download_File(replicaUrl_token, jsonFilePath)
 
     ##print '  Temp JSON file saved to: ' + jsonFilePath  # For testing purposes
 
@@ -583,13 +670,14 @@ def Get_Attachments(token, gaURL, gaFolder, attachment_name_prefix, use_field_to
                 try:
                     # Get the token to download the attachment
                     gaValues = {'token' : token }
-                    gaData = urllib.urlencode(gaValues)
 
                     # Get the attachment and save as attachPath
+                    # (a failed download doesn't leave a partial .jpg behind,
+                    #  so it is downloaded again on the next run)
                     attachmentUrl = attachment['url']
                     attach_path = os.path.join(gaFolder, attach_name)
                     print '    {} is being downloaded.'.format(attach_name)
-                    urllib.urlretrieve(url=attachmentUrl, filename=attach_path,data=gaData)
+                    client.Download_File(attachmentUrl, attach_path, gaValues, 'POST')
                     attachment_dl = True
                     number_dl+=1
                 except Exception as e:
@@ -604,6 +692,7 @@ def Get_Attachments(token, gaURL, gaFolder, attachment_name_prefix, use_field_to
         print '\n  No attachments saved this run.\n  OK if no new attachments since last script run.'
 
     print '\n  All attachments can be found at:\n    %s' % gaFolder
+    client.Print_Stats()
 
     # Delete the JSON file since it is no longer needed.
     ##print '  Deleting JSON file'
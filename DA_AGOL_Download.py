@@ -0,0 +1,1199 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_AGOL_Download.py
+# Purpose:
+"""
+Functions used by 'DA_Download_Fire_Data.py' to download the features in an
+AGOL Feature Service layer.
+
+This file does NOT import arcpy.  It only talks to the REST end points of the
+Feature Service and returns the JSON pages that the server sends back.  Writing
+those pages to a FGDB is done by the script that calls these functions.
+Because of that, these functions can be pointed at a local stand-in
+FeatureServer (anything that answers '<FS_url>?f=json' and
+'<FS_url>/<index>/query') to test the download without AGOL or arcpy.
+
+The layer is split into pages using the list of OBJECTIDs the layer actually
+has (see Build_OID_List_Batches()), and the pages are downloaded by a pool of
+worker threads.  The number of workers is bounded by the 'num_workers'
+parameter, and the pages are always returned in the same order that they were
+asked for, no matter what order the workers finish in.
+
+A page that the server cuts short ('exceededTransferLimit') is split and the
+missing features are downloaded in smaller pages, and the size of the pages
+is tuned from run to run to the fastest size for the network (see
+Choose_Page_Size()).
+
+A page that fails (i.e. a 5xx or a timeout) is tried again after waiting
+(2, 4, 8... seconds).  If a checkpoint folder is used, every page is saved to
+it as soon as it is downloaded, so a run that fails part way can be restarted
+and only download the pages it doesn't have yet (see Open_Checkpoint()).
+"""
+#-------------------------------------------------------------------------------
+
+import hashlib, httplib, json, os, shutil, socket, threading, time
+from multiprocessing.pool import ThreadPool
+
+import DA_File_Utils
+import DA_HTTP_Client
+
+# The most rounds of requests for the features the server left out of a page
+#  (see Download_Pages())
+MAX_PAGE_PARTS = 10
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                             FUNCTION Get_JSON()
+def Get_JSON(url, params, timeout=120):
+    """
+    PARAMETERS:
+      url (str): The URL of the REST end point (without any query string).
+      params (dict): The parameters to send to the end point.  They are sent
+        in the body of a POST so long where clauses and lists of OBJECTIDs
+        don't run into URL length limits.
+      timeout {int}: Number of seconds to wait for the server. OPTIONAL.
+
+    RETURNS:
+      response_json (dict): The JSON response from the server.
+      seconds (float): How long the request took.
+      num_bytes (int): The size of the response (as sent over the network,
+        so gzipped if the server gzipped it).
+
+    FUNCTION:
+      To send one request to a REST end point and time it.  If the server
+      returns an error message a DA_HTTP_Client.JSON_Error is raised with that
+      message and the error code.
+      The request is sent with the shared DA_HTTP_Client, so the connection
+      to the server is kept open and reused.
+      If the token is a DA_AGOL_Token.Token_Provider and the server says the
+      token is invalid (i.e. a cached token that was revoked), the request is
+      sent once more with a new token.
+    """
+
+    start_time = time.time()
+
+    response = DA_HTTP_Client.Get_Client().Request(url, params, 'POST', timeout=timeout)
+    response_json = json.loads(response.body)
+
+    token = params.get('token')
+    if 'error' in response_json and response_json['error'].get('code') in (498, 499) and hasattr(token, 'Invalidate'):
+        print '  Token was not accepted, getting a new token and trying again'
+        token.Invalidate()
+        response = DA_HTTP_Client.Get_Client().Request(url, params, 'POST', timeout=timeout)
+        response_json = json.loads(response.body)
+
+    seconds = time.time() - start_time
+
+    if 'error' in response_json:
+        raise DA_HTTP_Client.JSON_Error(url, response_json['error'])
+
+    return response_json, seconds, response.num_bytes
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                             FUNCTION Get_PBF()
+def Get_PBF(url, params, layer_fields=None, timeout=120):
+    """
+    PARAMETERS:
+      url (str): The '/query' URL of the layer.
+      params (dict): The query parameters.  'f' is set to 'pbf'.
+      layer_fields {list of dict}: The 'fields' of the layer, passed on to
+        DA_PBF_Decoder.Decode_Feature_Collection(). OPTIONAL.
+      timeout {int}: Number of seconds to wait for the server. OPTIONAL.
+
+    RETURNS:
+      response_json (dict): The decoded response, in the same form as the
+        'f=json' response.
+      seconds (float): How long the request (and decoding) took.
+      num_bytes (int): The size of the response.
+
+    FUNCTION:
+      To send one query that asks for the compact protocol buffer format
+      and decode it.  If the server sends back JSON instead (which it does
+      for errors) it is handled like Get_JSON() does.  If the response
+      can't be decoded DA_PBF_Decoder.PBF_Decode_Error is raised.
+    """
+
+    import DA_PBF_Decoder
+
+    start_time = time.time()
+
+    params = dict(params)
+    params['f'] = 'pbf'
+
+    response = DA_HTTP_Client.Get_Client().Request(url, params, 'POST', timeout=timeout)
+    response_bytes = response.body
+
+    if response_bytes[:1] == '{':
+        response_json = json.loads(response_bytes)
+        if 'error' in response_json:
+            raise DA_HTTP_Client.JSON_Error(url, response_json['error'])
+    else:
+        response_json = DA_PBF_Decoder.Decode_Feature_Collection(response_bytes, layer_fields)
+
+    seconds = time.time() - start_time
+
+    return response_json, seconds, response.num_bytes
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Supports_PBF()
+def Supports_PBF(layer_info):
+    """
+    PARAMETERS:
+      layer_info (dict): The layer description from Get_Layer_Info().
+
+    RETURNS:
+      supports_pbf (bool): True if the layer can return 'f=pbf' queries.
+
+    FUNCTION:
+      To check the 'supportedQueryFormats' of the layer, i.e. "JSON, geoJSON, PBF".
+    """
+
+    query_formats = layer_info.get('supportedQueryFormats') or ''
+
+    return 'pbf' in [query_format.strip().lower() for query_format in query_formats.split(',')]
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Object_Ids()
+def Get_Object_Ids(query_url, token, where_clause='1=1'):
+    """
+    PARAMETERS:
+      query_url (str): The '/query' URL of the layer.
+      token (str): The token obtained by Get_Token().
+      where_clause {str}: Only return the OBJECTIDs that satisfy this where
+        clause. OPTIONAL. Defaults to all features.
+
+    RETURNS:
+      object_ids (list of int): The sorted OBJECTIDs.
+
+    FUNCTION:
+      To get ALL the OBJECTIDs that satisfy the where clause regardless of the
+      'max records returned' setting of the Feature Service.
+    """
+
+    params = {'where'        : where_clause,
+              'returnIdsOnly': 'true',
+              'f'            : 'json',
+              'token'        : token}
+
+    response_json = Get_JSON(query_url, params)[0]
+
+    object_ids = response_json.get('objectIds') or []
+    object_ids.sort()
+
+    return object_ids
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Get_Max_Record_Count()
+def Get_Max_Record_Count(FS_url, token):
+    """
+    PARAMETERS:
+      FS_url (str): The URL of the Feature Service (up to the '/FeatureServer'
+        part).
+      token (str): The token obtained by Get_Token().
+
+    RETURNS:
+      max_record_count (int): The number of records the server will return
+        for one query.
+
+    FUNCTION:
+      To get the 'maxRecordCount' of the Feature Service.
+    """
+
+    response_json = Get_JSON(FS_url, {'f': 'json', 'token': token})[0]
+
+    return int(response_json['maxRecordCount'])
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Layer_Info()
+def Get_Layer_Info(FS_url, index_of_layer, token):
+    """
+    PARAMETERS:
+      FS_url (str): The URL of the Feature Service (up to the '/FeatureServer'
+        part).
+      index_of_layer (int): The index of the layer in the Feature Service.
+      token (str): The token obtained by Get_Token().
+
+    RETURNS:
+      layer_info (dict): The JSON description of the layer.  Some useful keys
+        are 'objectIdField', 'fields', 'editFieldsInfo' (if editor tracking
+        is on) and 'editingInfo'.
+
+    FUNCTION:
+      To get the description of one layer in a Feature Service.
+    """
+
+    layer_url = '{}/{}'.format(FS_url, index_of_layer)
+
+    return Get_JSON(layer_url, {'f': 'json', 'token': token})[0]
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Build_OID_List_Batches()
+def Build_OID_List_Batches(object_ids, max_record_count):
+    """
+    PARAMETERS:
+      object_ids (list of int): The OBJECTIDs in the layer (from
+        Get_Object_Ids()).
+      max_record_count (int): The 'maxRecordCount' of the Feature Service.
+
+    RETURNS:
+      batches (list of dict): One dictionary per page.  Each dictionary holds
+        the query parameters that are different for that page.
+        i.e. [{'objectIds': '1,2,5,...'}, ...]
+
+    FUNCTION:
+      To split the actual (sorted) OBJECTIDs of the layer into pages of
+      'max_record_count' OBJECTIDs each.
+
+      Walking contiguous 'OBJECTID >= start AND OBJECTID <= end' windows
+      downloads many near-empty (or empty) pages once features have been
+      deleted and the OBJECTIDs become sparse.  Asking for the OBJECTIDs by
+      list means every page except the last one is full, and the number of
+      pages is always ceil(number of OBJECTIDs / max_record_count).
+    """
+
+    object_ids = sorted(object_ids)
+
+    batches = []
+    for start in range(0, len(object_ids), max_record_count):
+        batch_ids = object_ids[start:start + max_record_count]
+        batches.append({'objectIds': ','.join(str(object_id) for object_id in batch_ids)})
+
+    return batches
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Download_Pages()
+def Download_Pages(query_url, batches, AGOL_fields, token, num_workers=1, output_format='json', layer_fields=None,
+                   checkpoint=None, max_retries=3, backoff_seconds=2, page_callback=None):
+    """
+    PARAMETERS:
+      query_url (str): The '/query' URL of the layer.
+        i.e. 'https://.../FeatureServer/0/query'
+      batches (list of dict): The pages to download.  See
+        Build_OID_List_Batches().
+      AGOL_fields (str): The fields we want the server to return.  Use '*'
+        to return all fields.
+      token (str): The token obtained by Get_Token().
+      num_workers {int}: The most pages that will be downloaded at the same
+        time. OPTIONAL. 1 downloads the pages one after the other.
+      output_format {str}: 'json' or 'pbf'. OPTIONAL.  With 'pbf' the pages
+        are downloaded in the compact protocol buffer format and decoded
+        (see Get_PBF()).  Only use 'pbf' if Supports_PBF() is True.
+      layer_fields {list of dict}: The 'fields' of the layer.  OPTIONAL.
+        Only used with 'pbf', to fill in the field lengths.
+      checkpoint {dict}: From Open_Checkpoint().  OPTIONAL.  If given, the
+        pages already in the checkpoint are not downloaded again, and every
+        page that is downloaded is saved to it.
+      max_retries {int}: The number of times a failed page is tried again.
+        OPTIONAL.
+      backoff_seconds {int}: The wait before the first retry of a page.  The
+        wait doubles for every retry after that. OPTIONAL.
+      page_callback {function}: Called with each page, in the order of
+        'batches', as soon as it is reassembled (i.e. to write it to the FC
+        while the next pages download). OPTIONAL.  It is called on the
+        thread that called Download_Pages().
+
+    RETURNS:
+      pages (list of dict): The JSON response for each batch, in the same
+        order as 'batches'.
+      stats (dict): Telemetry about the download.  See Print_Download_Stats().
+
+    FUNCTION:
+      To download every batch with a bounded pool of worker threads and hand
+      the pages back in order.  The latency of each page is printed as it is
+      reassembled, and the total throughput is printed at the end.
+
+      The server can send fewer features than the 'maxRecordCount' it
+      advertises (it then sets 'exceededTransferLimit').  If it does, the
+      OBJECTIDs it didn't send are downloaded in more requests and added to
+      the page, so no page is ever silently cut short.  The number of
+      features it did send is remembered as the server's real limit, and the
+      rest of the batches are split to that size before they are sent.  If
+      none of the features it sent are ones that were asked for, or a page
+      still isn't complete after 'MAX_PAGE_PARTS' rounds of this, an
+      Exception is raised instead of asking again forever.
+
+      A page that fails with a transient error (see Is_Transient_Error()) is
+      tried again up to 'max_retries' times, waiting 'backoff_seconds',
+      then twice that, etc. between tries.  If a page still fails, the
+      remaining downloads are stopped and the Exception is raised to the
+      calling function (the pages already downloaded stay in the checkpoint).
+      A 'pbf' page that can't be decoded is downloaded again as JSON.
+    """
+
+    import DA_PBF_Decoder
+
+    print '  Downloading {} page(s) with {} worker(s) as {}'.format(len(batches), num_workers, output_format.upper())
+
+    stats = {'pages'           : 0,
+             'features'        : 0,
+             'bytes'           : 0,
+             'seconds'         : 0.0,
+             'page_seconds'    : [],
+             'page_features'   : [],
+             'page_sizes'      : [len(batch['objectIds'].split(',')) for batch in batches],
+             'requests'        : 0,
+             'truncated_pages' : 0,
+             'server_cap'      : None,
+             'resumed_pages'   : 0,
+             'retries'         : 0}
+    stats_lock = threading.Lock()
+
+    def Get_Page(params):
+        if output_format == 'pbf':
+            try:
+                return Get_PBF(query_url, params, layer_fields)
+            except DA_PBF_Decoder.PBF_Decode_Error as e:
+                print '    WARNING, could not decode a PBF page, downloading it as JSON.  {}'.format(e)
+
+        return Get_JSON(query_url, params)
+
+    def Get_Page_With_Retries(params):
+        retry = 0
+        while True:
+            try:
+                return Get_Page(params)
+            except Exception as e:
+                if retry >= max_retries or not Is_Transient_Error(e):
+                    raise
+                wait_seconds = backoff_seconds * 2 ** retry
+                retry += 1
+                with stats_lock:
+                    stats['retries'] += 1
+                print '    WARNING, a page failed ({}), trying again in {} seconds (retry {} of {})'.format(
+                            e, wait_seconds, retry, max_retries)
+                time.sleep(wait_seconds)
+
+    def Download_Object_Ids(batch, object_ids, depth=0):
+        if depth > MAX_PAGE_PARTS:
+            raise Exception('The server still cut the page short after {} requests for the missing features'.format(
+                                MAX_PAGE_PARTS))
+
+        # Split to the server's real limit if it is known
+        with stats_lock:
+            server_cap = stats['server_cap']
+        if server_cap != None and len(object_ids) > server_cap:
+            parts = [Download_Object_Ids(batch, object_ids[start:start + server_cap], depth + 1)
+                     for start in range(0, len(object_ids), server_cap)]
+            return Merge_Page_Parts(parts)
+
+        params = {'outFields'     : AGOL_fields,
+                  'returnGeometry': 'true',
+                  'f'             : 'json',
+                  'token'         : token}
+        params.update(batch)
+        params['objectIds'] = ','.join(str(object_id) for object_id in object_ids)
+
+        page_json, seconds, num_bytes = Get_Page_With_Retries(params)
+        with stats_lock:
+            stats['requests'] += 1
+
+        if not page_json.get('exceededTransferLimit'):
+            return page_json, seconds, num_bytes
+
+        # The server cut the page short, get the rest of the features
+        features = page_json.get('features', [])
+        if len(features) == 0:
+            raise Exception('The server sent no features and said the transfer limit was exceeded')
+
+        oid_field = Get_Page_OID_Field(page_json)
+        sent_ids = set(feature['attributes'].get(oid_field) for feature in features)
+        missing_ids = [object_id for object_id in object_ids if object_id not in sent_ids]
+        if len(missing_ids) == len(object_ids):
+            raise Exception('The server sent {} features, but none of the {} OBJECTIDs asked for (is "{}" the OBJECTID field?)'.format(
+                                len(features), len(object_ids), oid_field))
+
+        with stats_lock:
+            stats['truncated_pages'] += 1
+            if stats['server_cap'] == None or len(features) < stats['server_cap']:
+                stats['server_cap'] = len(features)
+
+        print '    WARNING, the server only sent {} of {} features (exceededTransferLimit), downloading the other {}'.format(
+                    len(features), len(object_ids), len(missing_ids))
+
+        page_json.pop('exceededTransferLimit', None)
+        if len(missing_ids) == 0:
+            return page_json, seconds, num_bytes
+
+        return Merge_Page_Parts([(page_json, seconds, num_bytes), Download_Object_Ids(batch, missing_ids, depth + 1)])
+
+    def Download_Page(batch):
+        batch_key = Get_Batch_Key(query_url, AGOL_fields, batch)
+
+        if checkpoint != None:
+            page_json = Read_Checkpoint_Page(checkpoint, batch_key)
+            if page_json != None:
+                return page_json, 0.0, 0, True
+
+        object_ids = [int(object_id) for object_id in batch['objectIds'].split(',')]
+        page_json, seconds, num_bytes = Download_Object_Ids(batch, object_ids)
+
+        # Saved by the worker as soon as it has the page, so a page that
+        #  finished before a page in front of it failed is not lost
+        if checkpoint != None:
+            Write_Checkpoint_Page(checkpoint, batch_key, page_json)
+
+        return page_json, seconds, num_bytes, False
+
+    pages = []
+
+    start_time = time.time()
+    pool = ThreadPool(max(1, num_workers))
+    try:
+        # imap() hands back the results in the order of 'batches'
+        for page_num, result in enumerate(pool.imap(Download_Page, batches), start=1):
+            page_json, seconds, num_bytes, from_checkpoint = result
+            num_features = len(page_json.get('features', []))
+
+            if from_checkpoint:
+                print '    Page {} of {}: {} features, from the checkpoint'.format(page_num, len(batches), num_features)
+                stats['resumed_pages'] += 1
+            else:
+                print '    Page {} of {}: {} features, {:.1f} KB in {:.2f} seconds'.format(
+                            page_num, len(batches), num_features, num_bytes / 1024.0, seconds)
+                stats['pages'] += 1
+                stats['bytes'] += num_bytes
+                stats['page_seconds'].append(seconds)
+                stats['page_features'].append(num_features)
+
+            stats['features'] += num_features
+
+            pages.append(page_json)
+            if page_callback != None:
+                page_callback(page_json)
+        pool.close()
+
+    except:
+        pool.terminate()
+        raise
+
+    finally:
+        pool.join()
+
+    stats['seconds'] = time.time() - start_time
+
+    Print_Download_Stats(stats)
+
+    return pages, stats
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Print_Download_Stats()
+def Print_Download_Stats(stats):
+    """
+    PARAMETERS:
+      stats (dict): The telemetry returned by Download_Pages().  Keys:
+        pages (int): Number of pages downloaded.
+        features (int): Number of features downloaded (or read from the
+          checkpoint).
+        bytes (int): Number of bytes downloaded.
+        seconds (float): Wall clock time for the whole download.
+        page_seconds (list of float): The latency of each page.
+        page_features (list of int): The features in each downloaded page.
+        page_sizes (list of int): The OBJECTIDs asked for in each page.
+        requests (int): Number of requests sent (more than 'pages' if
+          the server cut pages short).
+        truncated_pages (int): Number of requests the server cut short.
+        server_cap (int): The most features the server would send in one
+          request, if it cut a page short.  Otherwise None.
+        resumed_pages (int): Number of pages read from the checkpoint.
+        retries (int): Number of times a failed page was tried again.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To print the per-page latency summary and the total throughput.
+    """
+
+    page_seconds = stats['page_seconds']
+    seconds = max(stats['seconds'], 0.001)
+
+    print '\n  Downloaded {} features in {} page(s), {:.1f} KB in {:.2f} seconds'.format(
+                stats['features'], stats['pages'], stats['bytes'] / 1024.0, stats['seconds'])
+
+    if stats.get('page_sizes'):
+        page_sizes = stats['page_sizes']
+        print '  Page size (OBJECTIDs):  min {}, mean {:.0f}, max {}'.format(
+                min(page_sizes), float(sum(page_sizes)) / len(page_sizes), max(page_sizes))
+
+    if stats.get('truncated_pages'):
+        print '  The server cut {} request(s) short, it sends at most {} features per request ({} requests in all)'.format(
+                    stats['truncated_pages'], stats['server_cap'], stats['requests'])
+
+    if stats.get('resumed_pages'):
+        print '  Resumed {} page(s) from the checkpoint'.format(stats['resumed_pages'])
+
+    if stats.get('retries'):
+        print '  Pages were tried again {} time(s)'.format(stats['retries'])
+
+    if page_seconds:
+        print '  Page latency (seconds):  min {:.2f}, mean {:.2f}, max {:.2f}'.format(
+                min(page_seconds), sum(page_seconds) / len(page_seconds), max(page_seconds))
+
+    print '  Throughput:  {:.1f} features/second, {:.1f} KB/second\n'.format(
+                stats['features'] / seconds, stats['bytes'] / 1024.0 / seconds)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Merge_Page_Parts()
+def Merge_Page_Parts(parts):
+    """
+    PARAMETERS:
+      parts (list of tuple): (page_json, seconds, num_bytes) for each request
+        that makes up one page.
+
+    RETURNS:
+      page_json (dict), seconds (float), num_bytes (int): The page with the
+        features of all the parts, and the total time and size.
+    """
+
+    page_json = dict(parts[0][0])
+    page_json['features'] = [feature for part in parts for feature in part[0].get('features', [])]
+    page_json.pop('exceededTransferLimit', None)
+
+    seconds   = sum(part[1] for part in parts)
+    num_bytes = sum(part[2] for part in parts)
+
+    return page_json, seconds, num_bytes
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Get_Page_OID_Field()
+def Get_Page_OID_Field(page_json):
+    """
+    RETURNS:
+      oid_field (str): The name of the OBJECTID field of a page.
+    """
+
+    if page_json.get('objectIdFieldName'):
+        return page_json['objectIdFieldName']
+
+    for field in page_json.get('fields', []):
+        if field.get('type') == 'esriFieldTypeOID':
+            return field['name']
+
+    return 'OBJECTID'
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Choose_Page_Size()
+def Choose_Page_Size(tuning_file, max_record_count, resume=False, min_page_size=100,
+                     max_page_seconds=30, explore_hours=24, max_page_kb=8192):
+    """
+    PARAMETERS:
+      tuning_file (str): Full path to the .json file written by
+        Update_Page_Size_Tuning().
+      max_record_count (int): The 'maxRecordCount' of the layer.
+      resume {bool}: True if a checkpoint is being resumed.  The page size of
+        the last run is used, so the batches match the pages in the
+        checkpoint. OPTIONAL.
+      min_page_size {int}: The smallest page size to try. OPTIONAL.
+      max_page_seconds {int}: A page size is not used if its pages take
+        longer than this on average. OPTIONAL.
+      explore_hours {int}: Try a page size next to the fastest one if it
+        hasn't been tried for this many hours, and try the full
+        'max_record_count' again if the server cut pages short longer ago
+        than this. OPTIONAL.
+      max_page_kb {int}: A page size is not used if its pages are bigger
+        than this many KB (as sent over the network). OPTIONAL.
+
+    RETURNS:
+      page_size (int): The number of OBJECTIDs to ask for in each page.
+
+    FUNCTION:
+      To choose the page size that downloads the most features per second on
+      the current network.  The sizes tried are the largest size the server
+      will send ('max_record_count', or less if the server has cut pages
+      short), half of that, a quarter, etc. down to 'min_page_size'.  The
+      server's limit is forgotten when the 'max_record_count' of the layer
+      changes or after 'explore_hours', so the larger sizes are tried again
+      (a page the server still cuts short is completed by Download_Pages(),
+      which then measures the limit again).
+
+      Every run measures the size it used (see Update_Page_Size_Tuning()).
+      The fastest measured size whose pages take at most 'max_page_seconds'
+      is used, except that a size next to it (twice or half as big) is tried
+      if it has never been measured or not for 'explore_hours'.  So the size
+      climbs to the fastest one and follows it as the network changes.  With
+      no measurements yet, the largest size is used.
+
+      The sizes whose pages are bigger than 'max_page_kb' are not tried at
+      all.  A big page is the one most likely to be cut off by a proxy or a
+      slow connection, and a page that fails is downloaded again whole.  The
+      KB of a size that hasn't been measured is worked out from the largest
+      KB per feature of the sizes that have.
+    """
+
+    tuning = Load_Page_Size_Tuning(tuning_file)
+
+    if resume and tuning.get('last_page_size'):
+        print '  Using the page size of the last run ({}) to resume the checkpoint'.format(tuning['last_page_size'])
+        return tuning['last_page_size']
+
+    largest_size = max_record_count
+    if tuning.get('server_cap'):
+        if tuning.get('server_cap_max_record_count') != max_record_count:
+            print '  The max record count changed since the server cut pages to {}, trying the full size again'.format(
+                        tuning['server_cap'])
+        elif (time.time() - tuning.get('server_cap_updated', 0)) > explore_hours * 3600:
+            print '  The server cut pages to {} more than {} hours ago, trying the full size again'.format(
+                        tuning['server_cap'], explore_hours)
+        else:
+            largest_size = min(largest_size, tuning['server_cap'])
+
+    page_sizes = [largest_size]
+    while page_sizes[-1] // 2 >= min_page_size:
+        page_sizes.append(page_sizes[-1] // 2)
+
+    measured = tuning.get('sizes', {})
+    now = time.time()
+
+    # Leave out the sizes with pages that are too big
+    kb_per_feature = 0
+    for key, size_stats in measured.items():
+        if 'kb_per_page' in size_stats:
+            kb_per_feature = max(kb_per_feature, size_stats['kb_per_page'] / float(key))
+    too_big = [page_size for page_size in page_sizes
+               if measured.get(str(page_size), {}).get('kb_per_page', kb_per_feature * page_size) > max_page_kb]
+    if too_big:
+        page_sizes = [page_size for page_size in page_sizes if page_size not in too_big] or [page_sizes[-1]]
+        print '  Not using page sizes {} (their pages are over {} KB)'.format(
+                    ', '.join(str(page_size) for page_size in too_big if page_size not in page_sizes), max_page_kb)
+
+    fast_enough = [page_size for page_size in page_sizes
+                   if str(page_size) in measured and measured[str(page_size)]['seconds_per_page'] <= max_page_seconds]
+
+    if len(fast_enough) == 0:
+        # Nothing measured yet, or every measured size was too slow: use the
+        #  largest size that hasn't been found too slow
+        too_slow = [page_size for page_size in page_sizes if str(page_size) in measured]
+        for page_size in page_sizes:
+            if len(too_slow) == 0 or page_size < min(too_slow):
+                print '  Page size: {} (no faster size measured yet)'.format(page_size)
+                return page_size
+        return page_sizes[-1]
+
+    best_size = max(fast_enough, key=lambda page_size: measured[str(page_size)]['features_per_second'])
+    best = measured[str(best_size)]
+
+    # Try a neighbouring size that hasn't been measured (lately)
+    best_index = page_sizes.index(best_size)
+    neighbours = []
+    if best_index > 0 and best['seconds_per_page'] * 2 <= max_page_seconds:
+        neighbours.append(page_sizes[best_index - 1])
+    if best_index < len(page_sizes) - 1:
+        neighbours.append(page_sizes[best_index + 1])
+
+    for page_size in neighbours:
+        neighbour = measured.get(str(page_size))
+        if neighbour == None or (now - neighbour.get('updated', 0)) > explore_hours * 3600:
+            print '  Page size: {} (trying it next to the fastest size so far, {})'.format(page_size, best_size)
+            return page_size
+
+    print '  Page size: {} (the fastest so far, {:.0f} features/second)'.format(best_size, best['features_per_second'])
+    return best_size
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Update_Page_Size_Tuning()
+def Update_Page_Size_Tuning(tuning_file, page_size, stats, max_record_count=None):
+    """
+    PARAMETERS:
+      tuning_file (str): Full path to the .json file to update.
+      page_size (int): The page size that was used.
+      stats (dict): The telemetry returned by Download_Pages().  Use {} to
+        only save the page size (i.e. before the download starts).
+      max_record_count {int}: The 'maxRecordCount' of the layer, saved with
+        the server's real limit (see Choose_Page_Size()). OPTIONAL.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To save how fast 'page_size' was (features per second of a request,
+      seconds and KB per page), the page size that was used and the server's
+      real limit (if it cut pages short, or no limit if it sent a page bigger
+      than the last limit), for Choose_Page_Size().
+      The measurements are averaged with the ones from earlier runs, with
+      the newest counting the most.  A download of fewer than 2 pages is
+      too small to measure.
+    """
+
+    tuning = Load_Page_Size_Tuning(tuning_file)
+    tuning['last_page_size'] = page_size
+
+    if stats.get('server_cap'):
+        tuning['server_cap']                  = stats['server_cap']
+        tuning['server_cap_updated']          = time.time()
+        tuning['server_cap_max_record_count'] = max_record_count
+    elif tuning.get('server_cap') and max(stats.get('page_features') or [0]) > tuning['server_cap']:
+        print '  The server sent pages of more than {} features, it no longer cuts pages short'.format(tuning['server_cap'])
+        for key in ['server_cap', 'server_cap_updated', 'server_cap_max_record_count']:
+            tuning.pop(key, None)
+
+    page_seconds = stats.get('page_seconds', [])
+    if len(page_seconds) >= 2 and sum(page_seconds) > 0:
+        features_per_second = sum(stats['page_features']) / sum(page_seconds)
+        seconds_per_page    = sum(page_seconds) / len(page_seconds)
+        kb_per_page         = stats['bytes'] / 1024.0 / len(page_seconds)
+
+        sizes = tuning.setdefault('sizes', {})
+        previous = sizes.get(str(page_size))
+        if previous != None:
+            features_per_second = (features_per_second + previous['features_per_second']) / 2
+            seconds_per_page    = (seconds_per_page + previous['seconds_per_page']) / 2
+            kb_per_page         = (kb_per_page + previous.get('kb_per_page', kb_per_page)) / 2
+
+        sizes[str(page_size)] = {'features_per_second' : features_per_second,
+                                 'seconds_per_page'    : seconds_per_page,
+                                 'kb_per_page'         : kb_per_page,
+                                 'updated'             : time.time()}
+
+        print '  Page size {}: {:.0f} features/second, {:.2f} seconds and {:.1f} KB per page'.format(
+                    page_size, features_per_second, seconds_per_page, kb_per_page)
+
+    Write_JSON_File(tuning_file, tuning)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Load_Page_Size_Tuning()
+def Load_Page_Size_Tuning(tuning_file):
+    """
+    RETURNS:
+      tuning (dict): The page size measurements saved by
+        Update_Page_Size_Tuning(), or an empty dict.
+    """
+
+    if not os.path.exists(tuning_file):
+        return {}
+
+    try:
+        with open(tuning_file) as json_file:
+            return json.load(json_file)
+    except ValueError:
+        return {}
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Is_Transient_Error()
+def Is_Transient_Error(e):
+    """
+    PARAMETERS:
+      e (Exception): The error raised while downloading a page.
+
+    RETURNS:
+      transient (boolean): True if trying again may work.
+
+    FUNCTION:
+      To tell a failure worth trying again from one that will fail every
+      time.  Only these are tried again:
+        1) A 5xx, 408 or 429 status code, or the same code in the 'error' of
+           the JSON (an overloaded server).
+        2) A timeout, or a connection that was refused or dropped.
+      Anything else (any other 4xx, an error in the JSON with another code or
+      no code, i.e. 400 'Invalid query' or a bad field, or a response that
+      can't be parsed or decoded) will fail every time.
+    """
+
+    if isinstance(e, (DA_HTTP_Client.HTTP_Error, DA_HTTP_Client.JSON_Error)):
+        return e.code != None and (e.code >= 500 or e.code in (408, 429))
+
+    # socket.timeout and ssl.SSLError are socket.errors
+    return isinstance(e, (socket.error, httplib.HTTPException))
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Open_Checkpoint()
+def Open_Checkpoint(checkpoint_folder, max_age_hours=24):
+    """
+    PARAMETERS:
+      checkpoint_folder (str): Full path to the folder to save the downloaded
+        pages in.  It is made if it doesn't exist.
+      max_age_hours {int}: A checkpoint started longer ago than this is
+        thrown away and a new one is started. OPTIONAL.
+
+    RETURNS:
+      checkpoint (dict): Keys:
+        folder (str): The checkpoint folder.
+        started (int): When the checkpoint was started (ms since 1970).
+        resumed (boolean): True if the checkpoint was left by a run that
+          failed, False if it is new.
+        num_pages (int): The number of pages in the checkpoint.
+
+    FUNCTION:
+      To open the checkpoint of a download.  Download_Pages() saves every
+      page to the checkpoint as soon as it is downloaded, and reads a page
+      from it instead of downloading it if the checkpoint already has it.
+      So if a download fails part way, the next run only downloads the pages
+      that weren't finished.  Call Remove_Checkpoint() once the download has
+      been saved, so the next run starts a new checkpoint.
+
+      Each page is saved under a key made from the query URL, the outFields
+      and the OBJECTIDs of the page (see Get_Batch_Key()), so a page is only
+      reused for exactly the same request.  Features edited after the
+      checkpoint was started can be dropped with Drop_Checkpoint_Pages().
+    """
+
+    manifest_file = os.path.join(checkpoint_folder, 'DA_Checkpoint.json')
+
+    manifest = None
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file) as json_file:
+                manifest = json.load(json_file)
+        except ValueError:
+            manifest = None
+
+        if manifest != None and (time.time() * 1000 - manifest.get('started', 0)) > max_age_hours * 3600 * 1000:
+            print '  The checkpoint is more than {} hours old, starting a new one'.format(max_age_hours)
+            manifest = None
+
+    if manifest == None:
+        Remove_Checkpoint(checkpoint_folder)
+        os.makedirs(checkpoint_folder)
+        manifest = {'started': int(time.time() * 1000)}
+        Write_JSON_File(manifest_file, manifest)
+        resumed = False
+    else:
+        resumed = True
+
+    num_pages = len([name for name in os.listdir(checkpoint_folder) if name.startswith('page_') and name.endswith('.json')])
+
+    checkpoint = {'folder'    : checkpoint_folder,
+                  'started'   : manifest['started'],
+                  'resumed'   : resumed,
+                  'num_pages' : num_pages}
+
+    if resumed:
+        print '  Resuming the checkpoint started {} with {} page(s) in it'.format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['started'] / 1000)), num_pages)
+
+    return checkpoint
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Batch_Key()
+def Get_Batch_Key(query_url, AGOL_fields, batch):
+    """
+    RETURNS:
+      batch_key (str): A key that is the same only for the same query URL,
+        outFields and batch (from Build_OID_List_Batches()).
+    """
+
+    key_str = '{}|{}|{}'.format(query_url, AGOL_fields, json.dumps(batch, sort_keys=True))
+
+    return hashlib.md5(key_str).hexdigest()
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Read_Checkpoint_Page()
+def Read_Checkpoint_Page(checkpoint, batch_key):
+    """
+    RETURNS:
+      page_json (dict): The page saved under 'batch_key', or None if the
+        checkpoint doesn't have it.
+    """
+
+    page_file = os.path.join(checkpoint['folder'], 'page_{}.json'.format(batch_key))
+    if not os.path.exists(page_file):
+        return None
+
+    try:
+        with open(page_file) as json_file:
+            return json.load(json_file)
+    except ValueError:
+        return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Write_Checkpoint_Page()
+def Write_Checkpoint_Page(checkpoint, batch_key, page_json):
+    """
+    FUNCTION:
+      To save a downloaded page to the checkpoint under 'batch_key'.
+    """
+
+    page_file = os.path.join(checkpoint['folder'], 'page_{}.json'.format(batch_key))
+    Write_JSON_File(page_file, page_json)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Drop_Checkpoint_Pages()
+def Drop_Checkpoint_Pages(checkpoint, query_url, AGOL_fields, batches, object_ids):
+    """
+    PARAMETERS:
+      checkpoint (dict): From Open_Checkpoint().
+      query_url (str): The '/query' URL of the layer.
+      AGOL_fields (str): The outFields being downloaded.
+      batches (list of dict): The pages about to be downloaded.
+      object_ids (list of int): The OBJECTIDs of features that have to be
+        downloaded again, i.e. the features edited since the checkpoint was
+        started.
+
+    RETURNS:
+      num_dropped (int): The number of pages removed from the checkpoint.
+
+    FUNCTION:
+      To remove the pages that have any of 'object_ids' in them from the
+      checkpoint, so they are downloaded again instead of being resumed with
+      out of date features.
+    """
+
+    object_ids = set(object_ids)
+    num_dropped = 0
+
+    for batch in batches:
+        batch_ids = set(int(object_id) for object_id in batch['objectIds'].split(','))
+        if batch_ids.isdisjoint(object_ids):
+            continue
+
+        page_file = os.path.join(checkpoint['folder'], 'page_{}.json'.format(Get_Batch_Key(query_url, AGOL_fields, batch)))
+        if os.path.exists(page_file):
+            os.remove(page_file)
+            num_dropped += 1
+
+    return num_dropped
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Remove_Checkpoint()
+def Remove_Checkpoint(checkpoint_folder):
+    """
+    FUNCTION:
+      To delete the checkpoint folder (if it exists).
+    """
+
+    if os.path.exists(checkpoint_folder):
+        shutil.rmtree(checkpoint_folder)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Get_Geometry_Params()
+def Get_Geometry_Params(out_sr=None, geometry_precision=None, datum_transformation=None):
+    """
+    PARAMETERS:
+      out_sr {int or str}: The WKID of the spatial reference the server should
+        return the geometry in. OPTIONAL.  If not given, the geometry comes
+        back in the spatial reference of the layer.
+      geometry_precision {int or str}: The number of decimal places of the
+        coordinates the server returns. OPTIONAL.  If not given, the
+        coordinates come back at full precision.
+      datum_transformation {int or str}: The WKID of the datum transformation
+        the server should use to project to 'out_sr'. OPTIONAL.
+
+    RETURNS:
+      geometry_params (dict): The query parameters, i.e.
+        {'outSR': '2230', 'geometryPrecision': '2'}.  Empty if nothing was
+        given.
+
+    FUNCTION:
+      To build the query parameters that have the server project the geometry
+      and round the coordinates before sending them.  Projecting once on the
+      server means the downloaded FC is already in the spatial reference of
+      the data it is used with, and rounding the coordinates makes every page
+      smaller.  The values are kept as strings so they can be compared with
+      the ones saved in the delta state.
+    """
+
+    geometry_params = {}
+
+    if out_sr not in (None, ''):
+        geometry_params['outSR'] = str(out_sr)
+
+    if geometry_precision not in (None, ''):
+        geometry_params['geometryPrecision'] = str(int(geometry_precision))
+
+    if datum_transformation not in (None, '') and 'outSR' in geometry_params:
+        geometry_params['datumTransformation'] = str(datum_transformation)
+
+    return geometry_params
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Build_Edit_Date_Where()
+def Build_Edit_Date_Where(edit_date_field, since_ms):
+    """
+    PARAMETERS:
+      edit_date_field (str): The name of the editor tracking date field of the
+        layer (from layer_info['editFieldsInfo']['editDateField']).
+      since_ms (int): A date in milliseconds since 1970 (UTC).  This is the
+        format that AGOL returns dates in.
+
+    RETURNS:
+      where_clause (str): i.e. "EditDate >= timestamp '2018-03-28 17:02:11'"
+
+    FUNCTION:
+      To build a where clause that selects every feature edited on or after
+      'since_ms'.  The date is rounded down to the second, so a feature edited
+      in the same second as 'since_ms' is selected again rather than missed.
+    """
+
+    since_str = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(since_ms // 1000))
+
+    return "{} >= timestamp '{}'".format(edit_date_field, since_str)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Merge_Delta()
+def Merge_Delta(prev_features, edited_features, object_ids, oid_field):
+    """
+    PARAMETERS:
+      prev_features (list of dict): The features (esri JSON) of the previous
+        snapshot.
+      edited_features (list of dict): The features (esri JSON) that were
+        added or edited since the previous snapshot.
+      object_ids (list of int): ALL the OBJECTIDs that are in the layer now.
+        Any previous feature whose OBJECTID is not in this list was deleted.
+      oid_field (str): The name of the OBJECTID field.
+
+    RETURNS:
+      features (list of dict): The merged features sorted by OBJECTID.
+      counts (dict): The number of features 'added', 'updated', 'deleted'
+        and 'unchanged'.
+
+    FUNCTION:
+      To merge the features that were edited since the previous snapshot into
+      the previous snapshot, and to drop the features that were deleted from
+      the layer, so the result is the same as downloading the whole layer.
+    """
+
+    current_ids = set(object_ids)
+
+    features_by_id = {}
+    for feature in prev_features:
+        features_by_id[feature['attributes'][oid_field]] = feature
+
+    counts = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    # Drop the features that are no longer in the layer
+    for object_id in features_by_id.keys():
+        if object_id not in current_ids:
+            del features_by_id[object_id]
+            counts['deleted'] += 1
+
+    counts['unchanged'] = len(features_by_id)
+
+    # Add (or replace) the edited features
+    for feature in edited_features:
+        object_id = feature['attributes'][oid_field]
+        if object_id not in current_ids:
+            continue  # Deleted after it was downloaded
+        if object_id in features_by_id:
+            counts['updated']   += 1
+            counts['unchanged'] -= 1
+        else:
+            counts['added'] += 1
+        features_by_id[object_id] = feature
+
+    features = [features_by_id[object_id] for object_id in sorted(features_by_id)]
+
+    return features, counts
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Load_Delta_State()
+def Load_Delta_State(state_file, FS_url, index_of_layer, AGOL_fields, full_refresh_hours=24, geometry_params=None):
+    """
+    PARAMETERS:
+      state_file (str): Full path to the .json file written by
+        Save_Delta_State() after the last successful download.
+      FS_url (str): The URL of the Feature Service being downloaded.
+      index_of_layer (int): The index of the layer being downloaded.
+      AGOL_fields (str): The outFields being downloaded.
+      full_refresh_hours {int}: Do a full download if the last full download
+        is older than this. OPTIONAL.
+      geometry_params {dict}: The geometry query parameters being downloaded
+        with (see Get_Geometry_Params()). OPTIONAL.
+
+    RETURNS:
+      state (dict): The saved state, or None if there is no state that can be
+        used for a delta download.  The reason is printed.
+
+    FUNCTION:
+      To load the previous snapshot and decide if it can be used as the base
+      of a delta download.  It can't if it doesn't exist, was downloaded from
+      a different layer, with different fields or in a different spatial
+      reference or precision, has no edit date to query from, or the last
+      full download is too old.
+    """
+
+    if not os.path.exists(state_file):
+        print '  No delta state found at:\n    {}'.format(state_file)
+        return None
+
+    with open(state_file) as json_file:
+        state = json.load(json_file)
+
+    reason = None
+    if state.get('FS_url') != FS_url or str(state.get('index_of_layer')) != str(index_of_layer):
+        reason = 'it was downloaded from a different layer'
+    elif state.get('AGOL_fields') != AGOL_fields:
+        reason = 'it was downloaded with different fields'
+    elif (state.get('geometry_params') or {}) != (geometry_params or {}):
+        reason = 'it was downloaded in a different spatial reference or precision'
+    elif state.get('last_edit_date') == None:
+        reason = 'it has no edit date to query from'
+    elif (time.time() - state.get('last_full_download', 0)) > full_refresh_hours * 3600:
+        reason = 'the last full download is more than {} hours old'.format(full_refresh_hours)
+
+    if reason != None:
+        print '  Not using the delta state because {}'.format(reason)
+        return None
+
+    return state
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Save_Delta_State()
+def Save_Delta_State(state_file, state):
+    """
+    PARAMETERS:
+      state_file (str): Full path to the .json file to write.
+      state (dict): The state to save.  Keys:
+        FS_url, index_of_layer, AGOL_fields, geometry_params: What was
+          downloaded.
+        objectIdFieldName, fields, geometryType, spatialReference, features:
+          The downloaded snapshot (esri JSON).
+        last_edit_date (int): The newest edit date in the snapshot.
+        last_full_download (float): When the whole layer was last downloaded.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To save the snapshot that the next delta download will be merged into.
+      The file is written to a temporary file first and then moved into place
+      so a failed run can't leave a half written state behind.
+    """
+
+    Write_JSON_File(state_file, state)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Write_JSON_File()
+def Write_JSON_File(path, obj):
+    """
+    PARAMETERS:
+      path (str): Full path to the .json file to write.
+      obj (dict or list): The object to write.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To write a .json file atomically.  The JSON is written to '<path>.tmp'
+      and then renamed over 'path' (see DA_File_Utils.Replace_File()), so a
+      reader never sees a partly written file, or no file.
+    """
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as json_file:
+        json.dump(obj, json_file)
+
+    DA_File_Utils.Replace_File(temp_path, path)
@@ -0,0 +1,400 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_AGOL_Token.py
+# Purpose:
+"""
+A token provider shared by all of the DA scripts.
+
+Each script used to ask AGOL's generateToken for a new token every run (and
+sometimes more than once).  The Token_Provider here:
+    1) Saves the token and when it expires to a cache file in the local
+       profile of the account that runs the scripts (not on the shared
+       drive the config file is on).  On Windows the file is encrypted with
+       DPAPI (CryptProtectData()), so only that account on that computer
+       can read it.  Elsewhere the file is readable only by its owner.
+    2) Reuses the cached token in the next script (or the next run) if it
+       is still good for at least 'refresh_minutes'.
+    3) Gets a new token BEFORE the current one expires, so a long download,
+       a long loop of updates or a large upload doesn't fail half way
+       through because the token expired.
+
+Get() returns a token that is good for at least 'refresh_minutes', getting
+a new one first if needed:
+
+    import DA_AGOL_Token
+    token_provider = DA_AGOL_Token.Get_Token_Provider(cfgFile)
+    params = {'f': 'json', 'token': token_provider.Get()}
+
+The provider can also be used anywhere a token string is used.  Every time
+it is turned into a string (i.e. urllib.urlencode({'token': token}) or
+'?token={}'.format(token)) it calls Get().
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import ConfigParser, json, os, threading, time
+
+import DA_File_Utils
+import DA_HTTP_Client
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          CLASS Token_Provider()
+class Token_Provider(object):
+    """
+    Gets, caches and refreshes an AGOL token for one account.
+    """
+
+    def __init__(self, usr, pwd, gtURL='https://www.arcgis.com/sharing/rest/generateToken',
+                 referer='http://www.arcgis.com', expiration_minutes=120, refresh_minutes=15,
+                 cache_file=None):
+        """
+        PARAMETERS:
+          usr (str): The AGOL username.
+          pwd (str): The AGOL password.
+          gtURL {str}: The generateToken URL. OPTIONAL.
+          referer {str}: The referer the token is made for. OPTIONAL.
+          expiration_minutes {int}: How long a new token should last.
+            OPTIONAL.
+          refresh_minutes {int}: Get a new token when the current one has
+            less than this many minutes left. OPTIONAL.
+          cache_file {str}: Full path to the token cache.  OPTIONAL.  Defaults
+            to Get_Default_Cache_File().
+        """
+
+        self.usr = usr
+        self.pwd = pwd
+
+        self.gtURL              = gtURL
+        self.referer            = referer
+        self.expiration_minutes = expiration_minutes
+        self.refresh_minutes    = refresh_minutes
+
+        if cache_file == None:
+            cache_file = Get_Default_Cache_File()
+        self.cache_file = cache_file
+
+        # The cache can hold tokens for more than one account / URL
+        self.cache_key = '{}|{}|{}'.format(self.usr, self.gtURL, self.referer)
+
+        self.token   = None
+        self.expires = 0  # In seconds since 1970
+        self.lock    = threading.Lock()
+
+    #---------------------------------------------------------------------------
+    def Get(self):
+        """
+        RETURNS:
+          token (str): A token that is good for at least 'refresh_minutes'.
+
+        FUNCTION:
+          To return the current token, or the cached token, or a new token,
+          in that order, whichever is first to still be good.
+        """
+
+        with self.lock:
+            if self.Is_Fresh(self.expires):
+                return self.token
+
+            cached = self.Read_Cache()
+            if cached != None and self.Is_Fresh(cached['expires']):
+                self.token   = cached['token']
+                self.expires = cached['expires']
+                print '  Using the cached token (good until {})'.format(self.Expires_Str())
+                return self.token
+
+            self.Generate_Token()
+            return self.token
+
+    #---------------------------------------------------------------------------
+    def Invalidate(self):
+        """
+        FUNCTION:
+          To throw away the current (and cached) token, i.e. if the server
+          said it is invalid.  The next Get() gets a new token.
+        """
+
+        with self.lock:
+            self.token   = None
+            self.expires = 0
+            self.Write_Cache(None)
+
+    #---------------------------------------------------------------------------
+    def Is_Fresh(self, expires):
+        """
+        RETURNS:
+          True if a token that expires at 'expires' (seconds since 1970) is
+          good for at least 'refresh_minutes' more.
+        """
+
+        return expires - time.time() > self.refresh_minutes * 60
+
+    #---------------------------------------------------------------------------
+    def Expires_Str(self):
+        """
+        RETURNS:
+          The local date and time the current token expires.
+        """
+
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.expires))
+
+    #---------------------------------------------------------------------------
+    def Generate_Token(self):
+        """
+        FUNCTION:
+          To get a new token from generateToken and save it to the cache.
+        """
+
+        gtValues = {'username'   : self.usr,
+                    'password'   : self.pwd,
+                    'client'     : 'referer',
+                    'referer'    : self.referer,
+                    'expiration' : self.expiration_minutes,
+                    'f'          : 'json'}
+
+        client = DA_HTTP_Client.Get_Client()
+        gtJson = client.Get_JSON(self.gtURL, gtValues)[0]
+
+        self.token = gtJson['token']
+
+        # A token replayed from the HTTP cache (see DA_HTTP_Cache.py) is not
+        #  a real token and has already expired.  Use it for this run, but
+        #  don't save it.
+        cache = client.Get_Active_Cache()
+        if cache != None and cache.Is_Replaying():
+            self.expires = time.time() + self.expiration_minutes * 60
+            print '  Using a replayed token'
+            return
+
+        # 'expires' is in milliseconds since 1970
+        if 'expires' in gtJson:
+            self.expires = gtJson['expires'] / 1000.0
+        else:
+            self.expires = time.time() + self.expiration_minutes * 60
+
+        # The org may allow shorter tokens than asked for.  Refresh a token
+        #  like that when a quarter of it is left, not every time it is used.
+        lifetime_minutes = (self.expires - time.time()) / 60
+        if lifetime_minutes <= self.refresh_minutes:
+            self.refresh_minutes = max(lifetime_minutes / 4, 0)
+            print '  The token is only good for {:.0f} minutes, getting a new one when {:.0f} minutes are left'.format(
+                        lifetime_minutes, self.refresh_minutes)
+
+        print '  Generated a new token (good until {})'.format(self.Expires_Str())
+
+        self.Write_Cache({'token': self.token, 'expires': self.expires})
+
+    #---------------------------------------------------------------------------
+    def Read_Cache(self):
+        """
+        RETURNS:
+          cached (dict): {'token': .., 'expires': ..} for this account, or None.
+        """
+
+        return self.Read_Cache_File().get(self.cache_key)
+
+    #---------------------------------------------------------------------------
+    def Read_Cache_File(self):
+        """
+        RETURNS:
+          cache (dict): The whole cache, or an empty dict if there is no cache
+            (or it can't be read, i.e. it was encrypted by another account).
+        """
+
+        try:
+            with open(self.cache_file, 'rb') as cache_file:
+                return json.loads(Unprotect(cache_file.read()))
+        except (IOError, OSError, ValueError):
+            return {}
+
+    #---------------------------------------------------------------------------
+    def Write_Cache(self, cached):
+        """
+        PARAMETERS:
+          cached (dict): {'token': .., 'expires': ..} for this account, or
+            None to remove this account from the cache.
+
+        FUNCTION:
+          To save the token to the cache file.  The file is encrypted with
+          Protect() and made readable and writable only by its owner, and is
+          written to a temp file first and renamed, so another script never
+          reads a half written cache.  A failure to write the cache is
+          printed but is not an error (the token is still good, it just isn't
+          shared).
+        """
+
+        try:
+            cache = self.Read_Cache_File()
+
+            if cached == None:
+                cache.pop(self.cache_key, None)
+            else:
+                cache[self.cache_key] = cached
+
+            cache_folder = os.path.dirname(self.cache_file)
+            if not os.path.isdir(cache_folder):
+                os.makedirs(cache_folder, 0700)
+
+            temp_path = self.cache_file + '.tmp'
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            file_descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0600)
+            with os.fdopen(file_descriptor, 'wb') as cache_file:
+                cache_file.write(Protect(json.dumps(cache)))
+
+            DA_File_Utils.Replace_File(temp_path, self.cache_file)
+
+        except (IOError, OSError) as e:
+            print '  WARNING, could not save the token cache at {}:  {}'.format(self.cache_file, e)
+
+    #---------------------------------------------------------------------------
+    def __str__(self):
+        return str(self.Get())
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Get_Token_Provider()
+
+providers = {}
+providers_lock = threading.Lock()
+
+def Get_Token_Provider(cfgFile, gtURL='https://www.arcgis.com/sharing/rest/generateToken'):
+    """
+    PARAMETERS:
+      cfgFile (str): Full path to the config file with the AGOL 'usr' and 'pwd'.
+      gtURL {str}: The generateToken URL. OPTIONAL.
+
+    RETURNS:
+      token (Token_Provider): The provider for the account in the [AGOL]
+        section of the config file (see Get_User_Token_Provider()).
+
+    FUNCTION:
+      Also removes the unencrypted token cache that older versions of these
+      scripts saved next to the config file.
+    """
+
+    config = ConfigParser.ConfigParser()
+    config.read(cfgFile)
+
+    old_cache_file = os.path.join(os.path.dirname(os.path.abspath(cfgFile)), 'DA_AGOL_Token_Cache.json')
+    if os.path.exists(old_cache_file):
+        try:
+            os.remove(old_cache_file)
+            print '  Removed the old token cache at {}'.format(old_cache_file)
+        except OSError as e:
+            print '  WARNING, could not remove the old token cache at {}:  {}'.format(old_cache_file, e)
+
+    return Get_User_Token_Provider(config.get('AGOL', 'usr'), config.get('AGOL', 'pwd'), gtURL)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Get_User_Token_Provider()
+def Get_User_Token_Provider(usr, pwd, gtURL='https://www.arcgis.com/sharing/rest/generateToken',
+                            expiration_minutes=120):
+    """
+    PARAMETERS:
+      usr (str): The AGOL username.
+      pwd (str): The AGOL password.
+      gtURL {str}: The generateToken URL. OPTIONAL.
+      expiration_minutes {int}: How long a new token should last. OPTIONAL.
+
+    RETURNS:
+      token (Token_Provider): The provider for this account, with a token
+        ready to use.  It is the same provider every time it is asked for in
+        the same script.
+
+    FUNCTION:
+      To get the token provider, making it (and getting its first token) the
+      first time it is asked for.
+    """
+
+    with providers_lock:
+        key = (usr, gtURL)
+        if key not in providers:
+            providers[key] = Token_Provider(usr, pwd, gtURL, expiration_minutes=expiration_minutes)
+        token = providers[key]
+
+    token.Get()
+
+    return token
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Get_Default_Cache_File()
+def Get_Default_Cache_File():
+    """
+    RETURNS:
+      cache_file (str): Full path to the token cache in the local profile of
+        the account running the script:
+          %LOCALAPPDATA%\DA_Scripts\DA_AGOL_Token_Cache.dat on Windows
+          ~/.cache/DA_Scripts/DA_AGOL_Token_Cache.dat elsewhere
+    """
+
+    if os.name == 'nt':
+        folder = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    else:
+        folder = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(folder, 'DA_Scripts', 'DA_AGOL_Token_Cache.dat')
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTIONS Protect() Unprotect()
+def Protect(data):
+    """
+    PARAMETERS:
+      data (str): The bytes to protect.
+
+    RETURNS:
+      protected_data (str): On Windows, 'data' encrypted with DPAPI for the
+        current account (only that account on this computer can decrypt it).
+        Elsewhere 'data' as it is (the file permissions protect it).
+    """
+
+    if os.name != 'nt':
+        return data
+
+    return Call_DPAPI('CryptProtectData', data)
+
+def Unprotect(protected_data):
+    """
+    RETURNS:
+      data (str): 'protected_data' decrypted (see Protect()).  A WindowsError
+        is raised if it can't be decrypted.
+    """
+
+    if os.name != 'nt':
+        return protected_data
+
+    return Call_DPAPI('CryptUnprotectData', protected_data)
+
+def Call_DPAPI(function_name, data):
+    """
+    RETURNS:
+      data (str): The output of the DPAPI function 'function_name'
+        ('CryptProtectData' or 'CryptUnprotectData') for the input 'data'.
+    """
+
+    import ctypes
+    from ctypes import wintypes
+
+    class DATA_BLOB(ctypes.Structure):
+        _fields_ = [('cbData', wintypes.DWORD), ('pbData', ctypes.POINTER(ctypes.c_char))]
+
+    CRYPTPROTECT_UI_FORBIDDEN = 0x1
+
+    in_buffer = ctypes.create_string_buffer(data, len(data))
+    in_blob   = DATA_BLOB(len(data), ctypes.cast(in_buffer, ctypes.POINTER(ctypes.c_char)))
+    out_blob  = DATA_BLOB()
+
+    function = getattr(ctypes.windll.crypt32, function_name)
+    if not function(ctypes.byref(in_blob), None, None, None, None, CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(out_blob)):
+        raise ctypes.WinError()
+
+    try:
+        return ctypes.string_at(out_blob.pbData, out_blob.cbData)
+    finally:
+        ctypes.windll.kernel32.LocalFree(out_blob.pbData)
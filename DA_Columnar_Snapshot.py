@@ -0,0 +1,351 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Columnar_Snapshot.py
+# Purpose:
+"""
+Functions to write and read a 'columnar' copy of a snapshot downloaded by
+'DA_Download_Fire_Data.py', next to the FC it writes to the FGDB.
+
+Reading a snapshot FC with a cursor takes a pass over every row, every time
+it is read.  The columnar copy has one NumPy array (.npy file) per field, so
+a script that needs a few fields of all the reports loads just those arrays,
+memory-mapped (np.load(mmap_mode='r')): nothing is read or copied until the
+values are used, and 100k reports load in milliseconds.
+
+A columnar snapshot is a folder:
+    Columns.json          = The number of rows, the OBJECTID field and the
+                            columns (name, type, file) of the snapshot.
+    Strings.npy           = The string table:  every string value of every
+                            string field, once, as UTF-8, one after the
+                            other (uint8).
+    Strings_Offsets.npy   = Where each string starts in Strings.npy, and
+                            where the last one ends (int64).
+    <field>.npy           = The values of a field:
+                              Integer fields: int32 (0 if NULL)
+                              Double fields:  float64 (NaN if NULL)
+                              Date fields:    int64, ms since 1970 (0 if NULL)
+                              String fields:  int32 index into the string
+                                              table (-1 if NULL)
+    <field>.null.npy      = A bool array, True where the field is NULL.  Only
+                            written for numeric and date fields with NULLs.
+    SHAPE_X.npy, SHAPE_Y.npy = float64 coordinates of the points (NaN if the
+                            feature has no geometry).
+
+The snapshots are in a folder next to the FGDB (see Get_Columnar_Folder()),
+each in a sub folder with the name of the snapshot FC.  A snapshot is
+written to a temp folder and renamed (see DA_File_Utils.Replace_Folder()),
+so a reader never finds a half written snapshot.  The string table is
+memory-mapped too, a string is only read when it is used.
+
+Use:
+    import DA_Columnar_Snapshot
+    snapshot = DA_Columnar_Snapshot.Load_Columnar_Snapshot(snapshot_folder)
+    quantity = snapshot.Column('Quantity')               # numpy array
+    incident = snapshot.Decode('IncidentName')           # list of str
+    x, y     = snapshot.Column('SHAPE_X'), snapshot.Column('SHAPE_Y')
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import json, os, shutil
+
+import numpy as np
+
+import DA_File_Utils
+import DA_Snapshot_Manifest
+
+# esri field type: (column type, numpy dtype)
+FIELD_TYPES = {'esriFieldTypeOID'          : ('int',    '<i4'),
+               'esriFieldTypeInteger'      : ('int',    '<i4'),
+               'esriFieldTypeSmallInteger' : ('int',    '<i4'),
+               'esriFieldTypeDouble'       : ('float',  '<f8'),
+               'esriFieldTypeSingle'       : ('float',  '<f8'),
+               'esriFieldTypeDate'         : ('date',   '<i8'),
+               'esriFieldTypeString'       : ('string', '<i4'),
+               'esriFieldTypeGlobalID'     : ('string', '<i4'),
+               'esriFieldTypeGUID'         : ('string', '<i4')}
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      CLASS Columnar_Snapshot()
+class Columnar_Snapshot(object):
+    """
+    A columnar snapshot loaded by Load_Columnar_Snapshot().  The arrays are
+    memory-mapped the first time they are asked for.
+    """
+
+    def __init__(self, snapshot_folder, info, strings):
+        self.snapshot_folder = snapshot_folder
+        self.num_rows        = info['num_rows']
+        self.oid_field       = info['oid_field']
+        self.columns         = info['columns']  # {name: {'type': .., 'file': .., 'null_file': ..}}
+        self.strings         = strings          # String_Table (or a list)
+        self.arrays          = {}
+
+    #---------------------------------------------------------------------------
+    def Column(self, name):
+        """
+        RETURNS:
+          array (numpy array): The (memory-mapped) values of a column.  For a
+            string column these are the indexes into the string table (see
+            Decode()).
+        """
+
+        if name not in self.arrays:
+            self.arrays[name] = self.Load_Array(self.columns[name]['file'])
+        return self.arrays[name]
+
+    #---------------------------------------------------------------------------
+    def Is_Null(self, name):
+        """
+        RETURNS:
+          is_null (numpy bool array): True where the column is NULL.
+        """
+
+        column = self.columns[name]
+        if column['type'] == 'string':
+            return self.Column(name) < 0
+        if column.get('null_file') == None:
+            return np.zeros(self.num_rows, dtype=bool)
+
+        key = name + '.null'
+        if key not in self.arrays:
+            self.arrays[key] = self.Load_Array(column['null_file'])
+        return self.arrays[key]
+
+    #---------------------------------------------------------------------------
+    def Decode(self, name):
+        """
+        RETURNS:
+          values (list): The values of a string column (None where NULL).
+        """
+
+        strings = self.strings
+        decoded = {-1: None}
+        values = []
+        for code in self.Column(name).tolist():
+            if code not in decoded:
+                decoded[code] = strings[code]
+            values.append(decoded[code])
+        return values
+
+    #---------------------------------------------------------------------------
+    def Get_Code(self, name, value):
+        """
+        RETURNS:
+          code (int): The index of 'value' in the string table, or -2 if it
+            isn't in it, so 'snapshot.Column(name) == code' selects the rows
+            where the string column 'name' is 'value' without decoding it.
+        """
+
+        if not hasattr(self, 'string_codes'):
+            self.string_codes = dict((string, code) for code, string in enumerate(self.strings))
+        if value == None:
+            return -1
+        return self.string_codes.get(value, -2)
+
+    #---------------------------------------------------------------------------
+    def Load_Array(self, file_name):
+        return np.load(os.path.join(self.snapshot_folder, file_name), mmap_mode='r')
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          CLASS String_Table()
+class String_Table(object):
+    """
+    The memory-mapped string table of a columnar snapshot.  A string is read
+    and decoded from UTF-8 when it is asked for:  strings[code]
+    """
+
+    def __init__(self, data, offsets):
+        """
+        PARAMETERS:
+          data (numpy uint8 array): Strings.npy
+          offsets (numpy int64 array): Strings_Offsets.npy
+        """
+
+        self.data    = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        if code < 0 or code >= len(self):
+            raise IndexError('No string {} in the string table'.format(code))
+        return self.data[int(self.offsets[code]):int(self.offsets[code + 1])].tostring().decode('utf-8')
+
+    def __iter__(self):
+        for code in range(len(self)):
+            yield self[code]
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Get_Columnar_Folder()
+def Get_Columnar_Folder(FGDB_path):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the snapshot FCs.
+
+    RETURNS:
+      columnar_folder (str): Full path to the folder with the columnar
+        snapshots of the FGDB, i.e. 'DA_Fire_From_AGOL.gdb' has its columnar
+        snapshots in 'DA_Fire_From_AGOL_Columnar' in the same folder.
+    """
+
+    return os.path.splitext(FGDB_path.rstrip('\\/'))[0] + '_Columnar'
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Write_Columnar_Snapshot()
+def Write_Columnar_Snapshot(snapshot_folder, pages, oid_field='OBJECTID'):
+    """
+    PARAMETERS:
+      snapshot_folder (str): Full path to the folder to write the snapshot to.
+        Anything already there is replaced.
+      pages (list of dict): The downloaded esri JSON pages (or one merged
+        page).  The fields of the first page are written.
+      oid_field {str}: The OBJECTID field. OPTIONAL.
+
+    RETURNS:
+      num_rows (int): The number of rows written.
+
+    FUNCTION:
+      To write the features of the pages as a columnar snapshot (see the top
+      of this file).  Fields of a type that isn't in FIELD_TYPES (i.e. blobs)
+      are not written.
+    """
+
+    features = [feature for page_json in pages for feature in page_json.get('features', [])]
+    fields = (pages[0].get('fields') or []) if pages else []
+    num_rows = len(features)
+
+    temp_folder = snapshot_folder + '.tmp'
+    if os.path.exists(temp_folder):
+        shutil.rmtree(temp_folder)
+    os.makedirs(temp_folder)
+
+    strings = []
+    string_codes = {}
+
+    columns = {}
+    for field in fields:
+        name = field['name']
+        if field.get('type') not in FIELD_TYPES or name.upper() in ('SHAPE_X', 'SHAPE_Y'):
+            continue
+        column_type, dtype = FIELD_TYPES[field['type']]
+
+        values = [feature['attributes'].get(name) for feature in features]
+        file_name = Get_File_Name(name)
+        column = {'type': column_type, 'file': file_name + '.npy', 'null_file': None}
+
+        if column_type == 'string':
+            codes = np.empty(num_rows, dtype=dtype)
+            for row_num, value in enumerate(values):
+                if value == None:
+                    codes[row_num] = -1
+                    continue
+                code = string_codes.get(value)
+                if code == None:
+                    code = string_codes[value] = len(strings)
+                    strings.append(value)
+                codes[row_num] = code
+            np.save(os.path.join(temp_folder, column['file']), codes)
+
+        else:
+            is_null = np.array([value == None for value in values], dtype=bool)
+            fill_value = np.nan if column_type == 'float' else 0
+            array = np.array([fill_value if value == None else value for value in values], dtype=dtype)
+            np.save(os.path.join(temp_folder, column['file']), array)
+
+            if is_null.any():
+                column['null_file'] = file_name + '.null.npy'
+                np.save(os.path.join(temp_folder, column['null_file']), is_null)
+
+        columns[name] = column
+
+    # The points
+    for name, key in [('SHAPE_X', 'x'), ('SHAPE_Y', 'y')]:
+        array = np.array([(feature.get('geometry') or {}).get(key, np.nan) for feature in features], dtype='<f8')
+        np.save(os.path.join(temp_folder, name + '.npy'), array)
+        columns[name] = {'type': 'float', 'file': name + '.npy', 'null_file': None}
+
+    encoded_strings = [string.encode('utf-8') if isinstance(string, unicode) else str(string) for string in strings]
+    offsets = np.zeros(len(encoded_strings) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(string) for string in encoded_strings])
+    np.save(os.path.join(temp_folder, 'Strings.npy'), np.frombuffer(''.join(encoded_strings), dtype=np.uint8))
+    np.save(os.path.join(temp_folder, 'Strings_Offsets.npy'), offsets)
+
+    with open(os.path.join(temp_folder, 'Columns.json'), 'w') as json_file:
+        json.dump({'num_rows'          : num_rows,
+                   'oid_field'         : oid_field,
+                   'spatialReference'  : pages[0].get('spatialReference') if pages else None,
+                   'columns'           : columns}, json_file, indent=2)
+
+    DA_File_Utils.Replace_Folder(temp_folder, snapshot_folder)
+
+    return num_rows
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Load_Columnar_Snapshot()
+def Load_Columnar_Snapshot(snapshot_folder):
+    """
+    PARAMETERS:
+      snapshot_folder (str): Full path to the folder of a columnar snapshot.
+
+    RETURNS:
+      snapshot (Columnar_Snapshot): The snapshot.  Only Columns.json is read
+        here, the string table is memory-mapped and the arrays are
+        memory-mapped when they are used.
+    """
+
+    with open(os.path.join(snapshot_folder, 'Columns.json')) as json_file:
+        info = json.load(json_file)
+
+    if os.path.exists(os.path.join(snapshot_folder, 'Strings_Offsets.npy')):
+        strings = String_Table(np.load(os.path.join(snapshot_folder, 'Strings.npy'), mmap_mode='r'),
+                               np.load(os.path.join(snapshot_folder, 'Strings_Offsets.npy'), mmap_mode='r'))
+    else:
+        # Written before the string table was memory-mapped
+        with open(os.path.join(snapshot_folder, 'Strings.json')) as json_file:
+            strings = json.load(json_file)
+
+    return Columnar_Snapshot(snapshot_folder, info, strings)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                  FUNCTION Load_Newest_Columnar_Snapshot()
+def Load_Newest_Columnar_Snapshot(FGDB_path):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the snapshot FCs.
+
+    RETURNS:
+      snapshot (Columnar_Snapshot): The columnar copy of the newest snapshot
+        in the manifest of the FGDB (see DA_Snapshot_Manifest.py), or None if
+        there is no newest snapshot or it has no columnar copy.
+    """
+
+    newest_snapshot = DA_Snapshot_Manifest.Get_Newest_Snapshot(DA_Snapshot_Manifest.Get_Manifest_Path(FGDB_path))
+    if newest_snapshot == None:
+        return None
+
+    snapshot_folder = os.path.join(Get_Columnar_Folder(FGDB_path), newest_snapshot['name'])
+    if not os.path.exists(os.path.join(snapshot_folder, 'Columns.json')):
+        return None
+
+    return Load_Columnar_Snapshot(snapshot_folder)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Get_File_Name()
+def Get_File_Name(field_name):
+    """
+    RETURNS:
+      file_name (str): The field name with anything that can't be in a file
+        name replaced by '_' (field names are already safe, this is just in
+        case).
+    """
+
+    return ''.join(char if char.isalnum() or char == '_' else '_' for char in field_name)
@@ -0,0 +1,215 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Field_Projection.py
+# Purpose:
+"""
+Functions used by 'DA_Download_Fire_Data.py' to work out which fields of the
+DA Reports layer the scripts actually use, so only those fields are
+downloaded (instead of every Survey123 field with outFields='*').
+
+A field of the layer is downloaded if it is:
+    1) Used in 'FieldsToCalculate.csv' (in a where clause, as the field to
+       calculate or in a calculation).
+    2) Used by QA_QC_Data(), Update_AGOL_Fields() or Handle_Stacked_Parcels()
+       in 'DA_Process_Fire_Data.py' (see SCRIPT_FIELDS below).
+    3) A field of the production FC.  'DA_Process_Fire_Data.py' appends the
+       processed data into the production FC by field name, so every field
+       it has must be downloaded or it would be empty.  The field names are
+       saved every time the production FC is read (see Write_Prod_Fields()),
+       so the fields can still be worked out on a run that can't reach it.
+    4) In the allow-list of the config file (Extra_Fields).
+    5) The OBJECTID, GlobalID or an editor tracking field of the layer.  They
+       are needed to page, merge and check the download.
+
+Names are matched to the fields of the layer without regard to case, and
+names that aren't fields of the layer (i.e. the PARCELS_ALL fields used in
+'FieldsToCalculate.csv') are ignored.
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import csv, json, os, re, time
+
+import DA_AGOL_Download
+
+# Fields of the layer used by 'DA_Process_Fire_Data.py' that are not in a
+#  Control CSV.  Keep this up to date if those functions change.
+SCRIPT_FIELDS = {'QA_QC_Data'             : ['ReportNumber', 'IncidentName'],
+                 'Update_AGOL_Fields'     : ['Quantity', 'EstimatedReplacementCost', 'ReportNumber'],
+                 'Handle_Stacked_Parcels' : ['ReportNumber']}
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                     FUNCTION Get_Fields_From_Calc_CSV()
+def Get_Fields_From_Calc_CSV(calc_fields_csv):
+    """
+    PARAMETERS:
+      calc_fields_csv (str): Full path to 'FieldsToCalculate.csv'.
+
+    RETURNS:
+      names (set of str): Every word in the 'SelectField Where', 'FieldToCalc'
+        and 'Calculation' columns that could be a field name.
+
+    FUNCTION:
+      To get the names of the fields that Fields_Calculate_Fields() uses.
+      Like Fields_Calculate_Fields(), the first two rows and columns B, D and
+      F are ignored.  Anything in quotes is a value, not a field, so it is
+      left out.  The names still include SQL words and words of the
+      calculation that aren't fields, those are dropped by Get_Out_Fields()
+      since they aren't fields of the layer.
+    """
+
+    names = set()
+
+    with open(calc_fields_csv) as csv_file:
+        readCSV = csv.reader(csv_file, delimiter = ',')
+
+        for row_num, row in enumerate(readCSV):
+            if row_num < 2 or len(row) < 5:
+                continue
+
+            for text in [row[0], row[2], row[4]]:
+                text = re.sub(r"'[^']*'", ' ', text)
+                text = re.sub(r'"[^"]*"', ' ', text)
+                names.update(re.findall(r'[A-Za-z_][A-Za-z0-9_]*', text))
+
+    return names
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Write_Prod_Fields()
+def Write_Prod_Fields(prod_fields_file, prod_FC_path, prod_fields):
+    """
+    PARAMETERS:
+      prod_fields_file (str): Full path to the .json file to write.
+      prod_FC_path (str): Full path to the production FC.
+      prod_fields (list of str): The field names of the production FC.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To save the field names of the production FC, for Read_Prod_Fields().
+    """
+
+    DA_AGOL_Download.Write_JSON_File(prod_fields_file, {'prod_FC_path' : prod_FC_path,
+                                                        'fields'       : prod_fields,
+                                                        'saved'        : time.time()})
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Read_Prod_Fields()
+def Read_Prod_Fields(prod_fields_file):
+    """
+    PARAMETERS:
+      prod_fields_file (str): Full path to the .json file written by
+        Write_Prod_Fields().
+
+    RETURNS:
+      saved (dict): {'prod_FC_path': .., 'fields': [..], 'saved': ..} or None
+        if the file doesn't exist or can't be read.
+    """
+
+    if not os.path.exists(prod_fields_file):
+        return None
+
+    try:
+        with open(prod_fields_file) as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Out_Fields()
+def Get_Out_Fields(layer_info, wanted_names):
+    """
+    PARAMETERS:
+      layer_info (dict): The JSON description of the layer (from
+        DA_AGOL_Download.Get_Layer_Info()).
+      wanted_names (iterable of str): The names of the fields wanted.
+
+    RETURNS:
+      out_fields (list of str): The fields of the layer that are wanted or
+        are always needed (see 5) at the top of this file), with the names as
+        the layer spells them and in the order of the layer.
+      skipped_fields (list of str): The fields of the layer that won't be
+        downloaded.
+
+    FUNCTION:
+      To match the wanted names to the fields of the layer.
+    """
+
+    wanted = set(name.lower() for name in wanted_names)
+
+    # Always needed
+    wanted.add(layer_info.get('objectIdField', 'OBJECTID').lower())
+    if layer_info.get('globalIdField'):
+        wanted.add(layer_info['globalIdField'].lower())
+    for field_name in (layer_info.get('editFieldsInfo') or {}).values():
+        if isinstance(field_name, basestring):
+            wanted.add(field_name.lower())
+
+    out_fields     = []
+    skipped_fields = []
+    for field in layer_info.get('fields') or []:
+        if field['name'].lower() in wanted or field.get('type') == 'esriFieldTypeOID':
+            out_fields.append(field['name'])
+        else:
+            skipped_fields.append(field['name'])
+
+    return out_fields, skipped_fields
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Build_Out_Fields()
+def Build_Out_Fields(layer_info, calc_fields_csv=None, prod_fields=None, extra_fields=None):
+    """
+    PARAMETERS:
+      layer_info (dict): The JSON description of the layer (from
+        DA_AGOL_Download.Get_Layer_Info()).
+      calc_fields_csv {str}: Full path to 'FieldsToCalculate.csv'. OPTIONAL.
+      prod_fields {list of str}: The field names of the production FC.
+        OPTIONAL.
+      extra_fields {list of str}: Field names to always download (the
+        allow-list). OPTIONAL.
+
+    RETURNS:
+      AGOL_fields (str): The outFields to download, i.e. 'OBJECTID,Quantity,...'
+        or '*' if the layer has no fields listed.
+
+    FUNCTION:
+      To work out and print which fields of the layer to download.
+    """
+
+    print '  Working out which fields to download:'
+
+    wanted_names = set()
+    for names in SCRIPT_FIELDS.values():
+        wanted_names.update(names)
+
+    if calc_fields_csv != None:
+        calc_names = Get_Fields_From_Calc_CSV(calc_fields_csv)
+        print '    {} name(s) from:  {}'.format(len(calc_names), calc_fields_csv)
+        wanted_names.update(calc_names)
+
+    if prod_fields != None:
+        print '    {} field(s) from the production FC'.format(len(prod_fields))
+        wanted_names.update(prod_fields)
+
+    if extra_fields != None:
+        print '    {} field(s) from the allow-list'.format(len(extra_fields))
+        wanted_names.update(extra_fields)
+
+    out_fields, skipped_fields = Get_Out_Fields(layer_info, wanted_names)
+
+    if len(out_fields) == 0:
+        print '    The layer has no fields listed, downloading all fields\n'
+        return '*'
+
+    print '    Downloading {} of the {} fields of the layer'.format(len(out_fields), len(out_fields) + len(skipped_fields))
+    if skipped_fields:
+        print '    Not downloading:  {}'.format(', '.join(skipped_fields))
+    print ''
+
+    return ','.join(out_fields)
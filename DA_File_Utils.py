@@ -0,0 +1,92 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_File_Utils.py
+# Purpose:
+"""
+File functions shared by the DA scripts.
+
+The scripts write their state files (the delta state, the manifest, the
+layer signature, the token cache, ...) to a temp file first and then rename
+the temp file over the old one, so a reader never sees a half written file.
+Replace_File() does that rename in one step on Windows too.  Replace_Folder()
+does the same for a folder of files.
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import os, shutil, sys
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                            FUNCTION Replace_File()
+def Replace_File(temp_path, path):
+    """
+    PARAMETERS:
+      temp_path (str): Full path to the new file.
+      path (str): Full path to the file to replace.  It doesn't have to
+        exist.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To rename 'temp_path' to 'path' in one step, so a reader of 'path'
+      always finds the old or the new file, never no file.  os.rename()
+      can't replace an existing file on Windows (and removing it first
+      leaves a gap with no file), so MoveFileExW() with
+      MOVEFILE_REPLACE_EXISTING is used there.
+    """
+
+    if os.name != 'nt':
+        os.rename(temp_path, path)
+        return
+
+    import ctypes
+
+    MOVEFILE_REPLACE_EXISTING = 0x1
+    MOVEFILE_WRITE_THROUGH    = 0x8
+
+    paths = [value.decode(sys.getfilesystemencoding() or 'mbcs') if isinstance(value, str) else value
+             for value in (temp_path, path)]
+    if not ctypes.windll.kernel32.MoveFileExW(paths[0], paths[1], MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+        raise ctypes.WinError()
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Replace_Folder()
+def Replace_Folder(temp_folder, folder):
+    """
+    PARAMETERS:
+      temp_folder (str): Full path to the new folder.
+      folder (str): Full path to the folder to replace.  It doesn't have to
+        exist.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To rename 'temp_folder' to 'folder'.  A folder can't be renamed over
+      another one, so the old 'folder' is first renamed aside (to
+      '<folder>.old'), and only deleted once the new folder is in place.  If
+      the new folder can't be renamed, the old one is put back.  So the old
+      files are never deleted before the new ones are in place, and a reader
+      that finds 'folder' always finds a whole folder.
+    """
+
+    old_folder = folder + '.old'
+    if os.path.exists(old_folder):
+        shutil.rmtree(old_folder)
+
+    if os.path.exists(folder):
+        os.rename(folder, old_folder)
+
+    try:
+        os.rename(temp_folder, folder)
+    except:
+        if os.path.exists(old_folder) and not os.path.exists(folder):
+            os.rename(old_folder, folder)
+        raise
+
+    # A reader may still have files of the old folder open (on Windows they
+    #  can't be deleted until it closes them), it is deleted next time then
+    shutil.rmtree(old_folder, ignore_errors=True)
@@ -0,0 +1,296 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Fingerprints.py
+# Purpose:
+"""
+Functions to know which DA Reports changed between two snapshots downloaded
+by 'DA_Download_Fire_Data.py'.
+
+When a snapshot is downloaded, a 'fingerprint' of every report is saved
+with it.  The fingerprint is 2 sha1s, one of the attributes and one of the
+geometry of the report.  The attributes and geometry are normalized so that
+the same report always has the same fingerprint:
+    1) The fields are sorted by name, and the editor tracking fields (which
+       change without the report changing) and the OBJECTID are left out.
+    2) Strings are stripped, and an empty string is the same as NULL.
+    3) A float with no decimals is the same as the integer (JSON and PBF
+       send numbers differently), and other floats are rounded to 6
+       decimals.
+    4) Coordinates are rounded to 6 decimals (so in a geographic spatial
+       reference a move of less than ~0.1 m is not seen as a move).
+
+The fingerprints are saved as
+{ReportNumber: [attribute fingerprint, geometry fingerprint]} in a .json file
+with the name of the snapshot FC, in a folder next to the FGDB (see
+Get_Fingerprints_Folder()).  If more than one feature has the same
+ReportNumber, the fingerprints of the ReportNumber are made from all of
+them.  A feature with no ReportNumber is saved as 'OBJECTID <oid>'.
+
+Diff_Snapshots() then gives the reports added, modified and deleted
+between any two snapshots in the manifest of the FGDB (see
+DA_Snapshot_Manifest.py), to report what changed between runs.  (The
+parcel of each report is kept from run to run by the spatial join itself,
+see DA_Parcel_Store.Join_Points_Incremental(), which hashes the point in the
+coordinates of the parcels.)
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import hashlib, json, os
+
+import DA_AGOL_Download
+import DA_Snapshot_Manifest
+
+# The field the reports are matched by
+KEY_FIELD = 'ReportNumber'
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Get_Fingerprints_Folder()
+def Get_Fingerprints_Folder(FGDB_path):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the snapshot FCs.
+
+    RETURNS:
+      fingerprints_folder (str): Full path to the folder with the
+        fingerprints of the snapshots of the FGDB, i.e. 'DA_Fire_From_AGOL.gdb'
+        has its fingerprints in 'DA_Fire_From_AGOL_Fingerprints' in the same
+        folder.
+    """
+
+    return os.path.splitext(FGDB_path.rstrip('\\/'))[0] + '_Fingerprints'
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Normalize_Value()
+def Normalize_Value(value):
+    """
+    RETURNS:
+      value: The value normalized (see the top of this file).
+    """
+
+    if isinstance(value, float):
+        if value == int(value) and abs(value) < 2 ** 53:
+            return int(value)
+        return round(value, 6)
+
+    if isinstance(value, basestring):
+        value = value.strip()
+        if value == '':
+            return None
+
+    return value
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Normalize_Geometry()
+def Normalize_Geometry(geometry):
+    """
+    RETURNS:
+      geometry: The esri JSON geometry with the coordinates rounded and
+        without the spatial reference (it is the same for every feature).
+    """
+
+    if isinstance(geometry, dict):
+        return dict((key, Normalize_Geometry(value)) for key, value in geometry.items()
+                    if key != 'spatialReference')
+
+    if isinstance(geometry, list):
+        return [Normalize_Geometry(value) for value in geometry]
+
+    if isinstance(geometry, float):
+        return round(geometry, 6)
+
+    return geometry
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Get_Geometry_Fingerprint()
+def Get_Geometry_Fingerprint(geometry):
+    """
+    RETURNS:
+      fingerprint (str): The sha1 of the normalized esri JSON geometry.
+    """
+
+    return hashlib.sha1(json.dumps(Normalize_Geometry(geometry), sort_keys=True, separators=(',', ':'))).hexdigest()
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Get_Feature_Fingerprint()
+def Get_Feature_Fingerprint(feature, exclude_fields):
+    """
+    PARAMETERS:
+      feature (dict): An esri JSON feature.
+      exclude_fields (set of str): The lower case names of the fields to
+        leave out.
+
+    RETURNS:
+      attribute_fingerprint (str): The sha1 of the normalized attributes.
+      geometry_fingerprint (str): The sha1 of the normalized geometry.
+    """
+
+    attributes = sorted((name.lower(), Normalize_Value(value))
+                        for name, value in feature.get('attributes', {}).items()
+                        if name.lower() not in exclude_fields)
+
+    attribute_fingerprint = hashlib.sha1(json.dumps(attributes, separators=(',', ':'))).hexdigest()
+
+    return attribute_fingerprint, Get_Geometry_Fingerprint(feature.get('geometry'))
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Get_Fingerprints()
+def Get_Fingerprints(features, oid_field='OBJECTID', exclude_fields=None):
+    """
+    PARAMETERS:
+      features (list of dict): The esri JSON features of a snapshot.
+      oid_field {str}: The OBJECTID field. OPTIONAL.
+      exclude_fields {list of str}: Other fields to leave out, i.e. the
+        editor tracking fields. OPTIONAL.
+
+    RETURNS:
+      fingerprints (dict): {ReportNumber: [attribute fingerprint,
+        geometry fingerprint]} for every report.
+    """
+
+    exclude = set(name.lower() for name in (exclude_fields or []) if name)
+    exclude.add(oid_field.lower())
+
+    feature_fingerprints = {}
+    for feature in features:
+        attributes = feature.get('attributes', {})
+        key = Normalize_Value(attributes.get(KEY_FIELD))
+        if key == None:
+            key = 'OBJECTID {}'.format(attributes.get(oid_field))
+
+        feature_fingerprints.setdefault(key, []).append(Get_Feature_Fingerprint(feature, exclude))
+
+    fingerprints = {}
+    for key, feature_fingerprint_list in feature_fingerprints.iteritems():
+        if len(feature_fingerprint_list) == 1:
+            fingerprints[key] = list(feature_fingerprint_list[0])
+        else:
+            fingerprints[key] = [hashlib.sha1(','.join(sorted(part))).hexdigest()
+                                 for part in zip(*feature_fingerprint_list)]
+
+    return fingerprints
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Save_Fingerprints()
+def Save_Fingerprints(FGDB_path, FC_name, fingerprints):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB of the snapshot.
+      FC_name (str): The name of the snapshot FC.
+      fingerprints (dict): From Get_Fingerprints().
+
+    RETURNS:
+      fingerprints_file (str): Full path to the saved fingerprints.
+    """
+
+    fingerprints_folder = Get_Fingerprints_Folder(FGDB_path)
+    if not os.path.exists(fingerprints_folder):
+        os.makedirs(fingerprints_folder)
+
+    fingerprints_file = os.path.join(fingerprints_folder, FC_name + '.json')
+    DA_AGOL_Download.Write_JSON_File(fingerprints_file, fingerprints)
+
+    return fingerprints_file
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Load_Fingerprints()
+def Load_Fingerprints(FGDB_path, FC_name):
+    """
+    RETURNS:
+      fingerprints (dict): The fingerprints saved for the snapshot FC
+        'FC_name', or None if none were saved.
+    """
+
+    fingerprints_file = os.path.join(Get_Fingerprints_Folder(FGDB_path), FC_name + '.json')
+
+    try:
+        with open(fingerprints_file) as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Diff_Fingerprints()
+def Diff_Fingerprints(old_fingerprints, new_fingerprints):
+    """
+    PARAMETERS:
+      old_fingerprints (dict), new_fingerprints (dict): From Get_Fingerprints()
+        or Load_Fingerprints().
+
+    RETURNS:
+      diff (dict): The sorted ReportNumbers that were 'added', 'modified'
+        and 'deleted', and the number 'unchanged'.
+    """
+
+    added    = sorted(key for key in new_fingerprints if key not in old_fingerprints)
+    deleted  = sorted(key for key in old_fingerprints if key not in new_fingerprints)
+    modified = sorted(key for key in new_fingerprints
+                      if key in old_fingerprints and new_fingerprints[key] != old_fingerprints[key])
+
+    return {'added'     : added,
+            'modified'  : modified,
+            'deleted'   : deleted,
+            'unchanged' : len(new_fingerprints) - len(added) - len(modified)}
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Diff_Snapshots()
+def Diff_Snapshots(FGDB_path, old_timestamp=None, new_timestamp=None):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the snapshot FCs.
+      old_timestamp {str}: 'YYYY_MM_DD__HH_MM_SS'.  The snapshot downloaded
+        at or before this time is compared. OPTIONAL.  Defaults to the
+        snapshot before the new snapshot.
+      new_timestamp {str}: 'YYYY_MM_DD__HH_MM_SS'.  The snapshot downloaded
+        at or before this time is compared. OPTIONAL.  Defaults to the newest
+        snapshot.
+
+    RETURNS:
+      diff (dict): From Diff_Fingerprints(), plus the 'old_snapshot' and
+        'new_snapshot' names.  Every report of the new snapshot is 'added' if
+        there is no old snapshot.
+
+    FUNCTION:
+      To find the reports that changed between two snapshots in the manifest
+      of the FGDB.  Raises a ValueError if a snapshot has no fingerprints.
+    """
+
+    manifest_path = DA_Snapshot_Manifest.Get_Manifest_Path(FGDB_path)
+
+    if new_timestamp == None:
+        new_snapshot = DA_Snapshot_Manifest.Get_Newest_Snapshot(manifest_path)
+    else:
+        new_snapshot = DA_Snapshot_Manifest.Get_Snapshot_At(manifest_path, new_timestamp)
+    if new_snapshot == None:
+        raise ValueError('There is no snapshot to compare in "{}"'.format(manifest_path))
+
+    if old_timestamp == None:
+        old_snapshot = DA_Snapshot_Manifest.Get_Previous_Snapshot(manifest_path, new_snapshot['timestamp'])
+    else:
+        old_snapshot = DA_Snapshot_Manifest.Get_Snapshot_At(manifest_path, old_timestamp)
+
+    new_fingerprints = Load_Fingerprints(FGDB_path, new_snapshot['name'])
+    if new_fingerprints == None:
+        raise ValueError('The snapshot "{}" has no fingerprints'.format(new_snapshot['name']))
+
+    old_fingerprints = {}
+    if old_snapshot != None:
+        old_fingerprints = Load_Fingerprints(FGDB_path, old_snapshot['name'])
+        if old_fingerprints == None:
+            raise ValueError('The snapshot "{}" has no fingerprints'.format(old_snapshot['name']))
+
+    diff = Diff_Fingerprints(old_fingerprints, new_fingerprints)
+    diff['old_snapshot'] = old_snapshot['name'] if old_snapshot != None else None
+    diff['new_snapshot'] = new_snapshot['name']
+
+    return diff
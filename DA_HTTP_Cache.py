@@ -0,0 +1,353 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_HTTP_Cache.py
+# Purpose:
+"""
+A record / replay cache of the responses to the requests the DA scripts send
+to AGOL (queries, updates, tokens, uploads, publish status, attachments...).
+
+Every request goes through DA_HTTP_Client, so the cache works for all of the
+scripts without changing how they call AGOL.  It has 3 modes:
+    OFF:     The default.  Nothing is saved, every request goes to AGOL.
+    RECORD:  Every request goes to AGOL and the response is saved in the
+             cache folder.  If a response in the cache has an ETag or a
+             Last-Modified header, the request is sent as a conditional
+             request (If-None-Match / If-Modified-Since), and if the server
+             answers '304 Not Modified' the saved response is used.
+    REPLAY:  No request goes to AGOL.  Every response comes from the cache,
+             and a request that isn't in the cache raises Cache_Miss.  A run
+             in REPLAY mode gets exactly the responses of the recorded run,
+             so processing problems and timings can be looked at again and
+             again without the network (and without changing the data in
+             AGOL, since updates are replayed too).
+
+A response is saved under a key made from the method, the URL and the
+parameters, with the token (and password) left out so a replay with a
+different token finds the same response.  The token in the body of a
+generateToken response is not saved (it is replaced by SCRUBBED_TOKEN), so
+the cache folder never holds a live token.  The parameters are sorted so their
+order doesn't matter, and the boundary of a multipart upload is taken out
+of its body.  Only responses with a status code under 400 are saved.
+
+Each response is saved as 2 files in the cache folder:
+    <key>.json = The method, URL, parameters (without the token), status and
+                 headers of the response.
+    <key>.body = The body of the response.
+
+To use the cache in a script, add a section to the config file:
+
+    [HTTP_Cache]
+    # OFF, RECORD or REPLAY (default OFF)
+    Mode = RECORD
+
+    # OPTIONAL. Folder for the cache.  Defaults to 'HTTP_Cache' in the folder
+    # of the config file.
+    Folder =
+
+and call Configure_From_Config(cfgFile) at the start of the script.
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import ConfigParser, hashlib, json, os, re, shutil, threading, urllib, urlparse
+
+import DA_File_Utils
+import DA_HTTP_Client
+
+# Parameters left out of the key (and out of the saved .json files)
+SECRET_PARAMS = ['token', 'password']
+
+# The responses of these end points have a token in the body, which is
+#  replaced by SCRUBBED_TOKEN before the body is saved
+TOKEN_END_POINTS = ['/generatetoken', '/oauth2/token']
+SCRUBBED_TOKEN   = 'TOKEN_NOT_SAVED'
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                             CLASS Cache_Miss()
+class Cache_Miss(Exception):
+    """
+    Raised in REPLAY mode for a request that isn't in the cache.
+    """
+    pass
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           CLASS Response_Cache()
+class Response_Cache(object):
+    """
+    Saves and finds the responses of DA_HTTP_Client (see the top of this
+    file).  It is safe to use from more than one thread.
+    """
+
+    MODES = ['OFF', 'RECORD', 'REPLAY']
+
+    def __init__(self, cache_folder, mode='RECORD'):
+        """
+        PARAMETERS:
+          cache_folder (str): Full path to the folder to save the responses in.
+            It is made if it doesn't exist.
+          mode {str}: 'OFF', 'RECORD' or 'REPLAY'. OPTIONAL.
+        """
+
+        mode = mode.strip().upper()
+        if mode not in self.MODES:
+            raise ValueError('HTTP cache mode "{}" is not one of {}'.format(mode, ', '.join(self.MODES)))
+
+        self.cache_folder = cache_folder
+        self.mode         = mode
+        self.lock         = threading.Lock()
+
+        self.stats = {'recorded': 0, 'replayed': 0, 'not_modified': 0, 'misses': 0}
+
+        if self.mode != 'OFF' and not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+
+    #---------------------------------------------------------------------------
+    def Is_Recording(self):
+        return self.mode == 'RECORD'
+
+    def Is_Replaying(self):
+        return self.mode == 'REPLAY'
+
+    #---------------------------------------------------------------------------
+    def Get_Key(self, method, url, params=None, body=None, headers=None):
+        """
+        RETURNS:
+          key (str): The key the response to this request is saved under.
+          request_info (dict): The method, URL and parameters, with the
+            token and password left out (saved with the response so the
+            cache folder can be looked through).
+        """
+
+        parts = urlparse.urlsplit(url)
+        items = urlparse.parse_qsl(parts.query, keep_blank_values=True)
+        if params:
+            items += params.items() if isinstance(params, dict) else list(params)
+
+        clean_items = []
+        for name, value in items:
+            if name.lower() in SECRET_PARAMS:
+                continue
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            clean_items.append((str(name), str(value)))
+        clean_items.sort()
+
+        clean_url = urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, '', ''))
+
+        key_parts = [method.upper(), clean_url, urllib.urlencode(clean_items)]
+
+        if body != None:
+            # A multipart body has a random boundary, take it out
+            content_type = (headers or {}).get('Content-Type', '')
+            match = re.search(r'boundary=([^;\s]+)', content_type)
+            if match:
+                body = body.replace(match.group(1), '')
+            # The token may be in a url-encoded body
+            body = re.sub(r'(^|&)(token|password)=[^&]*', r'\1\2=', body)
+            key_parts.append(hashlib.sha1(body).hexdigest())
+
+        key = hashlib.sha1('\n'.join(key_parts)).hexdigest()
+        request_info = {'method': method.upper(), 'url': clean_url, 'params': clean_items}
+
+        return key, request_info
+
+    #---------------------------------------------------------------------------
+    def Lookup(self, method, url, params=None, body=None, headers=None):
+        """
+        RETURNS:
+          key (str), request_info (dict): From Get_Key().
+          info (dict): The saved response (see Load()), or None.
+
+        FUNCTION:
+          To find the saved response to a request.  In REPLAY mode Cache_Miss
+          is raised if it isn't saved.
+        """
+
+        key, request_info = self.Get_Key(method, url, params, body, headers)
+        info = self.Load(key)
+
+        if self.Is_Replaying():
+            if info == None:
+                self.Count('misses')
+                raise Cache_Miss('No response in the HTTP cache for {} {}'.format(method.upper(), request_info['url']))
+            self.Count('replayed')
+
+        return key, request_info, info
+
+    #---------------------------------------------------------------------------
+    def Get_Paths(self, key):
+        """
+        RETURNS:
+          info_path (str), body_path (str): The 2 files of a saved response.
+        """
+
+        return os.path.join(self.cache_folder, key + '.json'), os.path.join(self.cache_folder, key + '.body')
+
+    #---------------------------------------------------------------------------
+    def Load(self, key):
+        """
+        RETURNS:
+          info (dict): The saved request and response info, with the path of
+            the body in 'body_path', or None if the response isn't saved.
+        """
+
+        info_path, body_path = self.Get_Paths(key)
+
+        try:
+            with open(info_path) as json_file:
+                info = json.load(json_file)
+        except (IOError, ValueError):
+            return None
+
+        if not os.path.exists(body_path):
+            return None
+
+        info['body_path'] = body_path
+        return info
+
+    #---------------------------------------------------------------------------
+    def Read_Body(self, info):
+        """
+        RETURNS:
+          body (str): The saved body of the response.
+        """
+
+        with open(info['body_path'], 'rb') as body_file:
+            return body_file.read()
+
+    #---------------------------------------------------------------------------
+    def Get_Conditional_Headers(self, info):
+        """
+        RETURNS:
+          headers (dict): If-None-Match / If-Modified-Since headers from the
+            ETag / Last-Modified of a saved response.  Empty if it has neither.
+        """
+
+        headers = {}
+        if info == None:
+            return headers
+
+        saved_headers = info.get('headers', {})
+        if saved_headers.get('etag'):
+            headers['If-None-Match'] = saved_headers['etag']
+        if saved_headers.get('last-modified'):
+            headers['If-Modified-Since'] = saved_headers['last-modified']
+
+        return headers
+
+    #---------------------------------------------------------------------------
+    def Save(self, key, request_info, status, headers, body=None, body_file_path=None):
+        """
+        PARAMETERS:
+          key (str), request_info (dict): From Get_Key().
+          status (int): The status code of the response.
+          headers (dict): The headers of the response (lower case names).
+          body {str}: The body of the response.
+          body_file_path {str}: Full path to a file with the body of the
+            response (i.e. a downloaded attachment).  Used instead of 'body'.
+
+        FUNCTION:
+          To save a response.  Both files are written to a temp file and
+          renamed, the body first, so a reader never finds a half written
+          response.  The token in the response of a token end point is
+          scrubbed first.
+        """
+
+        info_path, body_path = self.Get_Paths(key)
+
+        if body != None and any(request_info['url'].lower().endswith(end_point) for end_point in TOKEN_END_POINTS):
+            body = Scrub_Tokens(body)
+
+        saved_headers = dict((name, value) for name, value in headers.items()
+                             if name in ('content-type', 'etag', 'last-modified'))
+        info = dict(request_info)
+        info.update({'status': status, 'headers': saved_headers})
+
+        temp_body_path = '{}.{}.tmp'.format(body_path, threading.current_thread().ident)
+        if body_file_path != None:
+            shutil.copyfile(body_file_path, temp_body_path)
+        else:
+            with open(temp_body_path, 'wb') as body_file:
+                body_file.write(body)
+
+        with self.lock:
+            DA_File_Utils.Replace_File(temp_body_path, body_path)
+
+            temp_info_path = info_path + '.tmp'
+            with open(temp_info_path, 'w') as json_file:
+                json.dump(info, json_file, indent=2)
+            DA_File_Utils.Replace_File(temp_info_path, info_path)
+
+            self.stats['recorded'] += 1
+
+    #---------------------------------------------------------------------------
+    def Count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    #---------------------------------------------------------------------------
+    def Print_Stats(self):
+        """
+        FUNCTION:
+          To print how many responses were recorded, replayed and not
+          modified.
+        """
+
+        stats = self.stats
+        print '  HTTP cache ({}): {} recorded, {} replayed, {} not modified, {} missing'.format(
+                    self.mode, stats['recorded'], stats['replayed'], stats['not_modified'], stats['misses'])
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Configure_From_Config()
+def Configure_From_Config(cfgFile):
+    """
+    PARAMETERS:
+      cfgFile (str): Full path to the config file.
+
+    RETURNS:
+      cache (Response_Cache): The cache the shared DA_HTTP_Client now uses,
+        or None if the [HTTP_Cache] Mode is OFF (or not set).
+
+    FUNCTION:
+      To turn on the cache for every request of this script, from the
+      [HTTP_Cache] section of the config file (see the top of this file).
+    """
+
+    config = ConfigParser.ConfigParser()
+    config.read(cfgFile)
+
+    mode = 'OFF'
+    if config.has_option('HTTP_Cache', 'Mode'):
+        mode = config.get('HTTP_Cache', 'Mode').strip().upper() or 'OFF'
+
+    cache_folder = ''
+    if config.has_option('HTTP_Cache', 'Folder'):
+        cache_folder = config.get('HTTP_Cache', 'Folder').strip()
+    if cache_folder == '':
+        cache_folder = os.path.join(os.path.dirname(os.path.abspath(cfgFile)), 'HTTP_Cache')
+
+    if mode == 'OFF':
+        DA_HTTP_Client.Set_Cache(None)
+        return None
+
+    cache = Response_Cache(cache_folder, mode)
+    DA_HTTP_Client.Set_Cache(cache)
+
+    print '  HTTP cache is in {} mode, the cache is at:\n    {}'.format(mode, cache_folder)
+
+    return cache
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Scrub_Tokens()
+def Scrub_Tokens(body):
+    """
+    RETURNS:
+      body (str): The body with the value of every 'token', 'access_token'
+        and 'refresh_token' in it replaced by SCRUBBED_TOKEN.
+    """
+
+    return re.sub(r'("(?:access_|refresh_)?token"\s*:\s*)"[^"]*"', r'\1"{}"'.format(SCRUBBED_TOKEN), body)
@@ -0,0 +1,294 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Layer_Signature.py
+# Purpose:
+"""
+Functions used by the DA scripts to tell if the hosted DA Reports layer has
+changed since the last time the whole series of scripts ran successfully.
+
+A 'signature' of the layer is a small dict:
+    count          = The number of features in the layer.
+    oid_checksum   = A checksum of the sorted list of OBJECTIDs, so a delete
+                     plus an add (same count) is still seen as a change.
+    last_edit_date = The newest edit date of the layer (ms since 1970).
+
+Getting a signature only takes two small queries, so it is much cheaper than
+downloading and processing the layer.
+
+How the scripts use it:
+    1) 'DA_Download_Fire_Data.py' gets the signature of the layer and compares
+       it to the signature saved by the last successful run.  If they match
+       it does not download anything and writes a NO_CHANGES file to the
+       success_error_folder (next to its SUCCESS file).  If they don't match
+       it downloads the layer and saves the new signature as 'pending'.
+    2) 'DA_Process_Fire_Data.py', 'DA_Publish_FS_Exec_Dashboard.py' and
+       'DA_Download_Fire_Attachments.py' skip their work if the NO_CHANGES
+       file exists, but still write their SUCCESS file.
+    3) 'DA_Download_Fire_Attachments.py' (the last script) moves the pending
+       signature into place only if all the scripts were successful, so a
+       failed run is redone the next time even if nobody edits the layer.
+
+The last edit date is the newest edit date of ALL the features (or the
+layer's 'editingInfo.lastEditDate' if there is no editor tracking), so an
+edit is seen even if these scripts edit the same feature again later.
+
+NOTE: 'DA_Process_Fire_Data.py' edits the layer itself every run (see
+Update_AGOL_Fields()), which moves the last edit date.  Once its edits are
+done it calls Record_Pipeline_Edits(), which moves the last edit date of
+the pending signature to the edit date the scripts wrote, so the next run
+doesn't see the scripts' own edits as a change.  That is only done if no
+feature was edited by anyone else since the pending signature was taken.
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import hashlib, json, os
+
+import DA_AGOL_Download
+import DA_File_Utils
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Get_Layer_Signature()
+def Get_Layer_Signature(FS_url, index_of_layer, token):
+    """
+    PARAMETERS:
+      FS_url (str): The URL of the Feature Service (up to the '/FeatureServer'
+        part).
+      index_of_layer (int): The index of the layer in the Feature Service.
+      token (str): The token obtained by Get_Token().
+
+    RETURNS:
+      signature (dict): With the keys 'count', 'oid_checksum' and
+        'last_edit_date'.
+
+    FUNCTION:
+      To get a cheap signature of the layer that changes whenever a feature is
+      added, deleted or edited.
+    """
+
+    query_url = '{}/{}/query'.format(FS_url, index_of_layer)
+
+    # Count and checksum the OBJECTIDs
+    object_ids = DA_AGOL_Download.Get_Object_Ids(query_url, token)
+    oid_checksum = hashlib.md5(','.join(str(object_id) for object_id in object_ids)).hexdigest()
+
+    # Get the last edit date
+    layer_info = DA_AGOL_Download.Get_Layer_Info(FS_url, index_of_layer, token)
+    edit_date_field = (layer_info.get('editFieldsInfo') or {}).get('editDateField')
+
+    if edit_date_field != None:
+        last_edit_date = Get_Max_Value(query_url, token, edit_date_field)
+
+        # 0 (not None) if no feature has an edit date
+        if last_edit_date == None:
+            last_edit_date = 0
+    else:
+        last_edit_date = (layer_info.get('editingInfo') or {}).get('lastEditDate')
+
+    signature = {'count'          : len(object_ids),
+                 'oid_checksum'   : oid_checksum,
+                 'last_edit_date' : last_edit_date}
+
+    return signature
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Record_Pipeline_Edits()
+def Record_Pipeline_Edits(pending_signature_file, FS_url, index_of_layer, token, pipeline_user):
+    """
+    PARAMETERS:
+      pending_signature_file (str): Full path to the signature saved by
+        'DA_Download_Fire_Data.py' for this run.
+      FS_url (str), index_of_layer (int), token (str): The layer (see
+        Get_Layer_Signature()).
+      pipeline_user (str): The AGOL username these scripts edit the layer
+        with.
+
+    RETURNS:
+      recorded (boolean): True if the pending signature was moved past the
+        edits of these scripts.
+
+    FUNCTION:
+      To call once these scripts are done editing the layer.  The last edit
+      date of the pending signature is set to the newest edit date of the
+      layer now, so the next run doesn't see the scripts' own edits as a
+      change.  The count and OBJECTID checksum are left as they were before
+      the download, so a feature added or deleted during the run is still
+      seen by the next run.
+
+      It is NOT done (and the next run downloads the layer again) if there is
+      no pending signature, if the layer has no editor tracking, or if a
+      feature last edited by anyone other than 'pipeline_user' has an edit
+      date newer than the pending signature (it was edited during the run,
+      maybe after it was downloaded).
+    """
+
+    pending_signature = Read_Signature(pending_signature_file)
+    if pending_signature == None:
+        print '  There is no pending signature, nothing to record'
+        return False
+
+    layer_info = DA_AGOL_Download.Get_Layer_Info(FS_url, index_of_layer, token)
+    edit_fields_info = layer_info.get('editFieldsInfo') or {}
+    edit_date_field = edit_fields_info.get('editDateField')
+    editor_field    = edit_fields_info.get('editorField')
+
+    if edit_date_field == None or editor_field == None:
+        print '  The layer does not have editor tracking, the next run will see these edits as a change'
+        return False
+
+    query_url = '{}/{}/query'.format(FS_url, index_of_layer)
+
+    # The newest edit by anyone else
+    where_clause = "{0} IS NULL OR {0} <> '{1}'".format(editor_field, pipeline_user.replace("'", "''"))
+    last_other_edit_date = Get_Max_Value(query_url, token, edit_date_field, where_clause)
+    if last_other_edit_date > pending_signature.get('last_edit_date'):
+        print '  The layer was edited by someone else during this run, the next run will download it again'
+        return False
+
+    last_edit_date = Get_Max_Value(query_url, token, edit_date_field)
+    print '  Moving the last edit date of the pending signature from {} to {} (the edits of {})'.format(
+                pending_signature.get('last_edit_date'), last_edit_date, pipeline_user)
+
+    pending_signature['last_edit_date'] = last_edit_date
+    Write_Signature(pending_signature_file, pending_signature)
+
+    return True
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Get_Max_Value()
+def Get_Max_Value(query_url, token, field_name, where_clause='1=1'):
+    """
+    PARAMETERS:
+      query_url (str): The '/query' URL of the layer.
+      token (str): The token obtained by Get_Token().
+      field_name (str): The field to get the largest value of.
+      where_clause {str}: Only look at the features that satisfy this where
+        clause. OPTIONAL. Defaults to all features.
+
+    RETURNS:
+      max_value: The largest value in the field, or None if no features
+        satisfied the where clause.
+
+    FUNCTION:
+      To have the server work out the largest value of a field (a statistics
+      query), so no features have to be downloaded.
+    """
+
+    out_statistics = [{'statisticType'         : 'max',
+                       'onStatisticField'      : field_name,
+                       'outStatisticFieldName' : 'max_value'}]
+
+    params = {'where'         : where_clause,
+              'outStatistics' : json.dumps(out_statistics),
+              'f'             : 'json',
+              'token'         : token}
+
+    response_json = DA_AGOL_Download.Get_JSON(query_url, params)[0]
+
+    features = response_json.get('features') or []
+    if len(features) == 0:
+        return None
+
+    # Some servers change the case of the out field name
+    for key, value in features[0]['attributes'].iteritems():
+        if key.lower() == 'max_value':
+            return value
+
+    return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Read_Signature()
+def Read_Signature(signature_file):
+    """
+    PARAMETERS:
+      signature_file (str): Full path to a signature .json file.
+
+    RETURNS:
+      signature (dict): The saved signature, or None if the file doesn't exist.
+
+    FUNCTION:
+      To read a signature saved by Write_Signature().
+    """
+
+    if not os.path.exists(signature_file):
+        return None
+
+    with open(signature_file) as json_file:
+        return json.load(json_file)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Write_Signature()
+def Write_Signature(signature_file, signature):
+    """
+    PARAMETERS:
+      signature_file (str): Full path to the signature .json file to write.
+      signature (dict): The signature from Get_Layer_Signature().
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To save a signature so it can be compared to the next run.
+    """
+
+    DA_AGOL_Download.Write_JSON_File(signature_file, signature)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Signatures_Match()
+def Signatures_Match(signature_1, signature_2):
+    """
+    PARAMETERS:
+      signature_1, signature_2 (dict or None): Two signatures.
+
+    RETURNS:
+      match (boolean): True if both signatures exist and are the same.
+
+    FUNCTION:
+      To tell if the layer has changed between two signatures.  A signature
+      with no last edit date never matches, so a layer that can't tell us
+      when it was edited is always processed.
+    """
+
+    if signature_1 == None or signature_2 == None:
+        return False
+
+    if signature_1.get('last_edit_date') == None:
+        return False
+
+    for key in ['count', 'oid_checksum', 'last_edit_date']:
+        if signature_1.get(key) != signature_2.get(key):
+            return False
+
+    return True
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Commit_Pending_Signature()
+def Commit_Pending_Signature(pending_signature_file, signature_file):
+    """
+    PARAMETERS:
+      pending_signature_file (str): Full path to the signature saved by
+        'DA_Download_Fire_Data.py' for this run.
+      signature_file (str): Full path to the signature of the last successful
+        run.
+
+    RETURNS:
+      committed (boolean): True if there was a pending signature to commit.
+
+    FUNCTION:
+      To make the pending signature the signature of the last successful run.
+      Only call this once ALL of the scripts have run successfully.
+    """
+
+    if not os.path.exists(pending_signature_file):
+        return False
+
+    DA_File_Utils.Replace_File(pending_signature_file, signature_file)
+
+    return True
@@ -0,0 +1,572 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_PBF_Decoder.py
+# Purpose:
+"""
+A pure Python decoder for the protocol buffer (f=pbf) format that ArcGIS
+Online Feature Services can return from a '/query'.
+
+Decode_Feature_Collection() turns the bytes of a 'f=pbf' response into the
+same dictionary that json.loads() gives for the 'f=json' response, i.e.:
+    {'objectIdFieldName': 'OBJECTID',
+     'geometryType'     : 'esriGeometryPoint',
+     'spatialReference' : {'wkid': 102100, 'latestWkid': 3857},
+     'fields'           : [{'name': 'OBJECTID', 'type': 'esriFieldTypeOID', ...}, ...],
+     'features'         : [{'attributes': {...}, 'geometry': {'x': .., 'y': ..}}, ...]}
+so the code that uses the pages doesn't need to know which format was used.
+
+The PBF format is a lot smaller than JSON because the field names are only
+sent once (not once per feature), numbers are sent as binary, and the
+coordinates are sent as small integer offsets from the previous vertex.
+
+The schema (FeatureCollection.proto) is published by Esri at:
+    https://github.com/Esri/arcgis-pbf
+
+No protobuf library is needed, only the parts of the format that a query
+returns are decoded.  If the bytes can't be decoded a PBF_Decode_Error is
+raised so the caller can ask for the page again as JSON.
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import struct
+
+#-------------------------------------------------------------------------------
+#                     Values of the enums in the .proto file
+
+GEOMETRY_TYPES = {0  : 'esriGeometryPoint',
+                  1  : 'esriGeometryMultipoint',
+                  2  : 'esriGeometryPolyline',
+                  3  : 'esriGeometryPolygon',
+                  4  : 'esriGeometryMultipatch',
+                  127: None}
+
+FIELD_TYPES = {0 : 'esriFieldTypeSmallInteger',
+               1 : 'esriFieldTypeInteger',
+               2 : 'esriFieldTypeSingle',
+               3 : 'esriFieldTypeDouble',
+               4 : 'esriFieldTypeString',
+               5 : 'esriFieldTypeDate',
+               6 : 'esriFieldTypeOID',
+               7 : 'esriFieldTypeGeometry',
+               8 : 'esriFieldTypeBlob',
+               9 : 'esriFieldTypeRaster',
+               10: 'esriFieldTypeGUID',
+               11: 'esriFieldTypeGlobalID',
+               12: 'esriFieldTypeXML'}
+
+QUANTIZE_ORIGIN_UPPER_LEFT = 0
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         CLASS PBF_Decode_Error()
+class PBF_Decode_Error(Exception):
+    """
+    Raised when the bytes are not a FeatureCollectionPBuffer this decoder
+    understands.
+    """
+    pass
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                     FUNCTION Decode_Feature_Collection()
+def Decode_Feature_Collection(pbf_bytes, layer_fields=None):
+    """
+    PARAMETERS:
+      pbf_bytes (str): The body of a '/query?f=pbf' response.
+      layer_fields {list of dict}: The 'fields' of the layer (from the layer's
+        JSON description).  OPTIONAL.  The PBF format doesn't send the
+        'length' of the fields, so it is copied from here if given.
+
+    RETURNS:
+      result (dict): The same dictionary that the 'f=json' response gives.
+        For a 'returnIdsOnly' query it has 'objectIdFieldName' and
+        'objectIds', and for a 'returnCountOnly' query it has 'count'.
+
+    FUNCTION:
+      To decode a FeatureCollectionPBuffer message.
+    """
+
+    buf = bytearray(pbf_bytes)
+
+    try:
+        query_result = None
+        for field_num, wire_type, value in Iter_Fields(buf, 0, len(buf)):
+            if field_num == 2 and wire_type == 2:
+                query_result = value
+
+        if query_result == None:
+            raise PBF_Decode_Error('There is no queryResult in the response')
+
+        for field_num, wire_type, value in Iter_Fields(buf, query_result[0], query_result[1]):
+            if field_num == 1 and wire_type == 2:
+                return Decode_Feature_Result(buf, value[0], value[1], layer_fields)
+
+            elif field_num == 2 and wire_type == 2:
+                count = 0
+                for sub_num, sub_type, sub_value in Iter_Fields(buf, value[0], value[1]):
+                    if sub_num == 1:
+                        count = sub_value
+                return {'count': count}
+
+            elif field_num == 3 and wire_type == 2:
+                return Decode_Ids_Result(buf, value[0], value[1])
+
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise PBF_Decode_Error('Could not decode the PBF response: {}'.format(e))
+
+    raise PBF_Decode_Error('The queryResult has no features, count or OBJECTIDs')
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Decode_Feature_Result()
+def Decode_Feature_Result(buf, start, end, layer_fields=None):
+    """
+    PARAMETERS:
+      buf (bytearray): The whole response.
+      start, end (int): Where the FeatureResult message is in 'buf'.
+      layer_fields {list of dict}: See Decode_Feature_Collection(). OPTIONAL.
+
+    RETURNS:
+      result (dict): The 'f=json' style dictionary of the features.
+
+    FUNCTION:
+      To decode a FeatureResult message.  The fields and the transform are
+      decoded first, then the features (which need them).
+    """
+
+    result = {'fields': [], 'features': []}
+    has_z = False
+    has_m = False
+    transform = None
+    feature_spans = []
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 1:
+            result['objectIdFieldName'] = Decode_String(buf, value)
+        elif field_num == 3:
+            result['globalIdFieldName'] = Decode_String(buf, value)
+        elif field_num == 7:
+            result['geometryType'] = GEOMETRY_TYPES.get(value)
+        elif field_num == 8:
+            result['spatialReference'] = Decode_Spatial_Reference(buf, value[0], value[1])
+        elif field_num == 9:
+            if value:
+                result['exceededTransferLimit'] = True
+        elif field_num == 10:
+            has_z = bool(value)
+        elif field_num == 11:
+            has_m = bool(value)
+        elif field_num == 12:
+            transform = Decode_Transform(buf, value[0], value[1])
+        elif field_num == 13:
+            result['fields'].append(Decode_Field(buf, value[0], value[1]))
+        elif field_num == 15:
+            feature_spans.append(value)
+
+    if has_z:
+        result['hasZ'] = True
+    if has_m:
+        result['hasM'] = True
+
+    # Copy the field lengths (not sent in the PBF) from the layer description
+    if layer_fields:
+        lengths = dict((field['name'].lower(), field.get('length')) for field in layer_fields)
+        for field in result['fields']:
+            length = lengths.get(field['name'].lower())
+            if length != None:
+                field['length'] = length
+
+    field_names = [field['name'] for field in result['fields']]
+    single_fields = [field['type'] == 'esriFieldTypeSingle' for field in result['fields']]
+    geometry_type = result.get('geometryType')
+
+    features = result['features']
+    for feature_start, feature_end in feature_spans:
+        features.append(Decode_Feature(buf, feature_start, feature_end, field_names, single_fields,
+                                       geometry_type, transform, has_z, has_m))
+
+    return result
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Decode_Feature()
+def Decode_Feature(buf, start, end, field_names, single_fields, geometry_type, transform, has_z, has_m):
+    """
+    PARAMETERS:
+      buf (bytearray): The whole response.
+      start, end (int): Where the Feature message is in 'buf'.
+      field_names (list of str): The names of the fields, in the order the
+        attribute values are sent.
+      single_fields (list of bool): True for the fields that are
+        'esriFieldTypeSingle' (their values are rounded like the JSON is).
+      geometry_type (str): i.e. 'esriGeometryPoint'.
+      transform (dict): From Decode_Transform().
+      has_z, has_m (bool): If the vertices have Z and M values.
+
+    RETURNS:
+      feature (dict): {'attributes': {...}, 'geometry': {...}}.  There is no
+        'geometry' key if the feature has no geometry (like the JSON).
+
+    FUNCTION:
+      To decode one Feature message.
+    """
+
+    attributes = {}
+    feature = {'attributes': attributes}
+    value_index = 0
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 1:
+            if value_index < len(field_names):
+                attribute = Decode_Value(buf, value[0], value[1])
+                if attribute != None and single_fields[value_index]:
+                    attribute = float('%.7g' % attribute)
+                attributes[field_names[value_index]] = attribute
+            value_index += 1
+
+        elif field_num == 2:
+            feature['geometry'] = Decode_Geometry(buf, value[0], value[1], geometry_type, transform, has_z, has_m)
+
+        elif field_num == 3:
+            raise PBF_Decode_Error('esriShapeBuffer geometries are not supported')
+
+    return feature
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Decode_Geometry()
+def Decode_Geometry(buf, start, end, geometry_type, transform, has_z, has_m):
+    """
+    PARAMETERS:
+      buf (bytearray): The whole response.
+      start, end (int): Where the Geometry message is in 'buf'.
+      geometry_type (str): i.e. 'esriGeometryPolygon'.
+      transform (dict): From Decode_Transform().
+      has_z, has_m (bool): If the vertices have Z and M values.
+
+    RETURNS:
+      geometry (dict): The esri JSON geometry, i.e. {'x': .., 'y': ..} or
+        {'rings': [[[x, y], ...], ...]}.
+
+    FUNCTION:
+      To decode one Geometry message.  Each coordinate is sent as the
+      (quantized) offset from the same coordinate of the previous vertex, so
+      the offsets are summed and then scaled and translated back into map
+      units.  The offsets keep going from one part to the next.
+    """
+
+    lengths = []
+    coords  = []
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 2:
+            if wire_type == 2:
+                lengths.extend(Decode_Packed_Varints(buf, value[0], value[1]))
+            else:
+                lengths.append(value)
+
+        elif field_num == 3:
+            if wire_type == 2:
+                coords.extend(Zigzag(n) for n in Decode_Packed_Varints(buf, value[0], value[1]))
+            else:
+                coords.append(Zigzag(value))
+
+    num_dims = 2 + int(has_z) + int(has_m)
+
+    # Scale and translate for each dimension (x, y, then z and/or m)
+    if transform != None:
+        y_sign = -1 if transform['origin'] == QUANTIZE_ORIGIN_UPPER_LEFT else 1
+        scales = [transform['xScale'], y_sign * transform['yScale']]
+        translates = [transform['xTranslate'], transform['yTranslate']]
+        if has_z:
+            scales.append(transform['zScale'] or 1)
+            translates.append(transform['zTranslate'])
+        if has_m:
+            scales.append(transform['mScale'] or 1)
+            translates.append(transform['mTranslate'])
+    else:
+        scales = [1] * num_dims
+        translates = [0] * num_dims
+
+    # Sum the offsets and turn them into map units
+    vertices = []
+    totals = [0] * num_dims
+    for i in range(0, len(coords) - num_dims + 1, num_dims):
+        vertex = []
+        for dim in range(num_dims):
+            totals[dim] += coords[i + dim]
+            vertex.append(translates[dim] + totals[dim] * scales[dim])
+        vertices.append(vertex)
+
+    if geometry_type == 'esriGeometryPoint':
+        if len(vertices) == 0:
+            return None
+        geometry = {'x': vertices[0][0], 'y': vertices[0][1]}
+        if has_z:
+            geometry['z'] = vertices[0][2]
+        if has_m:
+            geometry['m'] = vertices[0][-1]
+        return geometry
+
+    if geometry_type == 'esriGeometryMultipoint':
+        return {'points': vertices}
+
+    # Split the vertices into parts
+    if len(lengths) == 0:
+        lengths = [len(vertices)]
+
+    parts = []
+    first = 0
+    for length in lengths:
+        parts.append(vertices[first:first + length])
+        first += length
+
+    if geometry_type == 'esriGeometryPolyline':
+        return {'paths': parts}
+
+    return {'rings': parts}
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Decode_Ids_Result()
+def Decode_Ids_Result(buf, start, end):
+    """
+    PARAMETERS:
+      buf (bytearray): The whole response.
+      start, end (int): Where the ObjectIdsResult message is in 'buf'.
+
+    RETURNS:
+      result (dict): {'objectIdFieldName': .., 'objectIds': [..]}
+
+    FUNCTION:
+      To decode the response of a 'returnIdsOnly' query.
+    """
+
+    result = {'objectIds': []}
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 1:
+            result['objectIdFieldName'] = Decode_String(buf, value)
+        elif field_num == 3:
+            if wire_type == 2:
+                result['objectIds'].extend(Decode_Packed_Varints(buf, value[0], value[1]))
+            else:
+                result['objectIds'].append(value)
+
+    return result
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Decode_Field()
+def Decode_Field(buf, start, end):
+    """
+    RETURNS:
+      field (dict): {'name': .., 'type': .., 'alias': ..} like the JSON.
+
+    FUNCTION:
+      To decode one Field message.
+    """
+
+    field = {'name': '', 'type': FIELD_TYPES[0], 'alias': ''}
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 1:
+            field['name'] = Decode_String(buf, value)
+        elif field_num == 2:
+            field['type'] = FIELD_TYPES.get(value)
+        elif field_num == 3:
+            field['alias'] = Decode_String(buf, value)
+        elif field_num == 5:
+            field['domain'] = Decode_String(buf, value)
+        elif field_num == 6:
+            field['defaultValue'] = Decode_String(buf, value)
+
+    return field
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Decode_Value()
+def Decode_Value(buf, start, end):
+    """
+    RETURNS:
+      value: The attribute value (str, float, int, bool), or None if the
+        Value message is empty (a NULL attribute).
+
+    FUNCTION:
+      To decode one Value message.  Only one of its fields is ever set.
+    """
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 1:
+            return Decode_String(buf, value)
+        elif field_num == 2:
+            return struct.unpack('<f', value)[0]
+        elif field_num == 3:
+            return struct.unpack('<d', value)[0]
+        elif field_num == 4 or field_num == 8:
+            return Zigzag(value)
+        elif field_num == 5 or field_num == 7:
+            return value
+        elif field_num == 6:
+            return value - (1 << 64) if value >= (1 << 63) else value
+        elif field_num == 9:
+            return bool(value)
+
+    return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Decode_Spatial_Reference()
+def Decode_Spatial_Reference(buf, start, end):
+    """
+    RETURNS:
+      spatial_reference (dict): i.e. {'wkid': 102100, 'latestWkid': 3857}
+
+    FUNCTION:
+      To decode a SpatialReference message.
+    """
+
+    spatial_reference = {}
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 1:
+            spatial_reference['wkid'] = value
+        elif field_num == 2:
+            spatial_reference['latestWkid'] = value
+        elif field_num == 3:
+            spatial_reference['vcsWkid'] = value
+        elif field_num == 4:
+            spatial_reference['latestVcsWkid'] = value
+        elif field_num == 5:
+            spatial_reference['wkt'] = Decode_String(buf, value)
+
+    return spatial_reference
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Decode_Transform()
+def Decode_Transform(buf, start, end):
+    """
+    RETURNS:
+      transform (dict): The 'origin' (QuantizeOriginPostion) and the x/y/z/m
+        'Scale' and 'Translate' values.
+
+    FUNCTION:
+      To decode a Transform message, which says how to turn the quantized
+      integer coordinates back into map units.
+    """
+
+    transform = {'origin'     : QUANTIZE_ORIGIN_UPPER_LEFT,
+                 'xScale'     : 1.0, 'yScale'     : 1.0, 'mScale'     : 1.0, 'zScale'     : 1.0,
+                 'xTranslate' : 0.0, 'yTranslate' : 0.0, 'mTranslate' : 0.0, 'zTranslate' : 0.0}
+
+    for field_num, wire_type, value in Iter_Fields(buf, start, end):
+        if field_num == 1:
+            transform['origin'] = value
+
+        elif field_num in (2, 3):
+            if field_num == 2:
+                names = ['xScale', 'yScale', 'mScale', 'zScale']
+            else:
+                names = ['xTranslate', 'yTranslate', 'mTranslate', 'zTranslate']
+
+            for sub_num, sub_type, sub_value in Iter_Fields(buf, value[0], value[1]):
+                if 1 <= sub_num <= 4 and sub_type == 1:
+                    transform[names[sub_num - 1]] = struct.unpack('<d', sub_value)[0]
+
+    return transform
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                   Low level protocol buffer functions
+
+def Iter_Fields(buf, start, end):
+    """
+    PARAMETERS:
+      buf (bytearray): The whole response.
+      start, end (int): Where the message is in 'buf'.
+
+    RETURNS:
+      A generator of (field_num, wire_type, value) for each field in the
+      message.  'value' is an int for varints, a (start, end) tuple for
+      length delimited fields (strings, sub messages and packed lists), and
+      the raw bytes for 64 and 32 bit fields.
+
+    FUNCTION:
+      To walk the fields of one message.
+    """
+
+    pos = start
+    while pos < end:
+        key, pos = Read_Varint(buf, pos)
+        field_num = key >> 3
+        wire_type = key & 0x7
+
+        if wire_type == 0:
+            value, pos = Read_Varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = Read_Varint(buf, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == 1:
+            value = bytes(buf[pos:pos + 8])
+            pos += 8
+        elif wire_type == 5:
+            value = bytes(buf[pos:pos + 4])
+            pos += 4
+        else:
+            raise PBF_Decode_Error('Unknown wire type {}'.format(wire_type))
+
+        if pos > end:
+            raise PBF_Decode_Error('A field runs past the end of its message')
+
+        yield field_num, wire_type, value
+
+def Read_Varint(buf, pos):
+    """
+    RETURNS:
+      value (int), pos (int): The varint at 'pos' and the position after it.
+    """
+
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise PBF_Decode_Error('Varint is too long')
+
+def Decode_Packed_Varints(buf, start, end):
+    """
+    RETURNS:
+      values (list of int): The varints of a packed repeated field.
+    """
+
+    values = []
+    pos = start
+    while pos < end:
+        value, pos = Read_Varint(buf, pos)
+        values.append(value)
+
+    return values
+
+def Decode_String(buf, span):
+    """
+    RETURNS:
+      string (unicode): The UTF-8 string at 'span' (start, end).
+    """
+
+    return buf[span[0]:span[1]].decode('utf-8')
+
+def Zigzag(n):
+    """
+    RETURNS:
+      The signed value of a zigzag encoded (sint32 / sint64) varint.
+    """
+
+    return (n >> 1) ^ -(n & 1)
@@ -0,0 +1,553 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Parcel_Store.py
+# Purpose:
+"""
+Functions to write and read a packed, memory-mapped copy of the parcels
+(the 'parcel store'), so the spatial work in 'DA_Process_Fire_Data.py' can
+start without reading every parcel from a FC.
+
+The store is written once every time the local copy of PARCELS_ALL is
+refreshed (see Refresh_Parcel_Cache() in 'DA_Process_Fire_Data.py').  It is
+a folder of NumPy arrays (.npy files) that are loaded memory-mapped
+(np.load(mmap_mode='r')): loading the store only reads Store.json, the pages
+of the arrays are read when they are used, and every process that uses the
+store shares the same pages through the OS file cache.
+
+A parcel store is a folder:
+    Store.json          = The number of parcels, the spatial reference and
+                          its XY tolerance, the string fields, the FC the
+                          store was made from and its generation.
+    strings.npy         = The string table, uint8 UTF-8 bytes of every value
+                          of every string field (i.e. APN), each in it once.
+    string_offsets.npy  = int64 offsets of the strings into strings.npy.
+    oids.npy            = int64 OBJECTID of each parcel in the FC.
+    x.npy, y.npy        = float64 vertices of all the rings (each ring is
+                          closed).
+    ring_offsets.npy    = int64 offsets of the rings into the vertices.
+    parcel_offsets.npy  = int64 offsets of the parcels into the rings (the
+                          parts and holes of a parcel are its rings).
+    bboxes.npy          = float64 (number of parcels, 4) xmin, ymin, xmax,
+                          ymax of each parcel.
+    field_<field>.npy   = int32 index into the string table of the value of
+                          each parcel (-1 if NULL).
+    grid_*.npy, large_parcels.npy = The grid of the Parcel_Index of the
+                          parcels (see DA_Spatial_Join.py), so the index is
+                          not built again.
+
+The store is written to a temp folder and renamed (see
+DA_File_Utils.Replace_Folder()), so a reader never finds a half written
+store, and the old store is only deleted once the new one is in place.
+
+Join_Points_Parallel() joins points to the parcels of a store with a pool of
+processes.  The points are split by spatial tile, and every worker loads the
+store itself (memory-mapped), so the parcels are never pickled to the
+workers: they all read the same pages of the store from the OS file cache,
+and only the points and the rows are sent between the processes.  On
+Windows every process of a pool imports the main script again, so the pool
+is started as if this file were the main script (see Start_Join_Pool()):
+the workers never import arcpy.
+
+Join_Points_Incremental() keeps the parcels each DA Report was joined to
+(its 'assignment') from one run to the next, keyed by ReportNumber and a
+hash of the point (see DA_Fingerprints.Get_Geometry_Fingerprint()), and
+only joins the reports again that are new, moved, or may be on a parcel that
+changed:
+    1) The OBJECTIDs of the parcels of the store are only the same parcels
+       as the last run if the store has the same 'generation' (the FC was
+       not made again), otherwise every report is joined again.
+    2) A parcel that is edited in the FC is deleted and added again, so a
+       report on a parcel whose OBJECTID is no longer in the store, or in the
+       bounding box of a parcel with an OBJECTID higher than the highest one
+       of the last run, is joined again.
+
+Use:
+    import DA_Parcel_Store
+    store = DA_Parcel_Store.Load_Parcel_Store(store_folder)
+    index = store.Get_Index()                  # DA_Spatial_Join.Parcel_Index
+    parcels = index.Query(x, y, tolerance)     # positions of the parcels
+    apns = [store.Get_Value('APN', parcel) for parcel in parcels]
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import json, math, multiprocessing, os, shutil, sys
+
+import numpy as np
+
+import DA_AGOL_Download
+import DA_File_Utils
+import DA_Fingerprints
+import DA_Spatial_Join
+
+# The arrays of the geometry of the parcels
+GEOMETRY_ARRAYS = ['oids', 'x', 'y', 'ring_offsets', 'parcel_offsets', 'bboxes']
+
+# Join_Points_Parallel() starts no more processes than there are this many
+#  points for each (starting a process costs more than joining fewer points)
+MIN_POINTS_PER_PROCESS = 5000
+
+# The points are split into tiles of this many grid cells of the index on a
+#  side, and each process is given about this many groups of tiles to join
+TILE_CELLS        = 16
+TASKS_PER_PROCESS = 4
+
+# The index and tolerance of a join worker process (see Init_Join_Worker())
+worker_index     = None
+worker_tolerance = 0.0
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                            CLASS Parcel_Store()
+class Parcel_Store(object):
+    """
+    A parcel store loaded by Load_Parcel_Store().  The arrays are
+    memory-mapped.
+    """
+
+    def __init__(self, store_folder, info):
+        self.store_folder      = store_folder
+        self.num_parcels       = info['num_parcels']
+        self.spatial_reference = info.get('spatial_reference')
+        self.xy_tolerance      = info.get('xy_tolerance') or 0.0
+        self.source            = info.get('source')
+        self.generation        = info.get('generation')
+        self.string_fields     = info['string_fields']
+        self.grid_info         = info['grid']
+        self.index             = None
+
+        self.strings        = self.Load_Array('strings')
+        self.string_offsets = self.Load_Array('string_offsets')
+
+        for name in GEOMETRY_ARRAYS:
+            setattr(self, name, self.Load_Array(name))
+
+        self.string_columns = dict((field, self.Load_Array(Get_Field_File_Name(field)))
+                                   for field in self.string_fields)
+
+    #---------------------------------------------------------------------------
+    def Get_Index(self):
+        """
+        RETURNS:
+          index (DA_Spatial_Join.Parcel_Index): The index of the parcels, made
+            from the memory-mapped arrays and the saved grid (nothing is
+            built).  The keys of the index are the OBJECTIDs of the parcels.
+        """
+
+        if self.index == None:
+            grid = dict(self.grid_info)
+            for name in DA_Spatial_Join.Parcel_Index.GRID_ARRAYS:
+                grid[name] = self.Load_Array(name)
+
+            self.index = DA_Spatial_Join.Parcel_Index(self.oids, self.x, self.y, self.ring_offsets,
+                                                      self.parcel_offsets, self.bboxes, grid=grid)
+        return self.index
+
+    #---------------------------------------------------------------------------
+    def Get_Value(self, field, parcel):
+        """
+        RETURNS:
+          value (str): The value of a string field of a parcel (a position,
+            not an OBJECTID), or None if it is NULL.
+        """
+
+        code = int(self.string_columns[field][parcel])
+        if code < 0:
+            return None
+        return self.strings[self.string_offsets[code]:self.string_offsets[code + 1]].tostring().decode('utf-8')
+
+    #---------------------------------------------------------------------------
+    def Load_Array(self, name):
+        return np.load(os.path.join(self.store_folder, name + '.npy'), mmap_mode='r')
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Get_Parcel_Store_Folder()
+def Get_Parcel_Store_Folder(FGDB_path):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the parcels the store is
+        made from.
+
+    RETURNS:
+      store_folder (str): Full path to the folder of the parcel store, i.e.
+        'DA_Parcel_Cache.gdb' has its store in 'DA_Parcel_Cache_Store' in the
+        same folder.
+    """
+
+    return os.path.splitext(FGDB_path.rstrip('\\/'))[0] + '_Store'
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Write_Parcel_Store()
+def Write_Parcel_Store(store_folder, parcels, string_fields, spatial_reference=None, xy_tolerance=0.0, source=None,
+                       generation=None):
+    """
+    PARAMETERS:
+      store_folder (str): Full path to the folder to write the store to.
+        Anything already there is replaced.
+      parcels (iterable): (OBJECTID, rings, values) for each parcel.  'rings'
+        is a list of rings (see DA_Spatial_Join.Pack_Parcels()) and 'values'
+        is a list of the values of the 'string_fields'.
+      string_fields (list of str): The string fields saved, i.e. ['APN',
+        'APN_8'].
+      spatial_reference {str}: The spatial reference of the parcels (i.e.
+        from exportToString()). OPTIONAL.
+      xy_tolerance {float}: The XY tolerance of the parcels. OPTIONAL.
+      source {str}: The FC the parcels are from. OPTIONAL.
+      generation {str}: Changes every time the FC is made again, so two
+        stores with the same generation have the same OBJECTIDs for the same
+        parcels (i.e. the time of the last full refresh of the parcel cache).
+        OPTIONAL.
+
+    RETURNS:
+      num_parcels (int): The number of parcels written.
+    """
+
+    strings = []
+    string_codes = {}
+    codes = [[] for field in string_fields]
+
+    def Get_Parcels():
+        for oid, rings, values in parcels:
+            for field_num, value in enumerate(values):
+                if value == None:
+                    codes[field_num].append(-1)
+                    continue
+                code = string_codes.get(value)
+                if code == None:
+                    code = string_codes[value] = len(strings)
+                    strings.append(value)
+                codes[field_num].append(code)
+            yield oid, rings
+
+    oids, x, y, ring_offsets, parcel_offsets = DA_Spatial_Join.Pack_Parcels(Get_Parcels())
+    index = DA_Spatial_Join.Parcel_Index(np.array(oids, dtype='<i8'), x, y, ring_offsets, parcel_offsets)
+
+    temp_folder = store_folder + '.tmp'
+    if os.path.exists(temp_folder):
+        shutil.rmtree(temp_folder)
+    os.makedirs(temp_folder)
+
+    arrays = {'oids'           : index.keys,
+              'x'              : index.x,
+              'y'              : index.y,
+              'ring_offsets'   : index.ring_offsets,
+              'parcel_offsets' : index.parcel_offsets,
+              'bboxes'         : index.bboxes}
+
+    grid = index.Get_Grid()
+    for name in DA_Spatial_Join.Parcel_Index.GRID_ARRAYS:
+        arrays[name] = grid.pop(name)
+
+    for field, field_codes in zip(string_fields, codes):
+        arrays[Get_Field_File_Name(field)] = np.array(field_codes, dtype='<i4')
+
+    encoded = [string.encode('utf-8') if isinstance(string, unicode) else str(string) for string in strings]
+    arrays['strings'] = np.frombuffer(''.join(encoded), dtype='u1')
+    arrays['string_offsets'] = np.concatenate([[0], np.cumsum([len(string) for string in encoded])]).astype('<i8')
+
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_folder, name + '.npy'), array)
+
+    with open(os.path.join(temp_folder, 'Store.json'), 'w') as json_file:
+        json.dump({'num_parcels'       : index.num_parcels,
+                   'spatial_reference' : spatial_reference,
+                   'xy_tolerance'      : xy_tolerance,
+                   'source'            : source,
+                   'generation'        : generation,
+                   'string_fields'     : string_fields,
+                   'grid'              : grid}, json_file, indent=2)
+
+    DA_File_Utils.Replace_Folder(temp_folder, store_folder)
+
+    return index.num_parcels
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Load_Parcel_Store()
+def Load_Parcel_Store(store_folder):
+    """
+    PARAMETERS:
+      store_folder (str): Full path to the folder of a parcel store.
+
+    RETURNS:
+      store (Parcel_Store): The store, or None if there is no store in the
+        folder.  Only Store.json is read here, the arrays are memory-mapped.
+    """
+
+    if not os.path.exists(os.path.join(store_folder, 'Store.json')):
+        return None
+
+    with open(os.path.join(store_folder, 'Store.json')) as json_file:
+        info = json.load(json_file)
+
+    return Parcel_Store(store_folder, info)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Get_Field_File_Name()
+def Get_Field_File_Name(field):
+    """
+    RETURNS:
+      name (str): The name of the .npy file (without .npy) of a string field.
+    """
+
+    return 'field_' + ''.join(char if char.isalnum() or char == '_' else '_' for char in field)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Join_Points_Parallel()
+def Join_Points_Parallel(store_folder, points, tolerance=0.0, processes=None):
+    """
+    PARAMETERS:
+      store_folder (str): Full path to the folder of a parcel store.
+      points (list): (key, x, y) for each point, in the spatial reference of
+        the store (see DA_Spatial_Join.Join_Points()).
+      tolerance {float}: See DA_Spatial_Join.Join_Points(). OPTIONAL.
+      processes {int}: The most processes to join with. OPTIONAL.  Defaults
+        to the number of cores.
+
+    RETURNS:
+      rows (list of tuple): The same rows, in the same order, as
+        DA_Spatial_Join.Join_Points() with the index of the store.
+
+    FUNCTION:
+      To join the points to the parcels of the store with a pool of processes
+      (see the top of this file).  The points are sorted into tiles, the
+      tiles are grouped into about TASKS_PER_PROCESS tasks for each process,
+      and the rows of the tasks are put back in the order of the points.  If
+      there are too few points for more than one process, the points are
+      joined in this process.
+    """
+
+    if processes == None or processes < 1:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(points) // MIN_POINTS_PER_PROCESS)
+
+    if processes <= 1:
+        store = Load_Parcel_Store(store_folder)
+        return DA_Spatial_Join.Join_Points(points, store.Get_Index(), tolerance)
+
+    # Sort the points into tiles (the points with no geometry are a tile)
+    store = Load_Parcel_Store(store_folder)
+    tile_size = store.grid_info['cell_size'] * TILE_CELLS
+    tiles = {}
+    for position, (key, x, y) in enumerate(points):
+        tile = None
+        if x != None and y != None:
+            tile = (int(math.floor(y / tile_size)), int(math.floor(x / tile_size)))
+        tiles.setdefault(tile, []).append((position, x, y))
+
+    # Group the tiles into tasks of about the same number of points
+    task_size = max(1, len(points) // (processes * TASKS_PER_PROCESS))
+    tasks = [[]]
+    for tile in sorted(tiles, key=lambda tile: (tile == None, tile)):
+        if len(tasks[-1]) >= task_size:
+            tasks.append([])
+        tasks[-1].extend(tiles[tile])
+
+    pool = Start_Join_Pool(processes, store_folder, tolerance)
+    try:
+        task_results = pool.map(Join_Points_Worker, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Put the rows back in the order of the points
+    point_parcels = [None] * len(points)
+    for task_result in task_results:
+        for position, parcel_keys in task_result:
+            point_parcels[position] = parcel_keys
+
+    rows = []
+    for (key, x, y), parcel_keys in zip(points, point_parcels):
+        if parcel_keys:
+            rows.extend((key, parcel_key) for parcel_key in parcel_keys)
+        else:
+            rows.append((key, None))
+
+    return rows
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Start_Join_Pool()
+def Start_Join_Pool(processes, store_folder, tolerance):
+    """
+    RETURNS:
+      pool (multiprocessing.Pool): 'processes' worker processes, each with
+        the store loaded (see Init_Join_Worker()).
+
+    FUNCTION:
+      To start the pool without running the main script in every worker.
+      On Windows a new process imports the file of the main module again (as
+      '__parents_main__') before it can run a worker, and the DA scripts
+      import arcpy, which takes seconds and may check out a license in every
+      process.  The processes are started while the main module points to
+      this file, which doesn't import arcpy, and the workers only need the
+      functions of this file.  On other systems the processes are forked, and
+      this changes nothing.
+    """
+
+    main_module = sys.modules['__main__']
+    main_file = getattr(main_module, '__file__', None)
+    main_module.__file__ = os.path.abspath(__file__)
+    try:
+        return multiprocessing.Pool(processes, Init_Join_Worker, (store_folder, tolerance))
+    finally:
+        if main_file == None:
+            del main_module.__file__
+        else:
+            main_module.__file__ = main_file
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Init_Join_Worker()
+def Init_Join_Worker(store_folder, tolerance):
+    """
+    FUNCTION:
+      To load the store (memory-mapped) once in each worker process of
+      Join_Points_Parallel().
+    """
+
+    global worker_index, worker_tolerance
+
+    worker_index     = Load_Parcel_Store(store_folder).Get_Index()
+    worker_tolerance = tolerance
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Join_Points_Worker()
+def Join_Points_Worker(task):
+    """
+    PARAMETERS:
+      task (list): (position, x, y) of the points of a task.
+
+    RETURNS:
+      task_result (list): (position, [parcel keys]) for each point.
+    """
+
+    return [(position, [worker_index.Get_Key(parcel) for parcel in worker_index.Query(x, y, worker_tolerance)])
+            for position, x, y in task]
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                      FUNCTION Join_Points_Incremental()
+def Join_Points_Incremental(store, points, report_numbers, last_assignments=None, tolerance=0.0, processes=None):
+    """
+    PARAMETERS:
+      store (Parcel_Store): The parcel store.
+      points (list): (key, x, y) for each point, in the spatial reference of
+        the store (see DA_Spatial_Join.Join_Points()).
+      report_numbers (list): The ReportNumber of each point (None if it has
+        none, it is then always joined).
+      last_assignments {dict}: From Load_Assignments(). OPTIONAL.  Every
+        point is joined if not given.
+      tolerance {float}: See DA_Spatial_Join.Join_Points(). OPTIONAL.
+      processes {int}: See Join_Points_Parallel(). OPTIONAL.
+
+    RETURNS:
+      rows (list of tuple): The same rows as DA_Spatial_Join.Join_Points().
+      assignments (dict): The assignments of this join, to save with
+        Save_Assignments() and give to the next join.
+      counts (dict): The number of points 'joined' and 'reused'.
+
+    FUNCTION:
+      To join only the points whose assignment can't be reused (see the top
+      of this file) and reuse the assignment of the others.
+    """
+
+    max_oid = int(store.oids.max()) if store.num_parcels else 0
+
+    # The points in the store's coordinates, hashed like the fingerprints
+    point_hashes = [DA_Fingerprints.Get_Geometry_Fingerprint({'x': x, 'y': y}) if x != None and y != None else None
+                    for key, x, y in points]
+
+    # Get the assignment of the last run of each point, if it can be reused
+    cached = [None] * len(points)
+    if (last_assignments != None and store.generation != None and
+            last_assignments.get('generation') == store.generation):
+        last_reports = last_assignments.get('assignments', {})
+        for point_num, (report_number, point_hash) in enumerate(zip(report_numbers, point_hashes)):
+            if report_number != None and point_hash != None:
+                cached[point_num] = last_reports.get(unicode(report_number), {}).get(point_hash)
+
+        # Not if one of its parcels was deleted (or edited)
+        sorted_oids = np.sort(store.oids)
+        for point_num, parcel_keys in enumerate(cached):
+            if parcel_keys:
+                positions = np.minimum(np.searchsorted(sorted_oids, parcel_keys), len(sorted_oids) - 1)
+                if len(sorted_oids) == 0 or (sorted_oids[positions] != parcel_keys).any():
+                    cached[point_num] = None
+
+        # Not if it may be on a parcel added (or edited) since
+        new_parcels = np.nonzero(np.asarray(store.oids) > last_assignments.get('max_oid', max_oid))[0]
+        cached_nums = np.array([point_num for point_num, parcel_keys in enumerate(cached) if parcel_keys != None], dtype=int)
+        if len(new_parcels) and len(cached_nums):
+            x = np.array([points[point_num][1] for point_num in cached_nums], dtype=float)
+            y = np.array([points[point_num][2] for point_num in cached_nums], dtype=float)
+            near_new_parcel = np.zeros(len(cached_nums), dtype=bool)
+            for xmin, ymin, xmax, ymax in store.bboxes[new_parcels]:
+                near_new_parcel |= ((x >= xmin - tolerance) & (x <= xmax + tolerance) &
+                                    (y >= ymin - tolerance) & (y <= ymax + tolerance))
+            for point_num in cached_nums[near_new_parcel]:
+                cached[point_num] = None
+
+    # Join the others
+    join_nums = [point_num for point_num, parcel_keys in enumerate(cached) if parcel_keys == None]
+    join_points = [(point_num, points[point_num][1], points[point_num][2]) for point_num in join_nums]
+    joined = {}
+    for point_num, parcel_key in Join_Points_Parallel(store.store_folder, join_points, tolerance, processes):
+        joined.setdefault(point_num, [])
+        if parcel_key != None:
+            joined[point_num].append(parcel_key)
+    for point_num in join_nums:
+        cached[point_num] = joined[point_num]
+
+    # The rows and the assignments
+    rows = []
+    assignments = {}
+    for (key, x, y), report_number, point_hash, parcel_keys in zip(points, report_numbers, point_hashes, cached):
+        if parcel_keys:
+            rows.extend((key, parcel_key) for parcel_key in parcel_keys)
+        else:
+            rows.append((key, None))
+        if report_number != None and point_hash != None:
+            assignments.setdefault(unicode(report_number), {})[point_hash] = parcel_keys
+
+    assignments = {'generation'  : store.generation,
+                   'max_oid'     : max_oid,
+                   'assignments' : assignments}
+
+    return rows, assignments, {'joined': len(join_nums), 'reused': len(points) - len(join_nums)}
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Load_Assignments()
+def Load_Assignments(assignments_file):
+    """
+    RETURNS:
+      assignments (dict): The assignments saved by Save_Assignments(), or
+        None if none were saved.
+    """
+
+    try:
+        with open(assignments_file) as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Save_Assignments()
+def Save_Assignments(assignments_file, assignments):
+    """
+    PARAMETERS:
+      assignments_file (str): Full path to the .json file to save to.
+      assignments (dict): From Join_Points_Incremental().
+
+    RETURNS:
+      None
+    """
+
+    DA_AGOL_Download.Write_JSON_File(assignments_file, assignments)
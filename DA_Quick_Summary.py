@@ -0,0 +1,399 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Quick_Summary.py
+# Purpose:
+"""
+To write a small summary table of the DA Reports within seconds, straight from
+the AGOL Feature Service, so there are near real time totals between the full
+runs of the download / process / publish scripts.
+
+The server does all the counting and adding (statistics queries with
+'outStatistics' and 'groupByFieldsForStatistics'), so no features are
+downloaded and arcpy is not needed.  The summary has one row for all the
+reports, and one row for each value of:
+    DamagedOrDestroyed
+    StructureType
+    IncidentName
+
+Each row has the number of reports, the number of structures (the sum of
+[Quantity], with a NULL Quantity counted as 1, like Update_AGOL_Fields()
+does), the total [EstimatedReplacementCost] and the number of reports with no
+EstimatedReplacementCost yet.
+
+NOTE: [DamagedOrDestroyed] is calculated by 'DA_Process_Fire_Data.py', so it
+is usually not a field of the AGOL layer.  If it isn't, the rows for it are
+counted with the where clauses that 'FieldsToCalculate.csv' uses to calculate
+it (i.e. "ExtentOfDamage = '5) >75%'" is 'Destroyed').
+
+NOTE: The EstimatedReplacementCost of a report is only in AGOL once
+'DA_Process_Fire_Data.py' has calculated it (see Update_AGOL_Fields()), so
+the total cost only includes the reports processed by the last full run.
+
+The summary is written to:
+    <Share_Folder>\Quick_Summary\DA_Quick_Summary.csv
+
+This script doesn't write a log file or send an email, it is meant to be run
+every few minutes.  It uses these variables from the cfgFile:
+    [AGOL]
+    usr, pwd
+
+    [Download_Info]
+    FS_name, FS_index, FS_url (OPTIONAL)
+
+    [Paths]
+    Root_Folder, Share_Folder
+"""
+#-------------------------------------------------------------------------------
+
+import ConfigParser, csv, datetime, json, os, sys, time
+from multiprocessing.pool import ThreadPool
+
+import DA_AGOL_Download
+import DA_AGOL_Token
+import DA_File_Utils
+import DA_HTTP_Cache
+
+# The fields the summary is grouped by
+GROUP_FIELDS = ['DamagedOrDestroyed', 'StructureType', 'IncidentName']
+
+def main():
+
+    #---------------------------------------------------------------------------
+    #                     Set Variables that will change
+
+    # Name of this script
+    name_of_script = 'DA_Quick_Summary.py'
+
+    # Flag to control if there is an error
+    success = True
+
+    #---------------------------------------------------------------------------
+    #                   Use cfgFile to set the below variables
+    cfgFile     = r"P:\Damage_Assessment_GIS\Fire_Damage_Assessment\PROD\Scripts\Config_Files\DA_Main_Config_File.ini"
+    if not os.path.exists(cfgFile):  # Try another path for the ini file
+        cfgFile = r"C:\Users\mgrue\Desktop\DA_Main_Config_File.ini"
+
+    if os.path.isfile(cfgFile):
+        print 'Using INI file found at: {}'.format(cfgFile)
+        config = ConfigParser.ConfigParser()
+        config.read(cfgFile)
+    else:
+        print("*** ERROR! cannot find valid INI file ***\nMake sure a valid INI file exists at:\n\n{}\n".format(cfgFile))
+        sys.exit()
+
+    FS_name        = config.get('Download_Info', 'FS_name')
+    index_of_layer = config.get('Download_Info', 'FS_index')
+    root_folder    = config.get('Paths',         'Root_Folder')
+    share_folder   = config.get('Paths',         'Share_Folder')
+
+    FS_url = ''
+    if config.has_option('Download_Info', 'FS_url'):
+        FS_url = config.get('Download_Info', 'FS_url')
+    if FS_url == '':
+        FS_url  = r'https://services1.arcgis.com/1vIhDJwtG5eNmiqX/arcgis/rest/services/{}/FeatureServer'.format(FS_name)
+
+    # The Control CSV with the where clauses that calculate DamagedOrDestroyed
+    calc_fields_csv = '{}\Scripts\Source_Code\Control_Files\FieldsToCalculate.csv'.format(root_folder)
+
+    # Where to write the summary
+    summary_folder = '{}\Quick_Summary'.format(share_folder)
+    summary_csv    = '{}\DA_Quick_Summary.csv'.format(summary_folder)
+
+    #---------------------------------------------------------------------------
+    #                          Start Calling Functions
+    start_time = time.time()
+
+    if not os.path.exists(summary_folder):
+        print 'NOTICE, Quick Summary folder does not exist, creating it now\n'
+        os.makedirs(summary_folder)
+
+    # Record or replay the responses from AGOL (see DA_HTTP_Cache.py)
+    if success == True:
+        try:
+            DA_HTTP_Cache.Configure_From_Config(cfgFile)
+        except Exception as e:
+            success = False
+            print '*** ERROR with DA_HTTP_Cache.Configure_From_Config() ***'
+            print str(e)
+
+    # Get a token with permissions to view the data
+    if success == True:
+        try:
+            token = DA_AGOL_Token.Get_Token_Provider(cfgFile)
+        except Exception as e:
+            success = False
+            print '*** ERROR getting a token ***'
+            print str(e)
+
+    # Get the summary
+    if success == True:
+        try:
+            rows = Get_Quick_Summary(FS_url, index_of_layer, token, calc_fields_csv)
+        except Exception as e:
+            success = False
+            print '*** ERROR with Get_Quick_Summary() ***'
+            print str(e)
+
+    # Write the summary
+    if success == True:
+        try:
+            Write_Summary_CSV(summary_csv, rows)
+        except Exception as e:
+            success = False
+            print '*** ERROR with Write_Summary_CSV() ***'
+            print str(e)
+
+    # End of script reporting
+    if success == True:
+        print '\nSUCCESSFULLY ran {} in {:.1f} seconds'.format(name_of_script, time.time() - start_time)
+        print 'Please find the summary at:\n  {}\n'.format(summary_csv)
+    else:
+        print '\n*** ERROR with {} ***\n'.format(name_of_script)
+
+#-------------------------------------------------------------------------------
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#-------------------------------------------------------------------------------
+#                              Define Functions
+#-------------------------------------------------------------------------------
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Get_Quick_Summary()
+def Get_Quick_Summary(FS_url, index_of_layer, token, calc_fields_csv=None):
+    """
+    PARAMETERS:
+      FS_url (str): The URL of the Feature Service (up to '/FeatureServer').
+      index_of_layer (int): The index of the layer in the Feature Service.
+      token (str): The token obtained by DA_AGOL_Token.Get_Token_Provider().
+      calc_fields_csv {str}: Full path to 'FieldsToCalculate.csv'.  OPTIONAL.
+        Used to count DamagedOrDestroyed if it isn't a field of the layer.
+
+    RETURNS:
+      rows (list of dict): One dict per row of the summary.  Keys:
+        Group_By, Group_Value, Num_Reports, Num_Structures,
+        Estimated_Replacement_Cost, Num_Reports_Without_Cost
+
+    FUNCTION:
+      To have the server count and add up the reports for all the reports
+      and for each value of the GROUP_FIELDS.  The statistics queries are
+      sent at the same time.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Get_Quick_Summary()'
+
+    query_url = '{}/{}/query'.format(FS_url, index_of_layer)
+
+    layer_info = DA_AGOL_Download.Get_Layer_Info(FS_url, index_of_layer, token)
+    layer_field_names = [field['name'] for field in layer_info.get('fields') or []]
+    oid_field = layer_info.get('objectIdField', 'OBJECTID')
+
+    # Each query: (Group_By, Group_Value, group_field, where_clause)
+    #  Group_Value is None if the query is grouped by 'group_field'
+    queries = [('All', 'All', None, '1=1')]
+
+    for group_field in GROUP_FIELDS:
+        if group_field in layer_field_names:
+            queries.append((group_field, None, group_field, '1=1'))
+
+        elif calc_fields_csv != None and os.path.exists(calc_fields_csv):
+            calc_groups = Get_Calculated_Groups(calc_fields_csv, group_field)
+            for group_value, where_clause in calc_groups:
+                queries.append((group_field, group_value, None, where_clause))
+            if len(calc_groups) == 0:
+                print '  * WARNING, [{}] is not a field of the layer or calculated in the Control CSV'.format(group_field)
+
+        else:
+            print '  * WARNING, [{}] is not a field of the layer'.format(group_field)
+
+    def Run_Query(query):
+        group_by, group_value, group_field, where_clause = query
+        return query, Get_Group_Statistics(query_url, token, oid_field, layer_field_names, group_field, where_clause)
+
+    pool = ThreadPool(4)
+    try:
+        results = pool.map(Run_Query, queries)
+    finally:
+        pool.close()
+        pool.join()
+
+    rows = []
+    for query, groups in results:
+        group_by, group_value, group_field, where_clause = query
+        for group in groups:
+            row = {'Group_By'    : group_by,
+                   'Group_Value' : group_value if group_value != None else group['value']}
+            row.update(group['stats'])
+            rows.append(row)
+
+    print '\n  {:<20}{:<30}{:>10}{:>12}{:>18}'.format('Group_By', 'Group_Value', 'Reports', 'Structures', 'Replacement_Cost')
+    for row in rows:
+        print '  {:<20}{:<30}{:>10}{:>12}{:>18}'.format(row['Group_By'], str(row['Group_Value'])[:29], row['Num_Reports'],
+                                                      row['Num_Structures'], row['Estimated_Replacement_Cost'])
+
+    print 'Finished Get_Quick_Summary()\n'
+
+    return rows
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Get_Group_Statistics()
+def Get_Group_Statistics(query_url, token, oid_field, layer_field_names, group_field=None, where_clause='1=1'):
+    """
+    PARAMETERS:
+      query_url (str): The '/query' URL of the layer.
+      token (str): The token obtained by DA_AGOL_Token.Get_Token_Provider().
+      oid_field (str): The OBJECTID field of the layer.
+      layer_field_names (list of str): The fields of the layer.  Statistics
+        of [Quantity] and [EstimatedReplacementCost] are only asked for if
+        they are fields of the layer.
+      group_field {str}: The field to group the statistics by. OPTIONAL.
+        If not given there is one group.
+      where_clause {str}: Only count the features that satisfy this where
+        clause. OPTIONAL.
+
+    RETURNS:
+      groups (list of dict): {'value': <group_field value>, 'stats': {...}}
+        for each group, sorted by the value.  'stats' has the keys
+        Num_Reports, Num_Structures, Estimated_Replacement_Cost and
+        Num_Reports_Without_Cost.
+
+    FUNCTION:
+      To have the server count and add up the reports in one statistics
+      query.
+    """
+
+    out_statistics = [('count', oid_field, 'num_reports')]
+    if 'Quantity' in layer_field_names:
+        out_statistics += [('sum',   'Quantity', 'sum_quantity'),
+                           ('count', 'Quantity', 'num_quantity')]
+    if 'EstimatedReplacementCost' in layer_field_names:
+        out_statistics += [('sum',   'EstimatedReplacementCost', 'sum_cost'),
+                           ('count', 'EstimatedReplacementCost', 'num_cost')]
+
+    params = {'where'         : where_clause,
+              'outStatistics' : json.dumps([{'statisticType'         : statistic_type,
+                                             'onStatisticField'      : field_name,
+                                             'outStatisticFieldName' : out_name}
+                                            for statistic_type, field_name, out_name in out_statistics]),
+              'f'             : 'json',
+              'token'         : token}
+    if group_field != None:
+        params['groupByFieldsForStatistics'] = group_field
+
+    response_json = DA_AGOL_Download.Get_JSON(query_url, params)[0]
+
+    groups = []
+    for feature in response_json.get('features') or []:
+        # Some servers change the case of the out field names
+        attributes = dict((key.lower(), value) for key, value in feature['attributes'].iteritems())
+
+        num_reports  = attributes.get('num_reports') or 0
+        num_quantity = attributes.get('num_quantity') or 0
+        num_cost     = attributes.get('num_cost') or 0
+
+        stats = {'Num_Reports'                : num_reports,
+                 # A NULL Quantity is 1 structure
+                 'Num_Structures'             : (attributes.get('sum_quantity') or 0) + (num_reports - num_quantity),
+                 'Estimated_Replacement_Cost' : attributes.get('sum_cost') or 0,
+                 'Num_Reports_Without_Cost'   : num_reports - num_cost}
+
+        value = None
+        if group_field != None:
+            value = attributes.get(group_field.lower())
+
+        groups.append({'value': value, 'stats': stats})
+
+    # A query with no features matching still has a row of zeros
+    if len(groups) == 0 and group_field == None:
+        groups.append({'value': None, 'stats': {'Num_Reports'                : 0,
+                                                'Num_Structures'             : 0,
+                                                'Estimated_Replacement_Cost' : 0,
+                                                'Num_Reports_Without_Cost'   : 0}})
+
+    groups.sort(key=lambda group: (group['value'] == None, group['value']))
+
+    return groups
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Get_Calculated_Groups()
+def Get_Calculated_Groups(calc_fields_csv, calc_field):
+    """
+    PARAMETERS:
+      calc_fields_csv (str): Full path to 'FieldsToCalculate.csv'.
+      calc_field (str): The field calculated in the CSV, i.e.
+        'DamagedOrDestroyed'.
+
+    RETURNS:
+      calc_groups (list of tuple): (value, where_clause) for every row of the
+        CSV that calculates 'calc_field' to a STRING, i.e.
+        [('Damaged', "ExtentOfDamage <> '5) >75%'"), ...]
+
+    FUNCTION:
+      To count a field that is calculated by 'DA_Process_Fire_Data.py' (and
+      so isn't in AGOL yet) with the same where clauses that calculate it.
+      Like Fields_Calculate_Fields(), the first two rows are ignored and a
+      calculation that starts or ends with '!' is a FIELD, not a STRING, so
+      it is skipped.
+    """
+
+    calc_groups = []
+
+    with open(calc_fields_csv) as csv_file:
+        readCSV = csv.reader(csv_file, delimiter = ',')
+
+        for row_num, row in enumerate(readCSV):
+            if row_num < 2 or len(row) < 5:
+                continue
+
+            where_clause, field, calc = row[0], row[2], row[4]
+            if field == calc_field and not (calc.startswith('!') or calc.endswith('!')):
+                calc_groups.append((calc, where_clause))
+
+    return calc_groups
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Write_Summary_CSV()
+def Write_Summary_CSV(summary_csv, rows):
+    """
+    PARAMETERS:
+      summary_csv (str): Full path to the CSV to write.
+      rows (list of dict): From Get_Quick_Summary().
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To write the summary, with the date and time it was made, to a CSV.
+      The CSV is written to a temp file first and then renamed, so a
+      dashboard or Excel reading it never sees a half written file.
+    """
+    print '--------------------------------------------------------------------'
+    print 'Starting Write_Summary_CSV()'
+
+    as_of = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    columns = ['As_Of', 'Group_By', 'Group_Value', 'Num_Reports', 'Num_Structures',
+               'Estimated_Replacement_Cost', 'Num_Reports_Without_Cost']
+
+    temp_csv = summary_csv + '.tmp'
+    with open(temp_csv, 'wb') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        for row in rows:
+            values = [as_of] + [row[column] for column in columns[1:]]
+            writer.writerow([value.encode('utf-8') if isinstance(value, unicode) else value for value in values])
+
+    DA_File_Utils.Replace_File(temp_csv, summary_csv)
+
+    print '  Wrote {} rows to:\n    {}'.format(len(rows), summary_csv)
+    print 'Finished Write_Summary_CSV()\n'
+
+    return
+
+#-------------------------------------------------------------------------------
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#-------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Snapshot_Manifest.py
+# Purpose:
+"""
+Functions used by the DA scripts to keep a small index (a 'manifest') of the
+timestamped snapshots that 'DA_Download_Fire_Data.py' writes to the
+'DA_Fire_From_AGOL.gdb' FGDB.
+
+Every run of the download script adds a new FC named like:
+    DA_Fire_from_AGOL_2018_01_01__10_00_00
+and 'DA_Process_Fire_Data.py' needs the newest one.  Listing every FC in the
+FGDB to find it gets slower as the snapshots pile up over a long incident.
+Instead, the download script adds each snapshot to the manifest as soon as
+it is written, and the other scripts look the snapshot up in the manifest.
+
+The manifest is a .json file next to the FGDB (see Get_Manifest_Path()):
+    {"newest"    : "2018_01_02__10_00_00",
+     "snapshots" : {"2018_01_02__10_00_00": {"name"         : <FC name>,
+                                             "path"         : <full path to the FC>,
+                                             "timestamp"    : "2018_01_02__10_00_00",
+                                             "record_count" : 1234,
+                                             "content_hash" : <sha1 of the features>,
+                                             "added"        : <time.time()>},
+                    ...},
+     "timestamps": ["2018_01_01__10_00_00", "2018_01_02__10_00_00"]}
+
+The newest snapshot, or the snapshot with a given timestamp, is found with a
+dict lookup.  The newest snapshot at or before a given time is found with a
+binary search of the sorted 'timestamps'.
+
+RETENTION:
+  So the FGDB doesn't grow without end, 'DA_Download_Fire_Data.py' deletes
+  the snapshots that aren't needed any more (see Choose_Snapshots_To_Delete()):
+    1) A snapshot with the same content hash as the next newer snapshot is
+       the same data, so it is collapsed into the newer one (the newer entry
+       gets a 'first_seen' timestamp of when the data was first downloaded).
+    2) Of the rest, the newest 'keep_last' snapshots are kept, plus the
+       newest snapshot of each hour for the last 'keep_hourly_hours' hours
+       and the newest snapshot of each day for the last 'keep_daily_days'
+       days.
+  The newest snapshot is never deleted.  Every 'compact_hours' the FGDB is
+  compacted to give back the space of the deleted snapshots (see
+  Is_Compaction_Due()).
+
+The manifest is written to a temp file and renamed (see
+DA_AGOL_Download.Write_JSON_File()), so a script reading it never sees a half
+written manifest.
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import bisect, hashlib, json, os, re, time
+
+import DA_AGOL_Download
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Get_Manifest_Path()
+def Get_Manifest_Path(FGDB_path):
+    """
+    PARAMETERS:
+      FGDB_path (str): Full path to the FGDB with the snapshots.
+
+    RETURNS:
+      manifest_path (str): Full path to the manifest of the FGDB, i.e.
+        'DA_Fire_From_AGOL.gdb' has the manifest 'DA_Fire_From_AGOL_Manifest.json'
+        in the same folder.
+    """
+
+    return os.path.splitext(FGDB_path.rstrip('\\/'))[0] + '_Manifest.json'
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Load_Manifest()
+def Load_Manifest(manifest_path):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+
+    RETURNS:
+      manifest (dict): The manifest.  An empty manifest if the file doesn't
+        exist or can't be read.
+    """
+
+    try:
+        with open(manifest_path) as json_file:
+            manifest = json.load(json_file)
+    except (IOError, ValueError):
+        return {'newest': None, 'snapshots': {}, 'timestamps': [], 'last_compacted': None}
+
+    manifest.setdefault('newest',         None)
+    manifest.setdefault('snapshots',      {})
+    manifest.setdefault('timestamps',     sorted(manifest['snapshots']))
+    manifest.setdefault('last_compacted', None)
+
+    return manifest
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Get_Timestamp_From_Name()
+def Get_Timestamp_From_Name(FC_name):
+    """
+    PARAMETERS:
+      FC_name (str): The name (or full path) of a snapshot FC, i.e.
+        'DA_Fire_from_AGOL_2018_01_01__10_00_00'.
+
+    RETURNS:
+      timestamp (str): The 'YYYY_MM_DD__HH_MM_SS' at the end of the name, or
+        None if the name doesn't end with one.
+    """
+
+    match = re.search(r'(\d{4}_\d{2}_\d{2}__\d{2}_\d{2}_\d{2})$', FC_name)
+    if match:
+        return match.group(1)
+    return None
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Hash_Features()
+def Hash_Features(features, oid_field='OBJECTID'):
+    """
+    PARAMETERS:
+      features (list of dict): The esri JSON features of a snapshot.
+      oid_field {str}: The OBJECTID field of the features. OPTIONAL.
+
+    RETURNS:
+      content_hash (str): A sha1 of the features.  The features are sorted by
+        OBJECTID and the keys of each feature are sorted, so the same data
+        always has the same hash no matter what order it was downloaded in.
+    """
+
+    sha1 = hashlib.sha1()
+
+    def Get_OID(feature):
+        return feature.get('attributes', {}).get(oid_field)
+
+    for feature in sorted(features, key=Get_OID):
+        sha1.update(json.dumps(feature, sort_keys=True, separators=(',', ':')))
+        sha1.update('\n')
+
+    return sha1.hexdigest()
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Add_Snapshot()
+def Add_Snapshot(manifest_path, FC_path, record_count, content_hash, timestamp=None):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+      FC_path (str): Full path to the snapshot FC that was just written.
+      record_count (int): The number of features in the snapshot.
+      content_hash (str): The hash of the features (see Hash_Features()), or
+        None if it isn't known (a snapshot made before the manifest was).
+      timestamp {str}: When the snapshot was downloaded, as
+        'YYYY_MM_DD__HH_MM_SS'. OPTIONAL.  Defaults to the timestamp at the
+        end of the FC name.
+
+    RETURNS:
+      entry (dict): The manifest entry of the snapshot.
+
+    FUNCTION:
+      To add a snapshot to the manifest and make it the newest snapshot if
+      nothing newer is in the manifest.
+    """
+
+    if timestamp == None:
+        timestamp = Get_Timestamp_From_Name(FC_path)
+    if timestamp == None:
+        raise ValueError('"{}" does not end with a YYYY_MM_DD__HH_MM_SS timestamp'.format(FC_path))
+
+    manifest = Load_Manifest(manifest_path)
+
+    entry = {'name'         : os.path.basename(FC_path.replace('\\', '/')),
+             'path'         : FC_path,
+             'timestamp'    : timestamp,
+             'record_count' : record_count,
+             'content_hash' : content_hash,
+             'added'        : time.time()}
+
+    if timestamp not in manifest['snapshots']:
+        bisect.insort(manifest['timestamps'], timestamp)
+    manifest['snapshots'][timestamp] = entry
+    manifest['newest'] = manifest['timestamps'][-1]
+
+    DA_AGOL_Download.Write_JSON_File(manifest_path, manifest)
+
+    return entry
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        FUNCTION Get_Newest_Snapshot()
+def Get_Newest_Snapshot(manifest_path):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+
+    RETURNS:
+      entry (dict): The manifest entry of the newest snapshot, or None if the
+        manifest has no snapshots.
+    """
+
+    manifest = Load_Manifest(manifest_path)
+
+    if manifest['newest'] == None:
+        return None
+    return manifest['snapshots'].get(manifest['newest'])
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                          FUNCTION Get_Snapshot_At()
+def Get_Snapshot_At(manifest_path, timestamp):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+      timestamp (str): A time as 'YYYY_MM_DD__HH_MM_SS'.
+
+    RETURNS:
+      entry (dict): The manifest entry of the newest snapshot downloaded at
+        or before 'timestamp', or None if there isn't one.
+    """
+
+    manifest = Load_Manifest(manifest_path)
+
+    if timestamp in manifest['snapshots']:
+        return manifest['snapshots'][timestamp]
+
+    index = bisect.bisect_right(manifest['timestamps'], timestamp)
+
+    # The next snapshot may have the same data as a collapsed snapshot that
+    #  was downloaded at or before 'timestamp'
+    if index < len(manifest['timestamps']):
+        next_snapshot = manifest['snapshots'][manifest['timestamps'][index]]
+        if next_snapshot.get('first_seen', next_snapshot['timestamp']) <= timestamp:
+            return next_snapshot
+
+    if index == 0:
+        return None
+    return manifest['snapshots'][manifest['timestamps'][index - 1]]
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       FUNCTION Get_Previous_Snapshot()
+def Get_Previous_Snapshot(manifest_path, timestamp):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+      timestamp (str): The timestamp of a snapshot in the manifest.
+
+    RETURNS:
+      entry (dict): The manifest entry of the snapshot before the snapshot at
+        'timestamp', or None if it is the oldest.
+    """
+
+    manifest = Load_Manifest(manifest_path)
+
+    index = bisect.bisect_left(manifest['timestamps'], timestamp)
+    if index == 0:
+        return None
+    return manifest['snapshots'][manifest['timestamps'][index - 1]]
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                    FUNCTION Choose_Snapshots_To_Delete()
+def Choose_Snapshots_To_Delete(manifest, keep_last=10, keep_hourly_hours=24, keep_daily_days=30, now=None):
+    """
+    PARAMETERS:
+      manifest (dict): The manifest (from Load_Manifest()).
+      keep_last {int}: Keep this many of the newest snapshots. OPTIONAL.
+      keep_hourly_hours {int}: Keep the newest snapshot of each hour for this
+        many hours. OPTIONAL.
+      keep_daily_days {int}: Keep the newest snapshot of each day for this
+        many days. OPTIONAL.
+      now {float}: The time (from time.time()) the hours and days are counted
+        back from. OPTIONAL.  Defaults to now.
+
+    RETURNS:
+      to_delete (list of str): The timestamps of the snapshots to delete,
+        oldest first.
+      collapsed (dict): {timestamp: newer timestamp} for each snapshot in
+        'to_delete' that has the same data as a newer snapshot.
+
+    FUNCTION:
+      To apply the retention policy (see RETENTION at the top of this file).
+      Nothing is deleted, the caller deletes the FCs and then calls
+      Remove_Snapshots().
+    """
+
+    if now == None:
+        now = time.time()
+
+    timestamps = manifest['timestamps']
+    snapshots  = manifest['snapshots']
+
+    # 1) Collapse runs of snapshots with the same data into the newest one
+    collapsed = {}
+    for index in range(len(timestamps) - 2, -1, -1):
+        content_hash = snapshots[timestamps[index]].get('content_hash')
+        newer = timestamps[index + 1]
+        if content_hash != None and content_hash == snapshots[newer].get('content_hash'):
+            collapsed[timestamps[index]] = collapsed.get(newer, newer)
+
+    remaining = [timestamp for timestamp in timestamps if timestamp not in collapsed]
+
+    # 2) Keep the newest, the newest of each hour and the newest of each day
+    keep = set(remaining[-max(keep_last, 1):])
+
+    newest_of_hour = {}
+    newest_of_day  = {}
+    for timestamp in remaining:
+        newest_of_hour[timestamp[:14]] = timestamp  # 'YYYY_MM_DD__HH'
+        newest_of_day[timestamp[:10]]  = timestamp  # 'YYYY_MM_DD'
+
+    for timestamp in newest_of_hour.values():
+        if now - Get_Epoch(timestamp) <= keep_hourly_hours * 3600:
+            keep.add(timestamp)
+
+    for timestamp in newest_of_day.values():
+        if now - Get_Epoch(timestamp) <= keep_daily_days * 86400:
+            keep.add(timestamp)
+
+    to_delete = [timestamp for timestamp in timestamps if timestamp not in keep]
+
+    return to_delete, collapsed
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Remove_Snapshots()
+def Remove_Snapshots(manifest_path, to_delete, collapsed=None):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+      to_delete (list of str): The timestamps of the snapshots that were
+        deleted.
+      collapsed {dict}: {timestamp: newer timestamp} for the deleted
+        snapshots that have the same data as a newer snapshot. OPTIONAL.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To take the deleted snapshots out of the manifest.  The newer snapshot
+      that a snapshot was collapsed into gets the oldest 'first_seen' of
+      the snapshots collapsed into it.
+    """
+
+    if collapsed == None:
+        collapsed = {}
+
+    manifest = Load_Manifest(manifest_path)
+    snapshots = manifest['snapshots']
+
+    for timestamp in to_delete:
+        entry = snapshots.pop(timestamp, None)
+        if entry == None:
+            continue
+
+        if timestamp in collapsed and collapsed[timestamp] in snapshots:
+            newer = snapshots[collapsed[timestamp]]
+            first_seen = entry.get('first_seen', timestamp)
+            newer['first_seen'] = min(newer.get('first_seen', newer['timestamp']), first_seen)
+
+    manifest['timestamps'] = sorted(snapshots)
+    manifest['newest'] = manifest['timestamps'][-1] if manifest['timestamps'] else None
+
+    DA_AGOL_Download.Write_JSON_File(manifest_path, manifest)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Is_Compaction_Due()
+def Is_Compaction_Due(manifest_path, compact_hours=24):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+      compact_hours {int}: Compact the FGDB every this many hours. OPTIONAL.
+
+    RETURNS:
+      True if the FGDB hasn't been compacted in the last 'compact_hours'.
+    """
+
+    last_compacted = Load_Manifest(manifest_path)['last_compacted']
+
+    return last_compacted == None or time.time() - last_compacted >= compact_hours * 3600
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                           FUNCTION Set_Compacted()
+def Set_Compacted(manifest_path):
+    """
+    PARAMETERS:
+      manifest_path (str): Full path to the manifest.
+
+    RETURNS:
+      None
+
+    FUNCTION:
+      To save the time the FGDB was compacted.
+    """
+
+    manifest = Load_Manifest(manifest_path)
+    manifest['last_compacted'] = time.time()
+    DA_AGOL_Download.Write_JSON_File(manifest_path, manifest)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                             FUNCTION Get_Epoch()
+def Get_Epoch(timestamp):
+    """
+    PARAMETERS:
+      timestamp (str): A local time as 'YYYY_MM_DD__HH_MM_SS'.
+
+    RETURNS:
+      epoch (float): The time in seconds since 1970.
+    """
+
+    return time.mktime(time.strptime(timestamp, '%Y_%m_%d__%H_%M_%S'))
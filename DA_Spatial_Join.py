@@ -0,0 +1,374 @@
+#-------------------------------------------------------------------------------
+# Name:        DA_Spatial_Join.py
+# Purpose:
+"""
+An in-process point in parcel spatial join, to find the parcels each DA
+Report is on without arcpy.SpatialJoin_analysis().
+
+The join gives the same rows as a JOIN_ONE_TO_MANY, KEEP_ALL, INTERSECT
+spatial join of points to polygons:
+    1) A point is in a parcel if it is inside one of the outer rings of the
+       parcel and not inside one of its holes, or if it is on (within the
+       tolerance of) the boundary of the parcel.
+    2) A point in more than one parcel (i.e. a stacked parcel) gets one row
+       for each parcel.
+    3) A point that isn't in any parcel still gets one row, with no parcel.
+
+The parcels are kept in a Parcel_Index:
+    - The vertices of every (closed) ring are in one x and one y NumPy array,
+      with the offsets of the rings into them and the offsets of the rings of
+      each parcel, so a parcel is a slice of the vertices, and the point in
+      polygon test of a parcel is done on its whole slice at once (even-odd
+      rule, so the holes and the parts of a multipart parcel need no special
+      handling).  These are the arrays DA_Parcel_Store.py saves, so an index
+      can be made from a memory-mapped store without copying them.
+    - A uniform grid over the bounding boxes of the parcels finds the few
+      parcels a point may be in.  A parcel is listed in every grid cell its
+      bounding box touches (a parcel that would touch a huge number of cells
+      is checked by its bounding box instead).  The grid is sorted by cell,
+      so a point finds its cell with one binary search.
+Building the index is NumPy work and a join is a few array operations per
+point, so tens of thousands of points are joined to ~1M parcels in seconds.
+
+Use:
+    import DA_Spatial_Join
+    index = DA_Spatial_Join.Build_Parcel_Index(parcels)   # [(key, rings), ...]
+    rows = DA_Spatial_Join.Join_Points(points, index)     # [(key, x, y), ...]
+    # rows = [(point key, parcel key or None), ...]
+
+This file does NOT import arcpy.
+"""
+#-------------------------------------------------------------------------------
+
+import numpy as np
+
+# A parcel that would be listed in more grid cells than this is checked by
+#  its bounding box instead
+MAX_CELLS_PER_PARCEL = 4096
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                            CLASS Parcel_Index()
+class Parcel_Index(object):
+    """
+    The parcels and the grid index over their bounding boxes (see the top
+    of this file).  Made by Build_Parcel_Index(), or directly from the arrays.
+    """
+
+    # The arrays of the grid (see Get_Grid())
+    GRID_ARRAYS = ['grid_cells', 'grid_parcels', 'large_parcels']
+
+    def __init__(self, keys, x, y, ring_offsets, parcel_offsets, bboxes=None, cell_size=None, grid=None):
+        """
+        PARAMETERS:
+          keys (list or numpy array): The key of each parcel (i.e. its
+            OBJECTID).
+          x, y (numpy arrays): float64 arrays of the vertices of all the
+            rings.  Every ring is closed (its last vertex is its first).
+          ring_offsets (numpy array): (number of rings + 1) int64 array.  The
+            vertices of ring r are x[ring_offsets[r]:ring_offsets[r + 1]].
+          parcel_offsets (numpy array): (number of parcels + 1) int64 array.
+            The rings of parcel i are rings parcel_offsets[i] to
+            parcel_offsets[i + 1] - 1.
+          bboxes {numpy array}: (number of parcels, 4) float64 array of the
+            xmin, ymin, xmax, ymax of each parcel. OPTIONAL.  Worked out from
+            the vertices if not given.
+          cell_size {float}: The size of the grid cells. OPTIONAL.  Defaults to
+            twice the median size of the parcels.
+          grid {dict}: A grid from Get_Grid() to use instead of building it.
+            OPTIONAL.
+        """
+
+        self.keys           = keys
+        self.x              = np.asarray(x, dtype='<f8')
+        self.y              = np.asarray(y, dtype='<f8')
+        self.ring_offsets   = np.asarray(ring_offsets, dtype='<i8')
+        self.parcel_offsets = np.asarray(parcel_offsets, dtype='<i8')
+        self.num_parcels    = len(self.parcel_offsets) - 1
+
+        if bboxes is None:
+            bboxes = Get_Bounding_Boxes(self.x, self.y, self.ring_offsets, self.parcel_offsets)
+        self.bboxes = np.asarray(bboxes, dtype='<f8').reshape(-1, 4)
+
+        if grid != None:
+            for name, value in grid.items():
+                setattr(self, name, value)
+        else:
+            self.Build_Grid(cell_size)
+
+    #---------------------------------------------------------------------------
+    def Get_Grid(self):
+        """
+        RETURNS:
+          grid (dict): The grid of the index: its 'cell_size', 'origin_x',
+            'origin_y' and 'num_columns', and the GRID_ARRAYS, so it can be
+            saved and given to a new index.
+        """
+
+        grid = {'cell_size'   : self.cell_size,
+                'origin_x'    : self.origin_x,
+                'origin_y'    : self.origin_y,
+                'num_columns' : self.num_columns}
+        for name in self.GRID_ARRAYS:
+            grid[name] = getattr(self, name)
+
+        return grid
+
+    #---------------------------------------------------------------------------
+    def Build_Grid(self, cell_size=None):
+        """
+        FUNCTION:
+          To list every parcel in the grid cells its bounding box touches,
+          sorted by cell.
+        """
+
+        # The parcels with no edges are left out of the grid
+        has_bbox = ~np.isnan(self.bboxes).any(axis=1)
+        bboxes = np.where(has_bbox[:, np.newaxis], self.bboxes, 0.0)
+        xmin, ymin, xmax, ymax = bboxes.T
+
+        if cell_size == None:
+            sizes = np.maximum(xmax - xmin, ymax - ymin)[has_bbox]
+            cell_size = 2 * float(np.median(sizes)) if len(sizes) else 1.0
+        if not cell_size > 0:
+            cell_size = 1.0
+
+        self.cell_size = cell_size
+        self.origin_x  = float(xmin[has_bbox].min()) if has_bbox.any() else 0.0
+        self.origin_y  = float(ymin[has_bbox].min()) if has_bbox.any() else 0.0
+
+        ix0, iy0 = self.Get_Cell_XY(xmin, ymin)
+        ix1, iy1 = self.Get_Cell_XY(xmax, ymax)
+        ix0, iy0 = np.maximum(ix0, 0), np.maximum(iy0, 0)
+        ix1, iy1 = np.maximum(ix1, ix0), np.maximum(iy1, iy0)
+        self.num_columns = int(ix1.max()) + 1 if len(ix1) else 1
+
+        widths = ix1 - ix0 + 1
+        spans  = np.where(has_bbox, widths * (iy1 - iy0 + 1), 0)
+
+        # The parcels in too many cells are checked by their bounding box
+        is_large = spans > MAX_CELLS_PER_PARCEL
+        self.large_parcels = np.nonzero(is_large)[0]
+        spans = np.where(is_large, 0, spans)
+
+        # One entry per parcel per cell
+        parcel_ids = np.repeat(np.arange(self.num_parcels), spans)
+        starts     = np.cumsum(spans) - spans
+        position   = np.arange(len(parcel_ids)) - np.repeat(starts, spans)
+        cell_x     = np.repeat(ix0, spans) + position % np.repeat(widths, spans)
+        cell_y     = np.repeat(iy0, spans) + position // np.repeat(widths, spans)
+        cells      = cell_y * self.num_columns + cell_x
+
+        order = np.argsort(cells, kind='mergesort')
+        self.grid_cells   = cells[order]
+        self.grid_parcels = parcel_ids[order]
+
+    #---------------------------------------------------------------------------
+    def Get_Cell_XY(self, x, y):
+        """
+        RETURNS:
+          cell_x, cell_y (numpy int64 arrays): The grid column and row of the
+            coordinates.
+        """
+
+        cell_x = np.floor((np.asarray(x, dtype='<f8') - self.origin_x) / self.cell_size).astype('<i8')
+        cell_y = np.floor((np.asarray(y, dtype='<f8') - self.origin_y) / self.cell_size).astype('<i8')
+        return cell_x, cell_y
+
+    #---------------------------------------------------------------------------
+    def Get_Candidates(self, x, y, tolerance=0.0):
+        """
+        RETURNS:
+          candidates (numpy array): The parcels (indexes into keys) whose
+            bounding box, grown by 'tolerance', has the point in it.
+        """
+
+        candidates = []
+        cell_x, cell_y = self.Get_Cell_XY([x - tolerance, x + tolerance], [y - tolerance, y + tolerance])
+        for row in range(max(cell_y[0], 0), cell_y[1] + 1):
+            for column in range(max(cell_x[0], 0), min(cell_x[1], self.num_columns - 1) + 1):
+                cell = row * self.num_columns + column
+                low, high = np.searchsorted(self.grid_cells, [cell, cell + 1])
+                candidates.append(self.grid_parcels[low:high])
+        candidates.append(self.large_parcels)
+
+        candidates = np.unique(np.concatenate(candidates))
+
+        bboxes = self.bboxes[candidates]
+        in_bbox = ((bboxes[:, 0] - tolerance <= x) & (x <= bboxes[:, 2] + tolerance) &
+                   (bboxes[:, 1] - tolerance <= y) & (y <= bboxes[:, 3] + tolerance))
+
+        return candidates[in_bbox]
+
+    #---------------------------------------------------------------------------
+    def Contains(self, parcel, x, y, tolerance=0.0):
+        """
+        RETURNS:
+          contains (bool): True if the point is in the parcel or within
+            'tolerance' of its boundary.
+        """
+
+        first_ring, end_ring = self.parcel_offsets[parcel], self.parcel_offsets[parcel + 1]
+        start, end = self.ring_offsets[first_ring], self.ring_offsets[end_ring]
+        xs, ys = self.x[start:end], self.y[start:end]
+
+        # The edges, without the ones from the end of a ring to the next ring
+        x1, y1, x2, y2 = xs[:-1], ys[:-1], xs[1:], ys[1:]
+        if end_ring - first_ring > 1:
+            keep = np.ones(len(x1), dtype=bool)
+            keep[self.ring_offsets[first_ring + 1:end_ring] - start - 1] = False
+            x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+
+        # Even-odd rule: count the edges crossed by a ray from the point to +x
+        crosses = (y1 > y) != (y2 > y)
+        if crosses.any():
+            x1c, y1c, x2c, y2c = x1[crosses], y1[crosses], x2[crosses], y2[crosses]
+            x_at_y = x1c + (y - y1c) * (x2c - x1c) / (y2c - y1c)
+            if np.count_nonzero(x < x_at_y) % 2 == 1:
+                return True
+
+        # On the boundary
+        dx, dy = x2 - x1, y2 - y1
+        length_2 = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(length_2 > 0, ((x - x1) * dx + (y - y1) * dy) / length_2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distance_2 = (x1 + t * dx - x) ** 2 + (y1 + t * dy - y) ** 2
+
+        return bool((distance_2 <= tolerance * tolerance).any())
+
+    #---------------------------------------------------------------------------
+    def Query(self, x, y, tolerance=0.0):
+        """
+        RETURNS:
+          parcels (list of int): The parcels (indexes into keys) the point is
+            in, in the order of the parcels.
+        """
+
+        if x == None or y == None or self.num_parcels == 0:
+            return []
+
+        return [int(parcel) for parcel in self.Get_Candidates(x, y, tolerance)
+                if self.Contains(parcel, x, y, tolerance)]
+
+    #---------------------------------------------------------------------------
+    def Get_Key(self, parcel):
+        """
+        RETURNS:
+          key: The key of a parcel (a plain Python value, even if the keys
+            are a NumPy array).
+        """
+
+        key = self.keys[parcel]
+        return key.item() if hasattr(key, 'item') else key
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Build_Parcel_Index()
+def Build_Parcel_Index(parcels, cell_size=None):
+    """
+    PARAMETERS:
+      parcels (iterable): (key, rings) for each parcel.  See Pack_Parcels().
+      cell_size {float}: See Parcel_Index. OPTIONAL.
+
+    RETURNS:
+      index (Parcel_Index): The index of the parcels.
+    """
+
+    keys, x, y, ring_offsets, parcel_offsets = Pack_Parcels(parcels)
+
+    return Parcel_Index(keys, x, y, ring_offsets, parcel_offsets, cell_size=cell_size)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                            FUNCTION Pack_Parcels()
+def Pack_Parcels(parcels):
+    """
+    PARAMETERS:
+      parcels (iterable): (key, rings) for each parcel.  'rings' is a list of
+        rings, each a list of [x, y] (like the 'rings' of an esri JSON
+        polygon).  The outer rings and the holes can be in any order and
+        direction, and a ring doesn't have to be closed.
+
+    RETURNS:
+      keys (list), x (numpy array), y (numpy array), ring_offsets (numpy
+        array), parcel_offsets (numpy array): The parcels packed into the
+        arrays of a Parcel_Index.
+    """
+
+    keys = []
+    xs = []
+    ys = []
+    ring_offsets = [0]
+    parcel_offsets = [0]
+
+    for key, rings in parcels:
+        keys.append(key)
+        for ring in rings or []:
+            if len(ring) < 3:
+                continue
+            xs.extend(point[0] for point in ring)
+            ys.extend(point[1] for point in ring)
+            if ring[0][0] != ring[-1][0] or ring[0][1] != ring[-1][1]:
+                xs.append(ring[0][0])
+                ys.append(ring[0][1])
+            ring_offsets.append(len(xs))
+        parcel_offsets.append(len(ring_offsets) - 1)
+
+    return (keys, np.array(xs, dtype='<f8'), np.array(ys, dtype='<f8'),
+            np.array(ring_offsets, dtype='<i8'), np.array(parcel_offsets, dtype='<i8'))
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                         FUNCTION Get_Bounding_Boxes()
+def Get_Bounding_Boxes(x, y, ring_offsets, parcel_offsets):
+    """
+    RETURNS:
+      bboxes (numpy array): (number of parcels, 4) array of the xmin, ymin,
+        xmax, ymax of the vertices of each parcel.  A parcel with no rings
+        gets an empty box (NaN) that no point is in.
+    """
+
+    num_parcels = len(parcel_offsets) - 1
+    bboxes = np.full((num_parcels, 4), np.nan)
+    if len(x) == 0:
+        return bboxes
+
+    vertex_offsets = ring_offsets[parcel_offsets]
+    has_rings = vertex_offsets[1:] > vertex_offsets[:-1]
+    starts = vertex_offsets[:-1][has_rings]
+
+    bboxes[has_rings, 0] = np.minimum.reduceat(x, starts)
+    bboxes[has_rings, 1] = np.minimum.reduceat(y, starts)
+    bboxes[has_rings, 2] = np.maximum.reduceat(x, starts)
+    bboxes[has_rings, 3] = np.maximum.reduceat(y, starts)
+
+    return bboxes
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                            FUNCTION Join_Points()
+def Join_Points(points, index, tolerance=0.0):
+    """
+    PARAMETERS:
+      points (iterable): (key, x, y) for each point.  x and y are None for a
+        point with no geometry.
+      index (Parcel_Index): The parcels.
+      tolerance {float}: A point this close to the boundary of a parcel is
+        in the parcel (use the XY tolerance of the data). OPTIONAL.
+
+    RETURNS:
+      rows (list of tuple): (point key, parcel key) for every parcel each
+        point is in, and (point key, None) for a point that isn't in any
+        parcel, in the order of the points (see the top of this file).
+    """
+
+    rows = []
+    for key, x, y in points:
+        parcels = index.Query(x, y, tolerance)
+        if parcels:
+            rows.extend((key, index.Get_Key(parcel)) for parcel in parcels)
+        else:
+            rows.append((key, None))
+
+    return rows
@@ -0,0 +1,177 @@
+#-------------------------------------------------------------------------------
+# Name:        conftest.py
+# Purpose:
+"""
+pytest fixtures shared by the tests of the DA modules.
+
+The tests run on any system with Python 2.7, NumPy and pytest, without
+arcpy and without the network:
+    python -m pytest tests
+
+'feature_server' is a stand-in for an AGOL FeatureServer on 127.0.0.1.  It
+answers the requests the DA modules send (generateToken, the layer info and
+'/query' by OBJECTIDs) from a list of point features held in memory.
+"""
+#-------------------------------------------------------------------------------
+
+import BaseHTTPServer, SocketServer, json, os, sys, threading, time, urlparse
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import DA_HTTP_Client
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                       CLASS Stand_In_Feature_Server()
+class Stand_In_Feature_Server(object):
+    """
+    A FeatureServer with one point layer, served from a thread.
+    """
+
+    def __init__(self, object_ids, max_record_count=1000):
+        """
+        PARAMETERS:
+          object_ids (list of int): The OBJECTIDs of the features.
+          max_record_count (int): The 'maxRecordCount' of the layer.
+        """
+
+        self.features = dict((object_id, {'attributes': {'OBJECTID'     : object_id,
+                                                         'ReportNumber' : '2018{:05d}.1'.format(object_id)},
+                                          'geometry'  : {'x': 6400000.0 + object_id, 'y': 1900000.0 + object_id}})
+                             for object_id in object_ids)
+        self.max_record_count = max_record_count
+
+        self.cap           = None  # Sends fewer features than maxRecordCount
+        self.fail_requests = 0     # The number of queries to answer with a 503
+        self.requests      = []    # (path, params) of every request
+        self.lock          = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.Handle(self)
+
+            def do_POST(self):
+                server.Handle(self)
+
+        self.httpd = Stand_In_HTTP_Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.url = 'http://127.0.0.1:{}/arcgis/rest/services/Test/FeatureServer'.format(self.httpd.server_address[1])
+        self.query_url = self.url + '/0/query'
+        self.token_url = 'http://127.0.0.1:{}/sharing/rest/generateToken'.format(self.httpd.server_address[1])
+
+    #---------------------------------------------------------------------------
+    def Handle(self, handler):
+        """
+        FUNCTION:
+          To answer one request.
+        """
+
+        parts = urlparse.urlsplit(handler.path)
+        params = dict(urlparse.parse_qsl(parts.query))
+        if handler.command == 'POST':
+            length = int(handler.headers.get('content-length', 0))
+            params.update(dict(urlparse.parse_qsl(handler.rfile.read(length))))
+
+        with self.lock:
+            self.requests.append((parts.path, params))
+
+        if parts.path.endswith('/generateToken'):
+            expires = int((time.time() + 120 * 60) * 1000)
+            return self.Send(handler, 200, {'token': 'live-token-{}'.format(len(self.requests)), 'expires': expires})
+
+        if parts.path.endswith('/FeatureServer'):
+            return self.Send(handler, 200, {'maxRecordCount': self.max_record_count, 'layers': [{'id': 0}]})
+
+        if parts.path.endswith('/query'):
+            with self.lock:
+                if self.fail_requests > 0:
+                    self.fail_requests -= 1
+                    return self.Send(handler, 503, {})
+
+            object_ids = sorted(self.features)
+            if params.get('objectIds'):
+                wanted = set(int(object_id) for object_id in params['objectIds'].split(','))
+                object_ids = [object_id for object_id in object_ids if object_id in wanted]
+
+            if params.get('returnIdsOnly') == 'true':
+                return self.Send(handler, 200, {'objectIdFieldName': 'OBJECTID', 'objectIds': object_ids})
+
+            cap = min(self.max_record_count, self.cap or self.max_record_count)
+            response = {'objectIdFieldName' : 'OBJECTID',
+                        'geometryType'      : 'esriGeometryPoint',
+                        'spatialReference'  : {'wkid': 2229},
+                        'features'          : [self.features[object_id] for object_id in object_ids[:cap]]}
+            if len(object_ids) > cap:
+                response['exceededTransferLimit'] = True
+            return self.Send(handler, 200, response)
+
+        return self.Send(handler, 200, {'error': {'code': 400, 'message': 'Invalid URL'}})
+
+    #---------------------------------------------------------------------------
+    def Send(self, handler, status, response_json):
+        body = json.dumps(response_json)
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    #---------------------------------------------------------------------------
+    def Num_Requests(self, path_end=''):
+        """
+        RETURNS:
+          The number of requests to a path that ends with 'path_end'.
+        """
+
+        with self.lock:
+            return len([path for path, params in self.requests if path.endswith(path_end)])
+
+    #---------------------------------------------------------------------------
+    def Close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class Stand_In_HTTP_Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                                  Fixtures
+
+@pytest.fixture
+def http_client(monkeypatch):
+    """
+    A new shared DA_HTTP_Client with no cache and no proxy.
+    """
+
+    for name in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+
+    DA_HTTP_Client.Set_Cache(None)
+    client = DA_HTTP_Client.Configure(timeout=10)
+    yield client
+    client.Close()
+    DA_HTTP_Client.Set_Cache(None)
+
+@pytest.fixture
+def feature_server(http_client):
+    """
+    A stand-in FeatureServer with 2500 features whose OBJECTIDs have gaps.
+    """
+
+    server = Stand_In_Feature_Server(range(1, 10000, 4))
+    yield server
+    http_client.Close()
+    server.Close()
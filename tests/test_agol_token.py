@@ -0,0 +1,47 @@
+#-------------------------------------------------------------------------------
+# Name:        test_agol_token.py
+# Purpose:
+"""
+Tests of the token cache of DA_AGOL_Token.py, with the stand-in
+FeatureServer's generateToken (see conftest.py).
+"""
+#-------------------------------------------------------------------------------
+
+import os, stat
+
+import pytest
+
+import DA_AGOL_Token
+
+@pytest.fixture
+def cache_folder(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('profile')))
+    monkeypatch.setattr(DA_AGOL_Token, 'providers', {})
+    return tmpdir.join('profile', 'DA_Scripts')
+
+#-------------------------------------------------------------------------------
+def test_the_cache_is_in_the_profile_of_the_account(feature_server, cache_folder, tmpdir):
+    cfgFile = tmpdir.join('DA_Config.ini')
+    cfgFile.write('[AGOL]\nusr = user\npwd = password\n')
+    tmpdir.join('DA_AGOL_Token_Cache.json').write('{}')
+
+    token = DA_AGOL_Token.Get_Token_Provider(str(cfgFile), feature_server.token_url)
+
+    cache_file = cache_folder.join('DA_AGOL_Token_Cache.dat')
+    assert token.cache_file == str(cache_file)
+    assert cache_file.check()
+    assert stat.S_IMODE(os.stat(str(cache_file)).st_mode) == 0600
+    assert not tmpdir.join('DA_AGOL_Token_Cache.json').check()
+
+def test_the_next_script_reuses_the_cached_token(feature_server, cache_folder):
+    first = DA_AGOL_Token.Token_Provider('user', 'password', feature_server.token_url).Get()
+    second = DA_AGOL_Token.Token_Provider('user', 'password', feature_server.token_url).Get()
+
+    assert first == second
+    assert feature_server.Num_Requests('/generateToken') == 1
+
+def test_another_account_gets_its_own_token(feature_server, cache_folder):
+    DA_AGOL_Token.Token_Provider('user', 'password', feature_server.token_url).Get()
+    DA_AGOL_Token.Token_Provider('other', 'password', feature_server.token_url).Get()
+
+    assert feature_server.Num_Requests('/generateToken') == 2
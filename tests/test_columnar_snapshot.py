@@ -0,0 +1,54 @@
+#-------------------------------------------------------------------------------
+# Name:        test_columnar_snapshot.py
+# Purpose:
+"""
+Tests of the columnar snapshot of DA_Columnar_Snapshot.py and the folder swap
+of DA_File_Utils.py.
+"""
+#-------------------------------------------------------------------------------
+
+import numpy as np
+
+import DA_Columnar_Snapshot
+
+def Get_Pages(report_numbers):
+    fields = [{'name': 'OBJECTID',     'type': 'esriFieldTypeOID'},
+              {'name': 'ReportNumber', 'type': 'esriFieldTypeString'}]
+    features = [{'attributes': {'OBJECTID': object_id, 'ReportNumber': report_number},
+                 'geometry'  : {'x': 6400000.0 + object_id, 'y': 1900000.0}}
+                for object_id, report_number in enumerate(report_numbers, 1)]
+    return [{'fields': fields, 'features': features}]
+
+#-------------------------------------------------------------------------------
+def test_the_strings_come_back_from_the_memory_mapped_table(tmpdir):
+    snapshot_folder = str(tmpdir.join('DA_Fire_Snapshot'))
+    report_numbers = [u'201800001.1', u'2018\xe9002.1', None, u'', u'201800001.1']
+
+    DA_Columnar_Snapshot.Write_Columnar_Snapshot(snapshot_folder, Get_Pages(report_numbers))
+    snapshot = DA_Columnar_Snapshot.Load_Columnar_Snapshot(snapshot_folder)
+
+    assert isinstance(snapshot.strings, DA_Columnar_Snapshot.String_Table)
+    assert not tmpdir.join('DA_Fire_Snapshot', 'Strings.json').check()
+    assert snapshot.Decode('ReportNumber') == report_numbers
+    assert snapshot.Get_Code('ReportNumber', u'2018\xe9002.1') == 1
+
+#-------------------------------------------------------------------------------
+def test_a_new_snapshot_replaces_the_old_one_without_leftovers(tmpdir):
+    snapshot_folder = str(tmpdir.join('DA_Fire_Snapshot'))
+
+    DA_Columnar_Snapshot.Write_Columnar_Snapshot(snapshot_folder, Get_Pages([u'A', u'B']))
+    DA_Columnar_Snapshot.Write_Columnar_Snapshot(snapshot_folder, Get_Pages([u'C', u'C', u'D']))
+    snapshot = DA_Columnar_Snapshot.Load_Columnar_Snapshot(snapshot_folder)
+
+    assert [path.basename for path in tmpdir.listdir()] == ['DA_Fire_Snapshot']
+    assert snapshot.Decode('ReportNumber') == [u'C', u'C', u'D']
+
+#-------------------------------------------------------------------------------
+def test_duplicates_are_found_from_the_codes(tmpdir):
+    snapshot_folder = str(tmpdir.join('DA_Fire_Snapshot'))
+    DA_Columnar_Snapshot.Write_Columnar_Snapshot(snapshot_folder, Get_Pages([u'A', u'B', u'A', u'A', u'C']))
+    snapshot = DA_Columnar_Snapshot.Load_Columnar_Snapshot(snapshot_folder)
+
+    codes, counts = np.unique(np.asarray(snapshot.Column('ReportNumber')), return_counts=True)
+
+    assert [(snapshot.strings[int(code)], count) for code, count in zip(codes, counts) if count > 1] == [(u'A', 3)]
@@ -0,0 +1,85 @@
+#-------------------------------------------------------------------------------
+# Name:        test_download_pages.py
+# Purpose:
+"""
+Tests of the OBJECTID page download of DA_AGOL_Download.py against the
+stand-in FeatureServer (see conftest.py).
+"""
+#-------------------------------------------------------------------------------
+
+import time
+
+import pytest
+
+import DA_AGOL_Download
+
+def Get_Page_OIDs(pages):
+    return [feature['attributes']['OBJECTID'] for page in pages for feature in page['features']]
+
+#-------------------------------------------------------------------------------
+def test_object_ids_and_max_record_count(feature_server):
+    object_ids = DA_AGOL_Download.Get_Object_Ids(feature_server.query_url, 'token')
+
+    assert object_ids == sorted(feature_server.features)
+    assert DA_AGOL_Download.Get_Max_Record_Count(feature_server.url, 'token') == 1000
+
+#-------------------------------------------------------------------------------
+def test_pages_come_back_in_order_with_workers(feature_server):
+    object_ids = sorted(feature_server.features)
+    batches = DA_AGOL_Download.Build_OID_List_Batches(object_ids, 300)
+
+    pages, stats = DA_AGOL_Download.Download_Pages(feature_server.query_url, batches, '*', 'token', num_workers=4)
+
+    assert len(pages) == len(batches) == 9
+    assert Get_Page_OIDs(pages) == object_ids
+    assert stats['pages'] == 9
+    assert stats['features'] == len(object_ids)
+    assert len(stats['page_seconds']) == 9
+
+#-------------------------------------------------------------------------------
+def test_pages_the_server_cuts_short_are_completed(feature_server):
+    feature_server.cap = 120
+    object_ids = sorted(feature_server.features)
+    batches = DA_AGOL_Download.Build_OID_List_Batches(object_ids, 500)
+
+    pages, stats = DA_AGOL_Download.Download_Pages(feature_server.query_url, batches, '*', 'token', num_workers=2)
+
+    assert Get_Page_OIDs(pages) == object_ids
+    assert stats['truncated_pages'] >= 1
+    assert stats['server_cap'] == 120
+    assert all('exceededTransferLimit' not in page for page in pages)
+
+#-------------------------------------------------------------------------------
+def test_a_page_that_fails_for_a_transient_reason_is_tried_again(feature_server):
+    feature_server.fail_requests = 2
+    object_ids = sorted(feature_server.features)
+    batches = DA_AGOL_Download.Build_OID_List_Batches(object_ids, 1000)
+
+    pages, stats = DA_AGOL_Download.Download_Pages(feature_server.query_url, batches, '*', 'token',
+                                                   num_workers=1, backoff_seconds=0)
+
+    assert Get_Page_OIDs(pages) == object_ids
+    assert stats['retries'] == 2
+
+#-------------------------------------------------------------------------------
+def test_a_page_of_other_object_ids_raises_instead_of_asking_forever(feature_server):
+    feature_server.cap = 100
+    for object_id, feature in feature_server.features.items():
+        feature['attributes']['OBJECTID'] = object_id + 1000000
+    batches = DA_AGOL_Download.Build_OID_List_Batches(sorted(feature_server.features)[:500], 500)
+
+    with pytest.raises(Exception) as error:
+        DA_AGOL_Download.Download_Pages(feature_server.query_url, batches, '*', 'token', max_retries=0)
+
+    assert 'none of the 500 OBJECTIDs' in str(error.value)
+    assert feature_server.Num_Requests('/query') == 1
+
+#-------------------------------------------------------------------------------
+def test_page_sizes_with_pages_that_are_too_big_are_not_used(tmpdir):
+    tuning_file = str(tmpdir.join('tuning.json'))
+    DA_AGOL_Download.Write_JSON_File(tuning_file, {'sizes': {
+        '1000': {'features_per_second': 900, 'seconds_per_page': 2, 'kb_per_page': 20000, 'updated': time.time()},
+        '500' : {'features_per_second': 800, 'seconds_per_page': 1, 'kb_per_page': 10000, 'updated': time.time()}}})
+
+    assert DA_AGOL_Download.Choose_Page_Size(tuning_file, 1000) == 250
+    assert DA_AGOL_Download.Choose_Page_Size(tuning_file, 1000, max_page_kb=100000) == 1000
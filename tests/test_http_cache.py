@@ -0,0 +1,70 @@
+#-------------------------------------------------------------------------------
+# Name:        test_http_cache.py
+# Purpose:
+"""
+Tests of the record / replay cache of DA_HTTP_Cache.py, with the shared
+DA_HTTP_Client and the stand-in FeatureServer (see conftest.py).
+"""
+#-------------------------------------------------------------------------------
+
+import json
+
+import pytest
+
+import DA_AGOL_Download
+import DA_HTTP_Cache
+import DA_HTTP_Client
+
+def Set_Mode(cache_folder, mode):
+    cache = DA_HTTP_Cache.Response_Cache(str(cache_folder), mode)
+    DA_HTTP_Client.Set_Cache(cache)
+    return cache
+
+#-------------------------------------------------------------------------------
+def test_replay_hit_sends_no_request(feature_server, tmpdir):
+    params = {'objectIds': '1,5,9', 'outFields': '*', 'f': 'json', 'token': 'recorded-token'}
+
+    Set_Mode(tmpdir, 'RECORD')
+    recorded = DA_AGOL_Download.Get_JSON(feature_server.query_url, params)[0]
+    assert feature_server.Num_Requests('/query') == 1
+
+    # A replay with another token finds the same response
+    cache = Set_Mode(tmpdir, 'REPLAY')
+    params['token'] = 'another-token'
+    replayed = DA_AGOL_Download.Get_JSON(feature_server.query_url, params)[0]
+
+    assert replayed == recorded
+    assert feature_server.Num_Requests('/query') == 1
+    assert cache.stats['replayed'] == 1
+
+#-------------------------------------------------------------------------------
+def test_replay_miss_raises_cache_miss(feature_server, tmpdir):
+    Set_Mode(tmpdir, 'RECORD')
+    DA_AGOL_Download.Get_JSON(feature_server.query_url, {'objectIds': '1', 'f': 'json'})
+
+    cache = Set_Mode(tmpdir, 'REPLAY')
+    with pytest.raises(DA_HTTP_Cache.Cache_Miss):
+        DA_AGOL_Download.Get_JSON(feature_server.query_url, {'objectIds': '5', 'f': 'json'})
+
+    assert feature_server.Num_Requests('/query') == 1
+    assert cache.stats['misses'] == 1
+
+#-------------------------------------------------------------------------------
+def test_the_order_of_the_parameters_does_not_change_the_key(tmpdir):
+    cache = DA_HTTP_Cache.Response_Cache(str(tmpdir), 'RECORD')
+
+    key_1 = cache.Get_Key('POST', 'https://Host/query?f=json', [('a', '1'), ('b', '2'), ('token', 'x')])[0]
+    key_2 = cache.Get_Key('post', 'https://host/query', [('b', '2'), ('f', 'json'), ('a', '1')])[0]
+
+    assert key_1 == key_2
+
+#-------------------------------------------------------------------------------
+def test_a_recorded_token_is_scrubbed(feature_server, tmpdir):
+    Set_Mode(tmpdir, 'RECORD')
+    token_json = DA_HTTP_Client.Get_Client().Get_JSON(feature_server.token_url, {'username': 'u', 'password': 'p'})[0]
+    assert token_json['token'].startswith('live-token')
+
+    bodies = [path.read() for path in tmpdir.listdir() if path.ext == '.body']
+    assert len(bodies) == 1
+    assert json.loads(bodies[0])['token'] == DA_HTTP_Cache.SCRUBBED_TOKEN
+    assert 'live-token' not in bodies[0]
@@ -0,0 +1,118 @@
+#-------------------------------------------------------------------------------
+# Name:        test_http_client.py
+# Purpose:
+"""
+Tests of the reused keep-alive connections and the proxies of
+DA_HTTP_Client.py.
+"""
+#-------------------------------------------------------------------------------
+
+import httplib, socket, threading, time
+
+import pytest
+
+import DA_HTTP_Client
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+#                        CLASS Drop_After_First_Server()
+class Drop_After_First_Server(object):
+    """
+    An HTTP server on 127.0.0.1 that answers the first request on a
+    connection and keeps it open, then reads the second request on it and
+    closes the connection without an answer, like a server that timed out
+    the idle connection while the request was on the way.
+    """
+
+    def __init__(self):
+        self.requests = []  # The request line of every request read
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.url = 'http://127.0.0.1:{}/query'.format(self.listener.getsockname()[1])
+
+        self.thread = threading.Thread(target=self.Serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Serve(self):
+        while True:
+            try:
+                connection = self.listener.accept()[0]
+            except socket.error:
+                return
+            reader = connection.makefile('rb')
+            for request_num in range(2):
+                request_line = reader.readline()
+                if not request_line:
+                    break
+                self.requests.append(request_line.split(' ')[0])
+                length = 0
+                for header in iter(reader.readline, '\r\n'):
+                    if header.lower().startswith('content-length:'):
+                        length = int(header.split(':')[1])
+                reader.read(length)
+                if request_num == 0:
+                    connection.sendall('HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                                       'Content-Length: 2\r\n\r\n{}')
+            reader.close()
+            connection.close()
+
+    def Close(self):
+        self.listener.close()
+
+@pytest.fixture
+def drop_server(http_client):
+    server = Drop_After_First_Server()
+    yield server
+    http_client.Close()
+    server.Close()
+
+#-------------------------------------------------------------------------------
+def Use_Connection_Once(client, server, monkeypatch):
+    """
+    FUNCTION:
+      To send one request so the connection goes back to the pool, and turn
+      off the check for connections closed by the server, so the next
+      request is sent on that connection.
+    """
+
+    client.Get_JSON(server.url, {'f': 'json'}, method='GET')
+    monkeypatch.setattr(DA_HTTP_Client, 'Is_Closed_By_Server', lambda connection: False)
+
+def test_a_post_is_not_sent_again_on_a_new_connection(drop_server, http_client, monkeypatch):
+    Use_Connection_Once(http_client, drop_server, monkeypatch)
+
+    with pytest.raises((httplib.HTTPException, socket.error)):
+        http_client.Get_JSON(drop_server.url, {'f': 'json', 'features': '[]'}, method='POST')
+
+    assert drop_server.requests == ['GET', 'POST']
+
+def test_a_get_is_sent_again_on_a_new_connection(drop_server, http_client, monkeypatch):
+    Use_Connection_Once(http_client, drop_server, monkeypatch)
+
+    assert http_client.Get_JSON(drop_server.url, {'f': 'json'}, method='GET')[0] == {}
+    assert drop_server.requests == ['GET', 'GET', 'GET']
+
+def test_an_idle_connection_the_server_closed_is_not_used(drop_server, http_client):
+    http_client.Get_JSON(drop_server.url, {'f': 'json'}, method='GET')
+    connection = http_client.idle_connections.values()[0][0]
+    connection.sock.shutdown(socket.SHUT_WR)  # The server reads the end and closes its side
+    time.sleep(0.2)
+
+    assert http_client.Get_JSON(drop_server.url, {'f': 'json', 'features': '[]'}, method='POST')[0] == {}
+    assert http_client.stats['connections_reused'] == 0
+
+#-------------------------------------------------------------------------------
+def test_each_scheme_uses_its_own_proxy():
+    client = DA_HTTP_Client.HTTP_Client(proxies={'http': 'http://u:p@proxy1:8080', 'https': 'http://proxy2:8081'})
+
+    http_key, http_path, http_headers = client.Parse_Url('http://example.com/a?b=1')
+    https_key, https_path, https_headers = client.Parse_Url('https://example.com/a')
+
+    assert http_key[3] == 'http://u:p@proxy1:8080'
+    assert http_path == 'http://example.com:80/a?b=1'
+    assert 'Proxy-Authorization' in http_headers
+    assert https_key[3] == 'http://proxy2:8081'
+    assert https_path == '/a'
+    assert client.Get_Proxy_Url('ftp', 'example.com') == None
@@ -0,0 +1,144 @@
+#-------------------------------------------------------------------------------
+# Name:        test_spatial_join.py
+# Purpose:
+"""
+Tests of the point in parcel join of DA_Spatial_Join.py and of the parcel
+store of DA_Parcel_Store.py (the parallel and the incremental join).
+"""
+#-------------------------------------------------------------------------------
+
+import random
+
+import pytest
+
+import DA_Parcel_Store
+import DA_Spatial_Join
+
+def Square(xmin, ymin, size):
+    return [[xmin, ymin], [xmin, ymin + size], [xmin + size, ymin + size], [xmin + size, ymin], [xmin, ymin]]
+
+def Get_Block_Parcels(num_columns, num_rows, size=10.0):
+    """
+    RETURNS:
+      parcels (list): (OBJECTID, rings, [APN]) of a block of square parcels,
+        each with a square hole in the middle of it.
+    """
+
+    parcels = []
+    for row in range(num_rows):
+        for column in range(num_columns):
+            oid = row * num_columns + column + 1
+            xmin, ymin = column * size, row * size
+            rings = [Square(xmin, ymin, size), Square(xmin + size * 0.4, ymin + size * 0.4, size * 0.2)]
+            parcels.append((oid, rings, ['APN{:05d}'.format(oid)]))
+    return parcels
+
+def Get_Random_Points(num_points, max_xy, seed=0):
+    generator = random.Random(seed)
+    return [(key, generator.uniform(-5.0, max_xy + 5.0), generator.uniform(-5.0, max_xy + 5.0))
+            for key in range(num_points)]
+
+@pytest.fixture
+def block_store(tmpdir):
+    store_folder = str(tmpdir.join('DA_Parcel_Cache_Store'))
+    DA_Parcel_Store.Write_Parcel_Store(store_folder, Get_Block_Parcels(20, 20), ['APN'], generation='1')
+    return store_folder
+
+#-------------------------------------------------------------------------------
+def test_a_point_in_a_hole_is_not_in_the_parcel():
+    index = DA_Spatial_Join.Build_Parcel_Index([('A', [Square(0, 0, 10), Square(4, 4, 2)])])
+
+    rows = DA_Spatial_Join.Join_Points([(1, 2.0, 2.0), (2, 5.0, 5.0), (3, 4.0, 5.0), (4, 15.0, 5.0), (5, None, None)], index)
+
+    assert rows == [(1, 'A'), (2, None), (3, 'A'), (4, None), (5, None)]
+
+def test_a_point_on_a_stacked_parcel_gets_a_row_for_each_parcel():
+    index = DA_Spatial_Join.Build_Parcel_Index([('A', [Square(0, 0, 10)]),
+                                                ('B', [Square(0, 0, 10)]),
+                                                ('C', [Square(20, 0, 10)])])
+
+    assert DA_Spatial_Join.Join_Points([(1, 5.0, 5.0), (2, 25.0, 5.0)], index) == [(1, 'A'), (1, 'B'), (2, 'C')]
+
+def test_a_point_on_a_boundary_is_in_every_parcel_it_touches():
+    index = DA_Spatial_Join.Build_Parcel_Index([('A', [Square(0, 0, 10)]), ('B', [Square(10, 0, 10)])])
+
+    rows = DA_Spatial_Join.Join_Points([(1, 10.0, 5.0), (2, 0.0, 0.0), (3, 20.0005, 5.0)], index, tolerance=0.001)
+
+    assert rows == [(1, 'A'), (1, 'B'), (2, 'A'), (3, 'B')]
+    assert DA_Spatial_Join.Join_Points([(3, 20.0005, 5.0)], index) == [(3, None)]
+
+def test_the_grid_finds_the_parcel_of_every_point():
+    parcels = [(oid, rings) for oid, rings, values in Get_Block_Parcels(30, 30)]
+    index = DA_Spatial_Join.Build_Parcel_Index(parcels)
+
+    for key, x, y in Get_Random_Points(2000, 300.0):
+        expected = []
+        column, row = int(x // 10), int(y // 10)
+        in_hole = 4.0 < x % 10 < 6.0 and 4.0 < y % 10 < 6.0
+        if 0 <= column < 30 and 0 <= row < 30 and not in_hole:
+            expected = [row * 30 + column + 1]
+        assert [index.Get_Key(parcel) for parcel in index.Query(x, y)] == expected
+
+#-------------------------------------------------------------------------------
+def test_the_store_joins_like_the_index_it_was_made_from(block_store):
+    parcels = Get_Block_Parcels(20, 20)
+    index = DA_Spatial_Join.Build_Parcel_Index([(oid, rings) for oid, rings, values in parcels])
+    store = DA_Parcel_Store.Load_Parcel_Store(block_store)
+    points = Get_Random_Points(300, 200.0)
+
+    assert DA_Spatial_Join.Join_Points(points, store.Get_Index()) == DA_Spatial_Join.Join_Points(points, index)
+    assert store.Get_Value('APN', 41) == u'APN00042'
+
+def test_the_parallel_join_gives_the_rows_of_the_serial_join(block_store, monkeypatch):
+    monkeypatch.setattr(DA_Parcel_Store, 'MIN_POINTS_PER_PROCESS', 100)
+    points = Get_Random_Points(2000, 200.0) + [(2000, None, None)]
+    serial = DA_Spatial_Join.Join_Points(points, DA_Parcel_Store.Load_Parcel_Store(block_store).Get_Index())
+
+    assert DA_Parcel_Store.Join_Points_Parallel(block_store, points, processes=3) == serial
+
+#-------------------------------------------------------------------------------
+def test_a_rerun_reuses_the_parcels_of_the_reports_that_did_not_move(block_store):
+    store = DA_Parcel_Store.Load_Parcel_Store(block_store)
+    points = Get_Random_Points(200, 200.0)
+    report_numbers = ['2018{:05d}.1'.format(key) for key, x, y in points]
+
+    first_rows, assignments, counts = DA_Parcel_Store.Join_Points_Incremental(store, points, report_numbers)
+    assert counts == {'joined': 200, 'reused': 0}
+
+    # One report moved
+    points[7] = (7, 52.0, 52.0)
+    rows, assignments, counts = DA_Parcel_Store.Join_Points_Incremental(store, points, report_numbers, assignments)
+
+    assert counts == {'joined': 1, 'reused': 199}
+    assert rows == DA_Spatial_Join.Join_Points(points, store.Get_Index())
+    assert (7, 106) in rows
+
+def test_a_rerun_joins_again_the_reports_on_a_new_or_remade_parcel(block_store):
+    store = DA_Parcel_Store.Load_Parcel_Store(block_store)
+    points = [(1, 12.0, 12.0), (2, 162.0, 2.0)]
+    report_numbers = ['201800001.1', '201800002.1']
+    rows, assignments, counts = DA_Parcel_Store.Join_Points_Incremental(store, points, report_numbers)
+
+    # Parcel 17 is edited (deleted and added again with a new OBJECTID)
+    parcels = Get_Block_Parcels(20, 20)
+    parcels[16] = (401, parcels[16][1], parcels[16][2])
+    DA_Parcel_Store.Write_Parcel_Store(block_store, parcels, ['APN'], generation='1')
+    store = DA_Parcel_Store.Load_Parcel_Store(block_store)
+    rows, assignments, counts = DA_Parcel_Store.Join_Points_Incremental(store, points, report_numbers, assignments)
+
+    assert counts == {'joined': 1, 'reused': 1}
+    assert rows == [(1, 22), (2, 401)]
+
+    # The FC was made again, so no OBJECTID can be trusted
+    DA_Parcel_Store.Write_Parcel_Store(block_store, parcels, ['APN'], generation='2')
+    store = DA_Parcel_Store.Load_Parcel_Store(block_store)
+    rows, assignments, counts = DA_Parcel_Store.Join_Points_Incremental(store, points, report_numbers, assignments)
+
+    assert counts == {'joined': 2, 'reused': 0}
+
+#-------------------------------------------------------------------------------
+def test_a_new_store_replaces_the_old_one_without_leftovers(block_store, tmpdir):
+    DA_Parcel_Store.Write_Parcel_Store(block_store, Get_Block_Parcels(2, 1), ['APN'], generation='2')
+
+    assert [path.basename for path in tmpdir.listdir()] == ['DA_Parcel_Cache_Store']
+    assert DA_Parcel_Store.Load_Parcel_Store(block_store).num_parcels == 2